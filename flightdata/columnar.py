@@ -0,0 +1,141 @@
+# helpers for the columnar (struct-of-arrays) flight data layout
+#
+# The default loader output is a dict of channels where each channel is a
+# list of per-sample dicts.  In the columnar layout each channel is instead
+# a dict of field name -> contiguous numpy array, all arrays in a channel
+# sharing the same length and the same time vector ("time" or "timestamp"
+# depending on the format.)
+
+import numpy as np
+
+time_keys = ["time", "timestamp"]
+
+# return the name of the time field of a channel (records or columns)
+def time_key(channel):
+    if isinstance(channel, dict):
+        keys = channel.keys()
+    elif len(channel):
+        keys = channel[0].keys()
+    else:
+        return None
+    for key in time_keys:
+        if key in keys:
+            return key
+    return None
+
+# number of samples in a channel (records or columns)
+def size(channel):
+    if isinstance(channel, dict):
+        for key in channel:
+            return len(channel[key])
+        return 0
+    return len(channel)
+
+# convert a list of record dicts into a dict of numpy arrays.  Fields that
+# are missing from some records are filled with nan.
+def records_to_columns(records):
+    keys = {}
+    for record in records:
+        for key in record:
+            keys[key] = True
+    columns = {}
+    for key in keys:
+        columns[key] = np.array([record.get(key, np.nan) for record in records])
+    return columns
+
+# convert a dict of numpy arrays back into a list of record dicts
+def columns_to_records(columns):
+    keys = list(columns.keys())
+    if not len(keys):
+        return []
+    values = [np.asarray(columns[key]).tolist() for key in keys]
+    return [dict(zip(keys, row)) for row in zip(*values)]
+
+# convert a whole flight (dict of channels) to the columnar layout
+def flight_to_columns(flight_data):
+    result = {}
+    for key in flight_data:
+        channel = flight_data[key]
+        if isinstance(channel, dict):
+            result[key] = channel
+        else:
+            result[key] = records_to_columns(channel)
+    return result
+
+# convert a whole flight (dict of channels) to the record layout
+def flight_to_records(flight_data):
+    result = {}
+    for key in flight_data:
+        channel = flight_data[key]
+        if isinstance(channel, dict):
+            result[key] = columns_to_records(channel)
+        else:
+            result[key] = channel
+    return result
+
+# select a subset of samples (index array, slice, or boolean mask) from
+# every field of a columnar channel
+def select(columns, index):
+    result = {}
+    for key in columns:
+        result[key] = columns[key][index]
+    return result
+
+# iterate over a channel (records or columns) in chunks of up to
+# chunk_size samples.  Columnar chunks are slices (views) of the channel arrays, so
+# with memory mapped arrays (e.g. from flight_cache) only the current chunk
+# is ever read into memory.
+def iter_chunks(channel, chunk_size=10000):
+    for start in range(0, size(channel), chunk_size):
+        if isinstance(channel, dict):
+            yield select(channel, slice(start, start + chunk_size))
+        else:
+            yield channel[start:start + chunk_size]
+
+# find the index range of the samples inside time_range = (t0, t1) using a
+# binary search on a sorted time sequence.  times may be a numpy array or
+# an h5py dataset (in which case only ~2*log2(N) elements are read from the
+# file.)  scale converts the stored values to seconds (e.g. 0.001 for
+# millis.)  Returns a slice usable on every field of the channel.
+def time_slice(times, time_range, scale=1.0):
+    if time_range is None:
+        return slice(None)
+    t0, t1 = time_range
+    def value(i):
+        return float(np.asarray(times[i]).flat[0]) * scale
+    def search(t, right):
+        lo = 0
+        hi = len(times)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            v = value(mid)
+            if v < t or (right and v == t):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+    return slice(search(t0, False), search(t1, True))
+
+# keep only the samples of a channel (records or columns) inside
+# time_range = (t0, t1)
+def clip_time(channel, time_range):
+    if time_range is None:
+        return channel
+    t0, t1 = time_range
+    key = time_key(channel)
+    if key is None:
+        return channel
+    if isinstance(channel, dict):
+        t = np.asarray(channel[key])
+        return select(channel, (t >= t0) & (t <= t1))
+    else:
+        return [ r for r in channel if r[key] >= t0 and r[key] <= t1 ]
+
+# clip every channel of a flight to time_range = (t0, t1)
+def clip_flight(flight_data, time_range):
+    if time_range is None:
+        return flight_data
+    result = {}
+    for key in flight_data:
+        result[key] = clip_time(flight_data[key], time_range)
+    return result
@@ -0,0 +1,278 @@
+# persistent on-disk cache of converted flight logs
+#
+# Parsing the original log (csv, .log, .ulg, .mat, .pkl) can take a long
+# time.  A FlightCache stores the normalized loader output in columnar form,
+# one .npy file per channel field, so the next load of the same flight is a
+# memory mapped read:
+#
+#   cache = flight_cache.FlightCache()
+#   data, flight_format = flight_loader.load(path, cache=cache)
+#
+# An entry is keyed by the absolute source path and is only used while the
+# source size + mtime (and optionally a content hash) and the source code
+# of the loader module and the flightdata modules it uses all still match,
+# so edits to either the log or the loader code automatically refresh the
+# entry.  The total cache size is capped and the least recently used
+# flights are evicted first.
+
+import hashlib
+import importlib
+import json
+import os
+import shutil
+import sys
+import types
+
+import numpy as np
+
+from . import columnar
+
+# bump when the on-disk entry layout changes
+cache_version = 1
+
+default_dir = os.path.join(os.path.expanduser("~"), ".cache", "flightdata")
+default_max_bytes = 4 * 1024 * 1024 * 1024
+
+# sha1 of the file contents
+def file_hash(filename, blocksize=1024*1024):
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+# identity of a log file or log directory: size and mtime of every file
+# (plus a content hash of every file if hash_content is set)
+def source_signature(path, hash_content=False):
+    if os.path.isdir(path):
+        names = sorted(os.listdir(path))
+        files = [ os.path.join(path, n) for n in names ]
+        files = [ f for f in files if os.path.isfile(f) ]
+    else:
+        files = [ path ]
+    result = []
+    for f in files:
+        st = os.stat(f)
+        entry = [ os.path.basename(f), st.st_size, st.st_mtime_ns ]
+        if hash_content:
+            entry.append(file_hash(f))
+        result.append(entry)
+    return result
+
+# the modules of the same package a module uses (itself included): every
+# module, function or class it references from the package, followed
+# recursively.  Packages (e.g. flightdata.formats) only add their own
+# __init__, not all the submodules they hold.  Returns {name: module}.
+def module_dependencies(module, found=None):
+    if found is None:
+        found = {}
+    found[module.__name__] = module
+    if hasattr(module, "__path__"):
+        return found
+    package = module.__name__.split(".")[0]
+    for value in list(vars(module).values()):
+        if isinstance(value, types.ModuleType):
+            dep = value
+        else:
+            name = getattr(value, "__module__", None)
+            if not isinstance(name, str):
+                continue
+            dep = sys.modules.get(name)
+        if dep is None or dep.__name__ in found \
+           or getattr(dep, "__file__", None) is None:
+            continue
+        if dep.__name__ == package or dep.__name__.startswith(package + "."):
+            module_dependencies(dep, found)
+    return found
+
+# version stamp of a loader: the hash of its module source and of the
+# sources of the package modules it depends on (columnar, shared readers
+# and kernels, ...), so editing any of them refreshes the cached flights
+def loader_version(module_name):
+    module = importlib.import_module(module_name)
+    h = hashlib.sha1()
+    for name, dep in sorted(module_dependencies(module).items()):
+        h.update(name.encode("utf-8"))
+        h.update(file_hash(dep.__file__).encode("utf-8"))
+    return h.hexdigest()
+
+class FlightCache():
+    def __init__(self, cache_dir=None, max_bytes=default_max_bytes,
+                 hash_content=False):
+        if cache_dir is None:
+            cache_dir = os.environ.get("FLIGHTDATA_CACHE", default_dir)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hash_content = hash_content
+        self.versions = {}      # loader module name -> source hash
+
+    def entry_dir(self, path):
+        key = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key)
+
+    def version(self, module_name):
+        if not module_name in self.versions:
+            self.versions[module_name] = loader_version(module_name)
+        return self.versions[module_name]
+
+    def read_meta(self, entry):
+        try:
+            with open(os.path.join(entry, "meta.json"), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # return (flight_data, flight_format) from the cache in the columnar
+    # layout (read only memory mapped arrays), or None if there is no valid
+    # entry for this path
+    def get(self, path):
+        entry = self.entry_dir(path)
+        meta = self.read_meta(entry)
+        if meta is None:
+            return None
+        try:
+            valid = meta["cache_version"] == cache_version \
+                and meta["path"] == os.path.abspath(path) \
+                and meta["source"] == source_signature(path, self.hash_content) \
+                and meta["loader"] == self.version(meta["module"])
+        except (OSError, ImportError, KeyError):
+            valid = False
+        if not valid:
+            self.remove(entry)
+            return None
+        flight_data = {}
+        try:
+            for i, (name, fields) in enumerate(meta["channels"]):
+                channel = {}
+                for j, field in enumerate(fields):
+                    filename = os.path.join(entry, "%d_%d.npy" % (i, j))
+                    try:
+                        channel[field] = np.load(filename, mmap_mode="r")
+                    except ValueError:
+                        # object arrays can't be memory mapped
+                        channel[field] = np.load(filename, allow_pickle=True)
+                flight_data[name] = channel
+            # touch for lru bookkeeping
+            os.utime(os.path.join(entry, "meta.json"))
+        except OSError:
+            # evicted by another process while reading it
+            return None
+        return flight_data, meta["format"]
+
+    # store a loaded flight.  module_name is the loader module used (its
+    # source hash is the loader version.)
+    def put(self, path, flight_data, flight_format, module_name):
+        if not len(flight_data):
+            return
+        entry = self.entry_dir(path)
+        tmp = entry + ".tmp%d" % os.getpid()
+        os.makedirs(tmp, exist_ok=True)
+        try:
+            meta = { "cache_version": cache_version,
+                     "path": os.path.abspath(path),
+                     "source": source_signature(path, self.hash_content),
+                     "module": module_name,
+                     "loader": self.version(module_name),
+                     "format": flight_format,
+                     "channels": [] }
+            for i, name in enumerate(flight_data):
+                channel = flight_data[name]
+                if not isinstance(channel, dict):
+                    channel = columnar.records_to_columns(channel)
+                fields = list(channel.keys())
+                for j, field in enumerate(fields):
+                    filename = os.path.join(tmp, "%d_%d.npy" % (i, j))
+                    array = np.asarray(channel[field])
+                    if array.dtype.metadata:
+                        # drop h5py string dtype metadata (not storable)
+                        array = array.astype(array.dtype.str)
+                    np.save(filename, array, allow_pickle=True)
+                meta["channels"].append([name, fields])
+            with open(os.path.join(tmp, "meta.json"), "w") as f:
+                json.dump(meta, f)
+            self.remove(entry)
+            try:
+                os.rename(tmp, entry)
+            except OSError:
+                # stored concurrently by another process
+                self.remove(tmp)
+        except Exception:
+            self.remove(tmp)
+            raise
+        self.evict(keep=entry)
+
+    def remove(self, entry):
+        shutil.rmtree(entry, ignore_errors=True)
+
+    # drop the entry for path, or for every cached flight loaded by
+    # module_name (e.g. "flightdata.formats.aura_csv"), or everything
+    def invalidate(self, path=None, module_name=None):
+        if path is not None:
+            self.remove(self.entry_dir(path))
+            return
+        for entry in self.entries():
+            if module_name is None:
+                self.remove(entry)
+            else:
+                meta = self.read_meta(entry)
+                if meta is None or meta.get("module") == module_name:
+                    self.remove(entry)
+
+    def entries(self):
+        if not os.path.isdir(self.cache_dir):
+            return []
+        result = []
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, name)
+            if os.path.isdir(entry) and not ".tmp" in name:
+                result.append(entry)
+        return result
+
+    # total size of the cache in bytes
+    def size(self):
+        total = 0
+        for entry in self.entries():
+            total += self.entry_size(entry)
+        return total
+
+    # (entries removed by another process meanwhile count as empty)
+    def entry_size(self, entry):
+        total = 0
+        try:
+            names = os.listdir(entry)
+        except OSError:
+            return 0
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(entry, name))
+            except OSError:
+                pass
+        return total
+
+    # remove least recently used entries until the cache fits in max_bytes.
+    # keep (an entry directory) is never removed, put() uses it so the
+    # flight just stored survives even if it is larger than max_bytes.
+    def evict(self, keep=None):
+        if self.max_bytes is None:
+            return
+        stamps = []
+        total = 0
+        for entry in self.entries():
+            try:
+                used = os.path.getmtime(os.path.join(entry, "meta.json"))
+            except OSError:
+                used = 0
+            size = self.entry_size(entry)
+            stamps.append( (used, size, entry) )
+            total += size
+        stamps.sort()
+        for used, size, entry in stamps:
+            if total <= self.max_bytes:
+                break
+            if entry == keep:
+                continue
+            self.remove(entry)
+            total -= size
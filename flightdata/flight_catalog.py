@@ -0,0 +1,283 @@
+# searchable catalog of the flight logs in a directory tree
+#
+# The catalog is a small SQLite database with one row per flight: format,
+# log time span and duration, unix start time, first valid gps fix and the
+# autopilot tag found in the event messages (Aura3 / APM2).  Building it
+# uses the format sniffers and each format's load_summary() (a minimal read
+# of the time stamps, gps, and events) when the format has one, otherwise a
+# full load.  refresh() only re-summarizes logs whose size or mtime changed.
+#
+#   catalog = flight_catalog.FlightCatalog("flights.db")
+#   catalog.refresh("/data/flights")
+#   march = catalog.query(start=datetime(2023, 3, 1), end=datetime(2023, 4, 1),
+#                         near=(44.98, -93.27, 5.0))
+
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import datetime
+import json
+import math
+import os
+import sqlite3
+
+import numpy as np
+
+from . import columnar
+from . import flight_cache
+from . import flight_loader
+from . import formats
+
+earth_radius_km = 6371.0
+
+schema = """
+create table if not exists flights (
+    path text primary key,
+    format text,
+    signature text,
+    t_start real,
+    t_end real,
+    duration real,
+    unix_start real,
+    lat real,
+    lon real,
+    tag text
+);
+create index if not exists flights_unix_start on flights (unix_start);
+create index if not exists flights_lat_lon on flights (lat, lon);
+"""
+
+columns = ["path", "format", "signature", "t_start", "t_end", "duration",
+           "unix_start", "lat", "lon", "tag"]
+
+# great circle distance (km) between points given in degrees
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+    a = math.sin((lat2 - lat1) * 0.5)**2 \
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) * 0.5)**2
+    return 2.0 * earth_radius_km * math.asin(math.sqrt(min(1.0, a)))
+
+def first_field(channel, names):
+    for name in names:
+        if name in channel:
+            return np.asarray(channel[name])
+    return None
+
+# reduce a (possibly partial) flight to its catalog metadata.  The time
+# span comes from the imu channel when there is one.
+def summarize_flight(flight_data):
+    flight_data = columnar.flight_to_columns(flight_data)
+    summary = { "t_start": None, "t_end": None, "duration": None,
+                "unix_start": None, "lat": None, "lon": None, "tag": None }
+
+    # the imu channel spans the whole log, otherwise use all the channels
+    if "imu" in flight_data and columnar.size(flight_data["imu"]):
+        keys = ["imu"]
+    else:
+        keys = list(flight_data.keys())
+    for key in keys:
+        channel = flight_data[key]
+        tkey = columnar.time_key(channel)
+        if tkey is None or not columnar.size(channel):
+            continue
+        t = np.asarray(channel[tkey], dtype=float)
+        t = t[np.isfinite(t)]
+        if not len(t):
+            continue
+        if summary["t_start"] is None or t.min() < summary["t_start"]:
+            summary["t_start"] = float(t.min())
+        if summary["t_end"] is None or t.max() > summary["t_end"]:
+            summary["t_end"] = float(t.max())
+    if summary["t_start"] is not None:
+        summary["duration"] = summary["t_end"] - summary["t_start"]
+
+    gps = flight_data.get("gps", {})
+    lat = first_field(gps, ["lat", "latitude_deg"])
+    lon = first_field(gps, ["lon", "longitude_deg"])
+    if lat is not None and lon is not None and len(lat):
+        valid = np.isfinite(lat) & np.isfinite(lon) \
+            & ((lat != 0) | (lon != 0)) & (np.abs(lat) <= 90) \
+            & (np.abs(lon) <= 180)
+        fixes = np.flatnonzero(valid)
+        if len(fixes):
+            i = fixes[0]
+            summary["lat"] = float(lat[i])
+            summary["lon"] = float(lon[i])
+            unix_sec = first_field(gps, ["unix_sec"])
+            t = first_field(gps, columnar.time_keys)
+            if unix_sec is not None and unix_sec[i] > 0:
+                summary["unix_start"] = float(unix_sec[i])
+                if t is not None and summary["t_start"] is not None:
+                    summary["unix_start"] -= float(t[i]) - summary["t_start"]
+
+    for key in ["event", "events"]:
+        if key in flight_data and "message" in flight_data[key]:
+            for message in flight_data[key]["message"]:
+                if isinstance(message, bytes):
+                    message = message.decode(errors="replace")
+                if "Aura3" in message:
+                    summary["tag"] = "Aura3"
+                elif "APM2" in message:
+                    summary["tag"] = "APM2"
+    return summary
+
+# summarize one log (fmt, load_path as returned by formats.detect())
+def summarize(fmt, load_path):
+    module = fmt["module"]
+    if hasattr(module, "load_summary"):
+        flight_data = module.load_summary(load_path)
+    else:
+        flight_data = flight_loader.run_loader(fmt, load_path, "columnar")
+    return summarize_flight(flight_data)
+
+# catalog worker: returns (path, format name, signature, summary, error)
+def summarize_worker(path, quiet=True):
+    name = None
+    try:
+        signature = json.dumps(flight_cache.source_signature(path))
+        fmt, load_path = formats.detect(path)
+        if fmt is None:
+            return path, None, signature, None, "unknown format"
+        name = fmt["name"]
+        with open(os.devnull, "w") as devnull:
+            if quiet:
+                redirect = contextlib.redirect_stdout(devnull)
+            else:
+                redirect = contextlib.nullcontext()
+            with redirect:
+                summary = summarize(fmt, load_path)
+        return path, name, signature, summary, None
+    except Exception as e:
+        return path, name, None, None, str(e)
+
+# find the flight logs under root: directories that are a flight
+# themselves (aura logs) are not descended into
+def find_flights(root):
+    result = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        fmt, load_path = formats.detect(dirpath)
+        if fmt is not None:
+            dirnames[:] = []
+            if fmt["supported"]:
+                result.append( (dirpath, fmt) )
+            continue
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            fmt, load_path = formats.detect(path)
+            if fmt is not None and fmt["supported"]:
+                result.append( (path, fmt) )
+    return result
+
+def unix_time(t):
+    if isinstance(t, datetime.datetime):
+        if t.tzinfo is None:
+            t = t.replace(tzinfo=datetime.timezone.utc)
+        return t.timestamp()
+    return t
+
+class FlightCatalog():
+    def __init__(self, db_filename):
+        self.db = sqlite3.connect(db_filename)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(schema)
+
+    # scan root for flight logs, summarize new or changed ones and drop
+    # entries for logs that no longer exist.  Returns the number of logs
+    # (re)summarized.
+    def refresh(self, root, workers=1, quiet=True):
+        root = os.path.abspath(root)
+        known = {}
+        like = os.path.join(root, "").replace("%", r"\%").replace("_", r"\_") + "%"
+        for row in self.db.execute("select path, signature from flights where path = ? or path like ? escape '\\'", (root, like)):
+            known[row["path"]] = row["signature"]
+
+        todo = []
+        for path, fmt in find_flights(root):
+            signature = json.dumps(flight_cache.source_signature(path))
+            if known.pop(path, None) != signature:
+                todo.append(path)
+        for path in known:
+            self.db.execute("delete from flights where path = ?", (path,))
+
+        if workers == 1:
+            results = [ summarize_worker(path, quiet) for path in todo ]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(summarize_worker, todo,
+                                            [quiet] * len(todo)))
+        for path, name, signature, summary, error in results:
+            if error is not None:
+                print("Unable to summarize:", path, error)
+                summary = summarize_flight({})
+            row = dict(summary, path=path, format=name, signature=signature)
+            self.db.execute("insert or replace into flights (%s) values (%s)"
+                            % (",".join(columns), ",".join(["?"] * len(columns))),
+                            [ row[c] for c in columns ])
+        self.db.commit()
+        return len(todo)
+
+    # find flights.  start/end (unix seconds or datetime, naive datetimes
+    # are utc) bound the flight start time, near = (lat, lon, radius_km)
+    # matches the first gps fix, durations are in seconds.  Returns a list
+    # of dicts (with a "distance_km" field when near is given), ordered by
+    # start time.
+    def query(self, start=None, end=None, near=None, min_duration=None,
+              max_duration=None, format=None, tag=None):
+        where = []
+        args = []
+        if start is not None:
+            where.append("unix_start >= ?")
+            args.append(unix_time(start))
+        if end is not None:
+            where.append("unix_start < ?")
+            args.append(unix_time(end))
+        if min_duration is not None:
+            where.append("duration >= ?")
+            args.append(min_duration)
+        if max_duration is not None:
+            where.append("duration <= ?")
+            args.append(max_duration)
+        if format is not None:
+            where.append("format = ?")
+            args.append(format)
+        if tag is not None:
+            where.append("tag = ?")
+            args.append(tag)
+        if near is not None:
+            # bounding box prefilter (uses the lat/lon index), exact
+            # distance check below
+            lat, lon, radius_km = near
+            dlat = math.degrees(radius_km / earth_radius_km)
+            coslat = math.cos(math.radians(lat))
+            if coslat > 1e-6:
+                dlon = min(180.0, dlat / coslat)
+            else:
+                dlon = 180.0
+            where.append("lat between ? and ?")
+            args += [lat - dlat, lat + dlat]
+            if lon - dlon >= -180 and lon + dlon <= 180:
+                where.append("lon between ? and ?")
+                args += [lon - dlon, lon + dlon]
+        sql = "select * from flights"
+        if len(where):
+            sql += " where " + " and ".join(where)
+        sql += " order by unix_start, path"
+        result = []
+        for row in self.db.execute(sql, args):
+            flight = dict(row)
+            if near is not None:
+                flight["distance_km"] = haversine(lat, lon, flight["lat"], flight["lon"])
+                if flight["distance_km"] > radius_km:
+                    continue
+            result.append(flight)
+        return result
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
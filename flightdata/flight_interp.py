@@ -1,68 +1,350 @@
 # build linear interpolaters for the "standard" flight data fields.
 
+from bisect import bisect_right
 import math
 import numpy as np
-from scipy import interpolate # strait up linear interpolation, nothing fancy
+
+from . import columnar
 
 # helpful constants
 d2r = math.pi / 180.0
 
-class FlightInterpolate():
-    def __init__(self, data):
-        # df is a pd.DataFrame indexed by time (in seconds)
-        columns = {}
-        if not len(data):
-            return
-        for key in data[0]:
-            print(" ", key, type(data[0][key]))
-            if type(data[0][key]) is str or type(data[0][key]) is bytes:
-                pass
-            else:
-                #print("  field:", key, type(data[0][key]))
-                columns[key] = []
-        for record in data:
-            for key in columns:
-                columns[key].append(record[key])
-        for key in columns:
-            columns[key] = np.array(columns[key])
-        self.interp = {}
-        for key in columns:
-            print(key)
-            self.interp[key] = interpolate.interp1d(columns["timestamp"],
-                                                    columns[key],
-                                                    bounds_error=False,
-                                                    fill_value=0.0)
+# default per field interpolation methods: discrete fields hold the
+# previous value, headings are interpolated the short way around the
+# circle and everything else is linear.
+default_methods = {
+    "status": "previous",
+    "num_sats": "previous",
+    "current_task": "previous",
+    "task_attrib": "previous",
+    "master_switch": "previous",
+    "pilot_pass_through": "previous",
+    "psi": "circular",
+    "yaw_body": "circular",
+    "psi_deg": "circular_deg",
+    "yaw_deg": "circular_deg",
+    "heading_deg": "circular_deg",
+    "hdg": "circular_deg",
+    "wind_dir": "circular_deg",
+}
 
-    def query(self, t):
+# method name -> period of the circular methods
+circular_periods = { "circular": 2.0 * math.pi, "circular_deg": 360.0 }
+
+methods_list = [ "linear", "previous", "nearest" ] + list(circular_periods.keys())
+
+# behavior outside the time range: "fill" (fill_value), "hold" (first /
+# last sample), "nan", or "extrapolate" (linear from the first / last two
+# samples, discrete fields hold)
+edges_list = [ "fill", "hold", "nan", "extrapolate" ]
+
+# unwrap the jumps of an angle sequence larger than half a period.  Only
+# the finite samples are unwrapped (each against the previous finite one),
+# NaN samples stay NaN in place.
+def unwrap(y, period):
+    result = np.array(y, dtype=np.float64)
+    finite = np.flatnonzero(np.isfinite(result))
+    if len(finite) < 2:
+        return result
+    v = result[finite]
+    dy = np.diff(v)
+    dy -= period * np.round(dy / period)
+    v[1:] = v[0] + np.cumsum(dy)
+    result[finite] = v
+    return result
+
+# flatten per field methods ({"psi": "circular"}) and per channel methods
+# ({"gps": {"status": "linear"}}) into the field methods of one channel,
+# later method sets override earlier ones
+def channel_methods(key, *method_sets):
+    result = {}
+    for methods in method_sets:
+        for name, method in methods.items():
+            if not isinstance(method, dict):
+                result[name] = method
+        if isinstance(methods.get(key), dict):
+            result.update(methods[key])
+    return result
+
+# interpolation of many fields sharing one time vector.  All the fields are
+# stored as the columns of one 2-D array so a lookup is a single binary
+# search plus one row blend, whatever the number of fields.  methods maps
+# field names to "linear" (the default), "previous" (zero order hold),
+# "nearest", "circular" (angles in radians) or "circular_deg", edge is the
+# behavior outside the time range (see edges_list).
+class MultiInterpolate():
+    def __init__(self, times, columns, fill_value=0.0, tkey="timestamp",
+                 methods=None, edge="fill"):
+        times = np.asarray(times, dtype=np.float64)
+        order = np.argsort(times, kind="stable")
+        self.t = times[order]
+        self.tlist = self.t.tolist()
+        self.tkey = tkey
+        self.names = list(columns.keys())
+        self.y = np.zeros( (len(self.t), len(self.names)) )
+        for j, key in enumerate(self.names):
+            self.y[:,j] = np.asarray(columns[key], dtype=np.float64)[order]
+        self.fill_value = fill_value
+        self.methods = {}
+        self.edge = "fill"
+        self.set_methods(methods, edge)
+        self.unwrapped = {}     # (column, method) -> (unwrapped, wrap start)
+        self.cursor = 0         # bracket of the previous scalar query
+        self.slope = None       # (bracket, slope) of the previous blend
+
+    def size(self):
+        return len(self.t)
+
+    # change the field methods and/or the edge behavior
+    def set_methods(self, methods=None, edge=None):
+        if methods is not None:
+            self.groups(methods)
+            self.methods = { key: method for key, method in methods.items()
+                             if key in self.names }
+        if edge is not None:
+            if not edge in edges_list:
+                raise ValueError("unknown edge behavior: %s" % edge)
+            self.edge = edge
+        # the scalar fast path handles linear fields with fill edges
+        self.simple = self.edge == "fill" \
+            and all([ m == "linear" for m in self.methods.values() ])
+
+    # column indices per method, in first use order
+    def groups(self, methods):
         result = {}
-        result["timestamp"] = t
-        for key in self.interp:
-            result[key] = self.interp[key](t).item()
+        for j, key in enumerate(self.names):
+            method = methods.get(key, "linear")
+            if not method in methods_list:
+                raise ValueError("unknown interpolation method: %s" % method)
+            result.setdefault(method, []).append(j)
         return result
 
-class pdFlightInterpolate():
-    def __init__(self, df):
-        # df is a pd.DataFrame indexed by time (in seconds)
-        self.interp = {}
-        for column in df.columns:
-            self.interp[column] = interpolate.interp1d(df.index, df[column],
-                                                       bounds_error=False,
-                                                       fill_value=0.0)
+    # index of the last sample <= t, for t inside the time range.  The
+    # search starts from the previous bracket so a replay with increasing
+    # t advances in amortized O(1): the next samples are checked directly,
+    # a longer forward jump gallops ahead and bisects the last step, and a
+    # backward jump falls back to a binary search of the earlier samples.
+    def bracket(self, t):
+        tlist = self.tlist
+        n = len(tlist)
+        i = self.cursor
+        if tlist[i] <= t:
+            lo = i + 1
+            if lo == n or t < tlist[lo]:
+                return i
+            step = 1
+            while lo < n and tlist[lo] <= t:
+                i = lo
+                lo = i + step
+                step += step
+            i = bisect_right(tlist, t, i, min(lo, n)) - 1
+        else:
+            i = bisect_right(tlist, t, 0, i) - 1
+        self.cursor = i
+        return i
+
+    # interpolated values of every field at time t (a scalar), returns a
+    # 1-D array in the order of self.names
+    def interp_one(self, t):
+        n = len(self.tlist)
+        if not self.simple:
+            return self.interp(np.array([t]))[0]
+        if not n or t < self.tlist[0] or t > self.tlist[-1] or t != t:
+            return np.full(len(self.names), self.fill_value)
+        lo = self.bracket(t)
+        t0 = self.tlist[lo]
+        if t == t0:
+            return self.y[lo].copy()
+        if self.slope is None or self.slope[0] != lo:
+            # sequential queries mostly stay in the same bracket
+            self.slope = (lo, (self.y[lo+1] - self.y[lo]) / (self.tlist[lo+1] - t0))
+        return self.slope[1] * (t - t0) + self.y[lo]
+
+    # linear blend of the rows of y (sampled at self.t) at times ti inside
+    # the time range, lo = index of the last sample <= ti
+    def blend(self, y, ti, lo):
+        result = np.empty( (len(ti), y.shape[1]) )
+        exact = ti == self.t[lo]
+        result[exact] = y[lo[exact]]
+        between = ~exact
+        ti = ti[between]
+        lo = lo[between]
+        t0 = self.t[lo][:,np.newaxis]
+        slope = (y[lo+1] - y[lo]) / (self.t[lo+1][:,np.newaxis] - t0)
+        result[between] = slope * (ti[:,np.newaxis] - t0) + y[lo]
+        return result
+
+    # linear continuation of the rows of y before the first sample (end =
+    # 0) or after the last one (end = -1), a hold if there is no slope
+    def extend(self, y, t, end):
+        n = len(self.t)
+        i = 0 if end == 0 else n - 2
+        if n < 2 or not self.t[i+1] > self.t[i]:
+            return np.tile(y[end], (len(t), 1))
+        slope = (y[i+1] - y[i]) / (self.t[i+1] - self.t[i])
+        return slope * (t - self.t[i])[:,np.newaxis] + y[i]
+
+    # an angle column unwrapped along time, and the start of the range its
+    # values are wrapped back into ([0, period) for non negative sources,
+    # otherwise [-period/2, period/2))
+    def unwrap_column(self, j, method):
+        if not (j, method) in self.unwrapped:
+            period = circular_periods[method]
+            y = self.y[:,j]
+            if len(y) and np.nanmin(y) < 0:
+                start = -0.5 * period
+            else:
+                start = 0.0
+            self.unwrapped[(j, method)] = (unwrap(y, period), start)
+        return self.unwrapped[(j, method)]
 
+    # interpolated values of every field at each time of a 1-D array,
+    # returns a (len(t), len(self.names)) array.  methods and edge default
+    # to the ones of the interpolator.
+    def interp(self, t, methods=None, edge=None):
+        if methods is None:
+            methods = self.methods
+        if edge is None:
+            edge = self.edge
+        if not edge in edges_list:
+            raise ValueError("unknown edge behavior: %s" % edge)
+        t = np.asarray(t, dtype=np.float64)
+        fill = self.fill_value if edge == "fill" else np.nan
+        result = np.full( (len(t), len(self.names)), fill, dtype=np.float64)
+        n = len(self.t)
+        if not n:
+            return result
+        inside = np.flatnonzero((t >= self.t[0]) & (t <= self.t[-1]))
+        ti = t[inside]
+        lo = np.searchsorted(self.t, ti, side="right") - 1
+        if edge in ["hold", "extrapolate"]:
+            before = np.flatnonzero(t < self.t[0])
+            after = np.flatnonzero(t > self.t[-1])
+        for method, cols in self.groups(methods).items():
+            whole = len(cols) == len(self.names)
+            if method == "linear":
+                y = self.y if whole else self.y[:,cols]
+                values = self.blend(y, ti, lo)
+            elif method == "previous":
+                y = self.y if whole else self.y[:,cols]
+                values = y[lo]
+            elif method == "nearest":
+                y = self.y if whole else self.y[:,cols]
+                hi = np.minimum(lo + 1, n - 1)
+                closer = self.t[hi] - ti < ti - self.t[lo]
+                values = y[np.where(closer, hi, lo)]
+            else:
+                period = circular_periods[method]
+                y = np.empty( (n, len(cols)) )
+                start = np.empty(len(cols))
+                for k, j in enumerate(cols):
+                    y[:,k], start[k] = self.unwrap_column(j, method)
+                values = self.blend(y, ti, lo)
+            if edge == "hold" or (edge == "extrapolate" and method in ["previous", "nearest"]):
+                values_before = np.tile(y[0], (len(before), 1))
+                values_after = np.tile(y[-1], (len(after), 1))
+            elif edge == "extrapolate":
+                values_before = self.extend(y, t[before], 0)
+                values_after = self.extend(y, t[after], -1)
+            if method in circular_periods:
+                values = np.mod(values - start, period) + start
+                if edge in ["hold", "extrapolate"]:
+                    values_before = np.mod(values_before - start, period) + start
+                    values_after = np.mod(values_after - start, period) + start
+            if whole:
+                result[inside] = values
+            else:
+                result[np.ix_(inside, cols)] = values
+            if edge in ["hold", "extrapolate"]:
+                result[np.ix_(before, cols)] = values_before
+                result[np.ix_(after, cols)] = values_after
+        return result
+
+    # query at a scalar time (dict of floats) or at an array of times
+    # (dict of arrays)
     def query(self, t):
         result = {}
         result["timestamp"] = t
-        for key in self.interp:
-            result[key] = self.interp[key](t).item()
+        if np.ndim(t) == 0:
+            values = self.interp_one(float(t)).tolist()
+        else:
+            values = self.interp(t).T
+        result.update(zip(self.names, values))
+        return result
+
+    # every field resampled at the times t (1-D array), returned as a
+    # columnar channel whose time field is t itself.  methods and edge
+    # default to the ones of the interpolator.
+    def resample(self, t, methods=None, edge=None):
+        t = np.asarray(t, dtype=np.float64)
+        values = self.interp(t, methods, edge)
+        result = { self.tkey: t }
+        for j, key in enumerate(self.names):
+            if key != self.tkey:
+                result[key] = values[:,j]
         return result
 
+# methods defaults to default_methods (plus "previous" for boolean fields),
+# pass methods={} for plain linear interpolation of every field
+class FlightInterpolate(MultiInterpolate):
+    def __init__(self, data, methods=None, edge="fill", fill_value=0.0):
+        # data is a list of records or a columnar channel (dict of arrays)
+        if isinstance(data, dict):
+            columns = data
+        elif len(data):
+            columns = columnar.records_to_columns(data)
+        else:
+            columns = {}
+        tkey = columnar.time_key(columns)
+        fields = {}
+        booleans = {}
+        for key in columns:
+            values = np.asarray(columns[key])
+            print(" ", key, values.dtype)
+            if values.dtype.kind in "biuf":
+                fields[key] = values
+            if values.dtype.kind == "b":
+                booleans[key] = "previous"
+        if tkey is None:
+            tkey = "timestamp"
+        if methods is None:
+            methods = dict(booleans, **default_methods)
+        times = fields.get(tkey, [])
+        MultiInterpolate.__init__(self, times, fields, fill_value, tkey,
+                                  methods, edge)
+
+class pdFlightInterpolate(MultiInterpolate):
+    def __init__(self, df, methods=None, edge="fill", fill_value=0.0):
+        # df is a pd.DataFrame indexed by time (in seconds)
+        fields = {}
+        booleans = {}
+        for column in df.columns:
+            if df[column].dtype.kind in "biuf":
+                fields[column] = df[column].to_numpy()
+            if df[column].dtype.kind == "b":
+                booleans[column] = "previous"
+        if methods is None:
+            methods = dict(booleans, **default_methods)
+        MultiInterpolate.__init__(self, df.index.to_numpy(), fields,
+                                  fill_value, methods=methods, edge=edge)
+
+# methods overrides default_methods per field name ({"psi": "circular"})
+# or per channel ({"gps": {"status": "linear"}}), edge applies to every
+# channel
 class InterpolationGroup():
-    def __init__(self, data):
+    def __init__(self, data, methods=None, edge="fill"):
+        if methods is None:
+            methods = {}
+        self.methods = methods
         self.group = {}
         for key in data:
-            if len(data[key]) > 1:
+            if columnar.size(data[key]) > 1:
                 print("group:", key)
-                self.group[key] = FlightInterpolate(data[key])
+                interp = FlightInterpolate(data[key], edge=edge)
+                overrides = channel_methods(key, methods)
+                if len(overrides):
+                    interp.set_methods(dict(interp.methods, **overrides))
+                self.group[key] = interp
 
     def query(self, t, key):
         if key in self.group:
@@ -70,45 +352,179 @@ class InterpolationGroup():
         else:
             return None
 
-# emulate realtime linear processing of a data set
+    # resample every channel (or the channels listed in keys) onto the
+    # time vector t, e.g. the imu time stamps or a fixed rate grid.
+    # Returns a dict of columnar channels that all share t as their time
+    # field.  methods (same form as for the group) and edge override the
+    # ones of the group for this call.
+    def resample(self, t, methods=None, keys=None, edge=None):
+        if keys is None:
+            keys = self.group.keys()
+        result = {}
+        for key in keys:
+            if not key in self.group:
+                continue
+            interp = self.group[key]
+            if methods is None:
+                field_methods = None
+            else:
+                field_methods = dict(interp.methods)
+                field_methods.update(channel_methods(key, methods))
+            result[key] = interp.resample(t, field_methods, edge)
+        return result
+
+# master steps per block of the as of index read by IterateGroup.ticks()
+replay_chunk = 10000
+
+# emulate realtime linear processing of a data set.  Any channel can drive
+# the replay (master).  An "as of" index is built once per flight: for each
+# master record, the index of the latest record of every other channel
+# (np.searchsorted).  Records older than a master record are received
+# before it; records with the same time stamp as master records are
+# received one per master record of that time stamp, the rest are left
+# for the following master records (like the original counter walk.)  Replay is then pure index lookups and any
+# step can be read at random (state(k)), e.g. to replay flight segments in
+# parallel.  events() walks every record of every channel in time order
+# through a merged index (a stable argsort of the concatenated time
+# stamps).  Channels can be lists of records or columnar (dict of arrays).
 class IterateGroup():
-    def __init__(self, data):
+    def __init__(self, data, master="imu"):
         self.data = data
-        self.counter = {}
+        self.master = master
+        self.keys = []
+        self.times = {}
         for key in data:
-            self.counter[key] = 0
+            tkey = columnar.time_key(data[key])
+            if tkey is None:
+                continue
+            self.keys.append(key)
+            self.times[key] = self.channel_times(data[key], tkey)
+        if master in self.times:
+            master_times = self.times[master]
+        else:
+            master_times = np.zeros(0)
+        # position of each master record in its run of equal time stamps
+        steps = np.arange(len(master_times))
+        run = np.ones(len(master_times), dtype=bool)
+        run[1:] = master_times[1:] != master_times[:-1]
+        rank = steps - np.maximum.accumulate(np.where(run, steps, 0))
+        self.asof = {}
+        for key in self.keys:
+            if key == master:
+                continue
+            t = self.times[key]
+            order = np.argsort(t, kind="stable")
+            before = np.searchsorted(t[order], master_times, side="left")
+            upto = np.searchsorted(t[order], master_times, side="right")
+            # number of records received by each master record
+            received = np.maximum.accumulate(np.minimum(upto, before + rank + 1))
+            i = received - 1
+            asof = np.full(len(master_times), -1, dtype=np.int32)
+            asof[i >= 0] = order[i[i >= 0]]
+            self.asof[key] = asof
+        self.event_key = None   # merged event index, built by events()
+        self.event_row = None
+        self.iterator = None
+
+    def channel_times(self, channel, tkey):
+        if isinstance(channel, dict):
+            return np.asarray(channel[tkey], dtype=np.float64)
+        else:
+            return np.array([ record[tkey] for record in channel ], dtype=np.float64)
 
+    # record i of a channel (a dict of field values)
+    def record(self, key, i):
+        channel = self.data[key]
+        if isinstance(channel, dict):
+            return { field: channel[field][i] for field in channel }
+        else:
+            return channel[i]
+
+    # number of master records
     def size(self):
-        if "imu" in self.data:
-            return len(self.data["imu"])
+        if self.master in self.times:
+            return len(self.times[self.master])
         else:
             return 0
 
-    def next(self):
+    # index of the latest record of each channel at master step k (-1 if
+    # the channel has no record yet)
+    def indices(self, k):
+        result = { self.master: k }
+        for key, asof in self.asof.items():
+            result[key] = int(asof[k])
+        return result
+
+    # the combined state at master step k: the master record plus, for each
+    # other channel, the latest record received so far (hold=True) or only
+    # if it was received since the previous master record (hold=False)
+    def state(self, k, hold=True):
+        if k < 0:
+            k += self.size()
+        if k < 0 or k >= self.size():
+            raise IndexError("master step out of range: %d" % k)
         result = {}
-        # next imu record
-        i = self.counter["imu"]
-        if i < len(self.data["imu"]):
-            t = self.data["imu"][i]["timestamp"]
-            #print("t = ", t)
-            result["imu"] = self.data["imu"][i]
-            self.counter["imu"] += 1
-
-            # look for new records of other types
-            for key in self.data:
-                if key != "imu":
-                    # print(" ", key)
-                    i = self.counter[key]
-                    while i < len(self.data[key]):
-                        d = self.data[key][i]
-                        if d["timestamp"] <= t:
-                            #print("  ", d["timestamp"])
-                            result[key] = d
-                            self.counter[key] += 1
-                            i = self.counter[key]
-                            if d["timestamp"] == t:
-                                break
-                        else:
-                            break
+        for key, asof in self.asof.items():
+            i = asof[k]
+            if i >= 0 and (hold or k == 0 or asof[k-1] != i):
+                result[key] = self.record(key, i)
+        result[self.master] = self.record(self.master, k)
         return result
 
+    # one state() per master step in range(start, end).  The as of index is
+    # read in blocks of replay_chunk steps and only the channels that have
+    # a record to deliver are visited at each step.
+    def ticks(self, hold=False, start=0, end=None):
+        if end is None:
+            end = self.size()
+        keys = list(self.asof.keys())
+        for k0 in range(start, end, replay_chunk):
+            k1 = min(k0 + replay_chunk, end)
+            rows = np.zeros( (k1 - k0, len(keys)), dtype=np.int32)
+            prev = np.full( (k1 - k0, len(keys)), -1, dtype=np.int32)
+            for j, key in enumerate(keys):
+                rows[:,j] = self.asof[key][k0:k1]
+                prev[1:,j] = rows[:-1,j]
+                if k0 > 0:
+                    prev[0,j] = self.asof[key][k0-1]
+            if hold:
+                deliver = rows >= 0
+            else:
+                deliver = (rows >= 0) & (rows != prev)
+            step, col = np.nonzero(deliver)
+            found = rows[step, col].tolist()
+            col = col.tolist()
+            bounds = np.searchsorted(step, np.arange(k1 - k0 + 1)).tolist()
+            for r in range(k1 - k0):
+                result = {}
+                for p in range(bounds[r], bounds[r+1]):
+                    key = keys[col[p]]
+                    result[key] = self.record(key, found[p])
+                result[self.master] = self.record(self.master, k0 + r)
+                yield result
+
+    # every record of every channel in time order, as (channel, record)
+    def events(self):
+        if self.event_key is None:
+            # the master channel goes last so it sorts after equal time stamps
+            keys = [ key for key in self.keys if key != self.master ]
+            if self.master in self.times:
+                keys.append(self.master)
+            times = [ self.times[key] for key in keys ]
+            if len(times):
+                ids = np.concatenate([ np.full(len(t), i) for i, t in enumerate(times) ])
+                rows = np.concatenate([ np.arange(len(t)) for t in times ])
+                order = np.argsort(np.concatenate(times), kind="stable")
+                self.event_key = [ keys[i] for i in ids[order].tolist() ]
+                self.event_row = rows[order].tolist()
+            else:
+                self.event_key = []
+                self.event_row = []
+        for key, row in zip(self.event_key, self.event_row):
+            yield key, self.record(key, row)
+
+    # the next master tick (see ticks()), an empty dict after the last one
+    def next(self):
+        if self.iterator is None:
+            self.iterator = self.ticks()
+        return next(self.iterator, {})
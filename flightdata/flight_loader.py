@@ -1,97 +1,208 @@
-import h5py
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import contextlib
 import os
 import pandas as pd
+import traceback
 
-from .formats import ardupilot_log
+from . import columnar
+from . import flight_cache
+from . import formats
+from .lazy_flight import LazyFlight
 from .formats import aura_csv
-from .formats import aura_hdf5
-from .formats import nst_hdf5
-from .formats import cirrus_pkl
-from .formats import px4_ulog
-from .formats import px4_sdlog2
-from .formats import px4_csv
-from .formats import umn1_mat
-from .formats import umn3_hdf5
-
-def load(path):
-    flight_data = {}
-    flight_format = None
-
-    (root, ext) = os.path.splitext(path)
-    aura_hdf5_path = os.path.join(path, "flight.h5")
-    aura_csv_path = os.path.join(path, "imu-0.csv")
-    ulog_path = path + "_sensor_combined_0.csv"
-
-    # determine the data log format and call the corresponding loader code
-
-    if ext == ".h5":
-        # quick peek
-        data = h5py.File(path, "r")
-        if "metadata" in data:
-            md = data["/metadata"]
-            if md.attrs.get("format", "") == "AuraUAS":
-                print("Detected AuraUAS hdf5 format.")
-                flight_data = aura_hdf5.load(path)
-                flight_format = "aura_hdf5"
-            elif md.attrs.get("format", "") == "NorthStarUAS":
-                print("Detected NorthStarUAS hdf5 format.")
-                flight_data = nst_hdf5.load(path)
-                flight_format = "nst_hdf5"
-            else:
-                print("not yet support hdf5 file")
-        else:
-            print("Detected UMN3 (hdf5) format.")
-            flight_data = umn3_hdf5.load(path)
-            flight_format = "umn3"
-    elif os.path.exists(aura_hdf5_path):
-        # aura hdf5 format
-        print("Detected AuraUAS hdf5 format.")
-        flight_data = aura_hdf5.load(aura_hdf5_path)
-        flight_format = "aura_hdf5"
-    elif os.path.exists(aura_csv_path):
-        # aura csv format
-        print("Detected aura csv format.")
-        flight_data = aura_csv.load(path)
-        flight_format = "aura_csv"
-    elif ext == ".mat":
-        # umn1
-        print("Detected umn1 format.")
-        print("Notice: assuming umn1 .mat format")
-        flight_data = umn1_mat.load(path)
-        flight_format = "umn1"
-    elif ext == ".ulg":
-        # px4 binary ulog
-        flight_data = px4_ulog.load(path)
-        flight_format = "px4_ulog"
-    elif os.path.exists(ulog_path):
-        # px4_ulog (csv export)
-        print("Detected px4 ulog (csv family of files) format.")
-        print("Support needs code updates")
-        quit()
-        flight_data = px4_csv.load(path)
-        flight_format = "px4_csv"
-    elif ext == ".px4_csv":
-        # px4 sdlog2
-        print("Detected px4 ulog (single csv file) format.")
-        print("Support needs code updates")
-        quit()
-        flight_data = px4_sdlog2.load(path)
-        flight_format = "px4_sdlog2"
-    elif ext == ".log":
-        # ardupilot .log (text, reminds me of nmea style format)
-        print("Detected ardupilot log format.")
-        flight_data = ardupilot_log.load(path)
-        flight_format = "ardupilot_log"
-    elif ext == ".pkl":
-        # cirrus in-house pkl log format
-        print("Detected cirrus pkl format.")
-        flight_data = cirrus_pkl.load(path)
-        flight_format = "cirrus_pkl"
+
+# call the format loader, using its lazy or native columnar path when it
+# has one
+def run_loader(fmt, path, layout, lazy=False, time_range=None):
+    module = fmt["module"]
+    if lazy and hasattr(module, "lazy_load"):
+        return module.lazy_load(path, layout, time_range)
+    elif lazy:
+        print("Notice: lazy loading not supported for this format, loading everything.")
+    if layout == "columnar" and hasattr(module, "load_columns"):
+        return module.load_columns(path, time_range)
+    elif fmt["time_range"]:
+        return module.load(path, time_range)
     else:
-        print("Unable to determine data log format (or path not valid):", path)
+        return module.load(path)
+
+# layout="records" (default) returns each channel as a list of per-sample
+# dicts.  layout="columnar" returns each channel as a dict of field name ->
+# numpy array (see columnar.py), which is far more compact for long logs.
+#
+# lazy=True (hdf5 formats) returns a LazyFlight that keeps the file open and
+# reads each channel the first time it is accessed.  Use it as a context
+# manager or call close() when done.
+#
+# time_range=(t0, t1) only returns the records inside that time window (in
+# the log's own time stamps.)  The hdf5 formats binary search the time
+# stamps and read just that hyperslab, the aura csv and ardupilot text
+# loaders stop parsing past t1, the ardupilot binary loader drops the
+# messages past t1 after decoding, other formats are clipped after loading.
+#
+# cache=True (or a flight_cache.FlightCache) keeps a converted copy of the
+# whole flight on disk and reuses it while the log and loader are unchanged
+# (see flight_cache.py.)  Cached columnar channels are read only memory
+# mapped arrays.
+def load(path, layout="records", lazy=False, time_range=None, cache=None):
+    if layout not in ["records", "columnar"]:
+        raise ValueError("unknown flight data layout: " + str(layout))
+
+    if cache is True:
+        cache = flight_cache.FlightCache()
+    if lazy or cache is False:
+        cache = None
+
+    if cache is not None:
+        cached = cache.get(path)
+        if cached is not None:
+            print("Loaded from cache:", path)
+            flight_data, flight_format = cached
+            flight_data = columnar.clip_flight(flight_data, time_range)
+            if layout == "records":
+                flight_data = columnar.flight_to_records(flight_data)
+            return flight_data, flight_format
+        # load (and cache) the whole flight, clip afterwards
+        flight_data, flight_format = load_format(path, layout, False, None)
+    else:
+        flight_data, flight_format = load_format(path, layout, lazy, time_range)
+
+    if layout == "columnar" and isinstance(flight_data, dict):
+        # convert channel by channel so each list of dicts can be released
+        # as soon as its arrays are built
+        for key in list(flight_data.keys()):
+            channel = flight_data.pop(key)
+            if not isinstance(channel, dict):
+                channel = columnar.records_to_columns(channel)
+            flight_data[key] = channel
+
+    if cache is not None and flight_format is not None:
+        cache.put(path, flight_data, flight_format,
+                  formats.get(flight_format)["module"].__name__)
+
+    if time_range is not None and isinstance(flight_data, dict):
+        flight_data = columnar.clip_flight(flight_data, time_range)
 
     return flight_data, flight_format
 
+# determine the data log format (see formats/__init__.py) and call the
+# corresponding loader code
+def load_format(path, layout, lazy, time_range):
+    fmt, load_path = formats.detect(path)
+    if fmt is None:
+        print("Unable to determine data log format (or path not valid):", path)
+        return {}, None
+    print("Detected %s format." % fmt["description"])
+    if not fmt["supported"]:
+        print("Support needs code updates")
+        return {}, fmt["name"]
+    return run_loader(fmt, load_path, layout, lazy, time_range), fmt["name"]
+
+# load one flight in a load_many() worker process.  Data goes back to the
+# parent as columnar numpy arrays (which pickle as raw buffers), or not at
+# all when a cache is used, ship is False and the parent can memory map
+# the cached copy.  With apply, only the result of apply(flight_data,
+# flight_format) is sent back.
+def load_worker(path, time_range, cache, quiet, apply=None, ship=True):
+    try:
+        if quiet:
+            output = open(os.devnull, "w")
+            redirect = contextlib.redirect_stdout(output)
+        else:
+            output = None
+            redirect = contextlib.nullcontext()
+        try:
+            with redirect:
+                if apply is None:
+                    flight_data, flight_format = load(path, "columnar", False,
+                                                      time_range, cache)
+                else:
+                    # lazy (when not cached) so only the channels apply
+                    # uses are read
+                    flight_data, flight_format = load(path, "columnar",
+                                                      cache is None,
+                                                      time_range, cache)
+                    try:
+                        flight_data = apply(flight_data, flight_format)
+                    finally:
+                        if isinstance(flight_data, LazyFlight):
+                            flight_data.close()
+        finally:
+            if output is not None:
+                output.close()
+        if apply is None and cache is not None and flight_format is not None \
+           and not ship:
+            flight_data = None
+        return path, flight_data, flight_format, None
+    except Exception:
+        return path, None, None, traceback.format_exc()
+
+# load many flights in parallel over a pool of worker processes (one per
+# cpu by default.)  This is a generator that yields (path, flight_data,
+# flight_format, error) tuples in completion order, error is None on
+# success or the traceback text of the failure.  quiet=True silences the
+# loader output in the workers.  Other options are the same as load().
+#
+# apply=fn(flight_data, flight_format) (a picklable module level function)
+# runs in the worker on the columnar (lazy for the hdf5 formats) flight and
+# its return value is yielded in place of flight_data.  Use it to reduce
+# each flight to a small result instead of shipping all the data back.
+def load_many(paths, workers=None, layout="records", time_range=None,
+              cache=None, quiet=True, apply=None):
+    if layout not in ["records", "columnar"]:
+        raise ValueError("unknown flight data layout: " + str(layout))
+    if cache is True:
+        cache = flight_cache.FlightCache()
+    if cache is False:
+        cache = None
+
+    # the workers only leave the data in the cache for the parent to
+    # memory map when their entry can't be evicted before the parent reads
+    # it: one (in process) worker, or a cache without a size limit.
+    # Otherwise another worker's put() may evict it, so the columns are
+    # shipped back.
+    ship = cache is None or (cache.max_bytes is not None and workers != 1)
+
+    def finish(result):
+        path, flight_data, flight_format, error = result
+        if apply is not None:
+            return result
+        if error is None and flight_data is None:
+            cached = cache.get(path)
+            if cached is None:
+                # evicted (or never stored, e.g. an empty flight) after
+                # all: load it again here
+                try:
+                    flight_data, flight_format = load(path, "columnar", False,
+                                                      time_range, cache)
+                except Exception:
+                    error = traceback.format_exc()
+            else:
+                flight_data = columnar.clip_flight(cached[0], time_range)
+        if error is None and layout == "records":
+            flight_data = columnar.flight_to_records(flight_data)
+        return path, flight_data, flight_format, error
+
+    if workers == 1:
+        for path in paths:
+            yield finish(load_worker(path, time_range, cache, quiet, apply,
+                                     ship))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for path in paths:
+            future = executor.submit(load_worker, path, time_range, cache,
+                                     quiet, apply, ship)
+            futures[future] = path
+        for future in as_completed(futures):
+            # a crashed worker (broken pool) or a result that can't be
+            # pickled back only fails its own flights
+            try:
+                result = future.result()
+            except Exception:
+                yield futures[future], None, None, traceback.format_exc()
+                continue
+            yield finish(result)
+
 def as_pandas(flight_data):
     result = {}
     # convert to pandas DataFrame's
@@ -0,0 +1,115 @@
+# flight data format registry
+#
+# Each format module registers a cheap sniff(path) function together with
+# itself (the module provides load() and optionally load_columns() and
+# lazy_load()).  sniff() looks at the path name, magic bytes or a header
+# line (the first few KB of the file), or for hdf5 logs opens the file with
+# h5py for its /metadata format and top level groups, and returns the path
+# to hand to the loader (e.g. the flight.h5 inside a flight directory) or
+# None if it doesn't recognize the log.
+#
+# In-house formats can be added without touching flightdata:
+#
+#   from flightdata import formats
+#   formats.register("my_format", my_module, my_module.sniff, priority=10)
+
+import functools
+import os
+
+import h5py
+
+hdf5_signature = b"\x89HDF\r\n\x1a\n"
+head_size = 4096
+
+registry = []
+
+# name: the flight_format string returned by flight_loader.load()
+# module: the loader module (load(path[, time_range]), ...)
+# sniff: fn(path) -> load path or None
+# priority: lower values are tried first (ties in registration order)
+# time_range: the module load() function accepts a time_range argument
+# supported: False if the format is recognized but can't be loaded yet
+def register(name, module, sniff, priority=100, description=None,
+             time_range=False, supported=True):
+    unregister(name)
+    if description is None:
+        description = name
+    registry.append({
+        "name": name,
+        "module": module,
+        "sniff": sniff,
+        "priority": priority,
+        "description": description,
+        "time_range": time_range,
+        "supported": supported,
+    })
+    registry.sort(key=lambda fmt: fmt["priority"])
+
+def unregister(name):
+    registry[:] = [ fmt for fmt in registry if fmt["name"] != name ]
+
+# look up a registered format by name
+def get(name):
+    for fmt in registry:
+        if fmt["name"] == name:
+            return fmt
+    return None
+
+# find the format of a log.  Returns (format entry, load path) or
+# (None, None) if no sniffer recognizes it.
+def detect(path):
+    for fmt in registry:
+        try:
+            load_path = fmt["sniff"](path)
+        except (OSError, ValueError):
+            load_path = None
+        if load_path is not None:
+            return fmt, load_path
+    return None, None
+
+# the first bytes of a file (b"" for directories or unreadable paths)
+def read_head(path, size=head_size):
+    if not os.path.isfile(path):
+        return b""
+    try:
+        with open(path, "rb") as f:
+            return f.read(size)
+    except OSError:
+        return b""
+
+def extension(path):
+    return os.path.splitext(path)[1].lower()
+
+# summary of an hdf5 file for sniffing: (metadata format attribute or None,
+# top level group names), or None if it isn't an hdf5 file.  The file is
+# opened with h5py (which reads the superblock and root group) once per
+# size and mtime.
+def hdf5_info(path):
+    if not read_head(path, len(hdf5_signature)) == hdf5_signature:
+        return None
+    st = os.stat(path)
+    return hdf5_info_cached(os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+# each hdf5 sniffer asks for the same info, only open the file once
+@functools.lru_cache(maxsize=64)
+def hdf5_info_cached(path, size, mtime_ns):
+    with h5py.File(path, "r") as data:
+        md_format = None
+        if "metadata" in data:
+            md_format = data["/metadata"].attrs.get("format", "")
+            if isinstance(md_format, bytes):
+                md_format = md_format.decode("utf-8", "replace")
+        return md_format, list(data.keys())
+
+# register the built in formats (in detection order)
+from . import aura_hdf5
+from . import nst_hdf5
+from . import umn3_hdf5
+from . import aura_csv
+from . import umn1_mat
+from . import px4_ulog
+from . import px4_csv
+from . import px4_sdlog2
+from . import ardupilot_log
+from . import ardupilot_bin
+from . import cirrus_pkl
@@ -0,0 +1,216 @@
+# load a ardupilot binary dataflash (.bin) log
+#
+# Every message starts with the two sync bytes 0xA3 0x95 and a message type
+# id.  The FMT messages (type 128) give the name, total length, field
+# formats and column names of each message type, so the log describes
+# itself.  The file is memory mapped, the message boundaries are found by
+# following the FMT lengths from sync to sync, and all the messages of a
+# type are decoded at once with a numpy structured dtype.  Values are
+# scaled like the text log export (c/C/e/E are hundredths, L is degrees *
+# 1e7), so the flight channels come from the same
+# ardupilot_log.build_channels().
+
+import numpy as np
+import sys
+
+from .. import columnar
+from .. import formats
+from . import ardupilot_log
+
+sync = b"\xa3\x95"
+fmt_type = 128
+fmt_length = 89
+
+# dataflash field format character -> numpy dtype
+field_types = {
+    "a": ("<i2", (32,)),
+    "b": "i1",
+    "B": "u1",
+    "h": "<i2",
+    "H": "<u2",
+    "i": "<i4",
+    "I": "<u4",
+    "f": "<f4",
+    "d": "<f8",
+    "n": "S4",
+    "N": "S16",
+    "Z": "S64",
+    "c": "<i2",
+    "C": "<u2",
+    "e": "<i4",
+    "E": "<u4",
+    "L": "<i4",
+    "M": "u1",
+    "q": "<i8",
+    "Q": "<u8",
+    "g": "<f2",
+}
+
+# scale factor applied to the raw integer of these formats
+field_scales = {
+    "c": 0.01,
+    "C": 0.01,
+    "e": 0.01,
+    "E": 0.01,
+    "L": 1e-7,
+}
+
+fmt_dtype = np.dtype([ ("sync", "S2"), ("id", "u1"), ("type", "u1"),
+                       ("length", "u1"), ("name", "S4"), ("format", "S16"),
+                       ("columns", "S64") ])
+
+def text(value):
+    return value.decode("ascii", "replace").strip("\x00 ")
+
+# the structured dtype of a message type (including the 3 byte header),
+# or None if the format has an unknown field type, duplicate or empty
+# column names, or doesn't add up to the message length
+def message_dtype(fmt, columns, length):
+    if len(fmt) != len(columns) or not all([ c in field_types for c in fmt ]):
+        return None
+    fields = [ ("_sync", "S2"), ("_id", "u1") ]
+    for c, column in zip(fmt, columns):
+        fields.append( (column, field_types[c]) )
+    try:
+        dtype = np.dtype(fields)
+    except (ValueError, TypeError):
+        return None
+    if dtype.itemsize != length:
+        return None
+    return dtype
+
+# a plausible FMT message: printable name and format, a length that holds
+# at least the header and, when every field type is known, matches the
+# field sizes
+def valid_format(name, fmt, length):
+    if not len(name) or not name.isprintable() or not fmt.isprintable() \
+       or length < 3:
+        return False
+    if all([ c in field_types for c in fmt ]):
+        size = 3 + sum([ np.dtype(field_types[c]).itemsize for c in fmt ])
+        return size == length
+    return True
+
+# the message types defined by the FMT messages of the log: {type id:
+# {"name", "length", "format", "columns", "dtype"}}.  FMT messages can be
+# anywhere in the log (newer firmware writes each one just before the
+# first message of its type.)  Every format is kept (its length is needed
+# to walk the log), dtype is None for the ones that can't be decoded.
+def read_formats(buf):
+    result = {}
+    head = sync + bytes([fmt_type])
+    candidates = np.flatnonzero((buf[:-2] == head[0]) & (buf[1:-1] == head[1])
+                                & (buf[2:] == head[2]))
+    candidates = candidates[candidates + fmt_length <= len(buf)]
+    if not len(candidates):
+        return result
+    raw = buf[candidates[:,None] + np.arange(fmt_length)]
+    for fmt in raw.view(fmt_dtype).reshape(-1):
+        if fmt["type"] in result:
+            continue
+        name = text(fmt["name"])
+        format = text(fmt["format"])
+        if not valid_format(name, format, int(fmt["length"])):
+            # not a real FMT message (the sync bytes inside a payload)
+            continue
+        columns = text(fmt["columns"]).split(",")
+        result[int(fmt["type"])] = { "name": name,
+                                     "length": int(fmt["length"]),
+                                     "format": format,
+                                     "columns": columns,
+                                     "dtype": message_dtype(format, columns, fmt["length"]) }
+    return result
+
+# offsets and type ids of the messages in the log.  Walks the chain of
+# sync bytes using the message lengths.  A message that isn't followed by
+# another sync (or the end of the log) is corrupt: it is dropped and the
+# walk resyncs at the next sync bytes.
+def find_messages(buf, fmts):
+    lengths = np.zeros(256, dtype=np.int64)
+    lengths[fmt_type] = fmt_length
+    for type_id, fmt in fmts.items():
+        lengths[type_id] = fmt["length"]
+    starts = np.flatnonzero((buf[:-2] == sync[0]) & (buf[1:-1] == sync[1]))
+    ids = buf[starts + 2]
+    known = lengths[ids] > 0
+    starts = starts[known]
+    ids = ids[known]
+    ends = starts + lengths[ids]
+
+    # following[i] = index of the candidate that starts where i ends,
+    # len(starts) if i ends at the end of the log, -1 otherwise
+    following = np.searchsorted(starts, ends)
+    clipped = np.minimum(following, len(starts) - 1)
+    following = np.where(starts[clipped] == ends, following, -1)
+    following[ends == len(buf)] = len(starts)
+    following = following.tolist()
+
+    chain = []
+    i = 0
+    while i < len(following):
+        j = following[i]
+        if j < 0:
+            i += 1
+        else:
+            chain.append(i)
+            i = j
+    chain = np.array(chain, dtype=np.int64)
+    return starts[chain], ids[chain]
+
+# decode the structured records of a message type to {column name: array},
+# numbers as float64 in the text log units, strings as str
+def decode(records, fmt):
+    result = {}
+    for c, column in zip(fmt["format"], fmt["columns"]):
+        values = records[column]
+        if values.dtype.kind == "S":
+            result[column] = np.char.decode(np.char.rstrip(values, b"\x00"),
+                                            "ascii", "replace")
+        elif c in field_scales:
+            result[column] = values * field_scales[c]
+        else:
+            result[column] = values.astype(np.float64)
+    return result
+
+# all the messages of a log: {message name: {column name: array}} (the
+# same layout as ardupilot_log.read_messages()).  names limits the message
+# types that are decoded (default: all).  With time_range = (t0, t1) the
+# messages past t1 are dropped after decoding.
+def read_messages(filename, names=None, time_range=None):
+    buf = np.memmap(filename, dtype=np.uint8, mode="r")
+    fmts = read_formats(buf)
+    starts, ids = find_messages(buf, fmts)
+    result = {}
+    for type_id, fmt in fmts.items():
+        if type_id == fmt_type or fmt["dtype"] is None \
+           or (names is not None and not fmt["name"] in names):
+            continue
+        offsets = starts[ids == type_id]
+        if not len(offsets):
+            continue
+        raw = buf[offsets[:,None] + np.arange(fmt["length"])]
+        msg = decode(raw.view(fmt["dtype"]).reshape(-1), fmt)
+        if time_range is not None and fmt["columns"][0] == "TimeUS":
+            msg = columnar.select(msg, msg["TimeUS"] <= time_range[1] * 1e6)
+        result[fmt["name"]] = msg
+    return result
+
+# load the flight as a dict of channels, each channel a dict of field name
+# -> numpy array.  time_range = (t0, t1) only keeps records inside that
+# window
+def load_columns(bin_file, time_range=None):
+    msgs = read_messages(bin_file, ardupilot_log.used_messages(), time_range)
+    return ardupilot_log.build_channels(msgs, time_range)
+
+def load(bin_file, time_range=None):
+    return columnar.flight_to_records(load_columns(bin_file, time_range))
+
+# ardupilot dataflash log (starts with a FMT message)
+def sniff(path):
+    if formats.extension(path) == ".bin" \
+       and formats.read_head(path, 3) == sync + bytes([fmt_type]):
+        return path
+    return None
+
+formats.register("ardupilot_bin", sys.modules[__name__], sniff,
+                 description="ardupilot dataflash log", time_range=True)
@@ -1,10 +1,21 @@
 # load a ardupilot log file
+#
+# The text log starts with FMT messages that define the name, format and
+# column names of every other message type.  The parser reads those and
+# dispatches each line on its message name, only the message types that
+# are needed are collected and parsed, a chunk at a time, into typed numpy
+# arrays keyed by their FMT column names.  The flight
+# channels are then built from the message arrays with whole array
+# operations (build_channels(), shared with the binary dataflash reader.)
 
-import csv
-from copy import copy
 import math
 import numpy as np
 import re
+import sys
+import warnings
+
+from .. import columnar
+from .. import formats
 
 d2r = math.pi / 180.0
 r2d = 180.0/ math.pi
@@ -14,149 +25,335 @@ m2ft = 1.0 / 0.3048
 select_imu = "IMU2"
 select_mag = "MAG2"
 
+fmt_lines = re.compile(r"\nFMT,([^\n]*)")
+
+# approximate bytes of log text per chunk of the streaming parser
+chunk_bytes = 8 * 1024 * 1024
+
 # convert value (string) to float, check for "" and return 0.0
 def my_float(value):
     if value != "":
         return float(value)
     else:
         return 0.0
-    
-def load(csv_file):
+
+# the message types build_channels() uses
+def used_messages():
+    return [ select_imu, select_mag, "GPS", "ARSP", "BARO", "NKF1", "NKF2",
+             "AHR2", "AETR", "AUTO", "EFF" ]
+
+# convert the text fields of one column to an array: floats if they all
+# parse (empty fields are 0.0, like my_float()), otherwise strings
+def text_column(values):
+    try:
+        return np.array([ my_float(v.strip()) for v in values ])
+    except ValueError:
+        return np.array([ v.strip() for v in values ])
+
+# convert the lines of one message type (the text after the message name)
+# to {column name: array}.  All numeric messages are parsed in one C level
+# pass, the rest (empty or text fields) column by column.  Truncated or
+# malformed lines are dropped.
+def parse_lines(lines, fields):
+    text = ",".join(lines).replace("\r", "")
+    values = None
+    # np.fromstring() reads an empty field as -1, those take the slow path
+    if not (",," in text or ", ," in text or text.rstrip().endswith(",")):
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("error")
+                values = np.fromstring(text, sep=",")
+        except (ValueError, DeprecationWarning):
+            values = None
+    result = {}
+    if values is not None and len(values) == len(lines) * len(fields):
+        values = values.reshape(len(lines), len(fields))
+        for j, field in enumerate(fields):
+            result[field] = values[:,j].copy()
+    else:
+        rows = [ line.rstrip("\r").split(",") for line in lines ]
+        rows = [ row for row in rows if len(row) == len(fields) ]
+        if len(rows):
+            for field, column in zip(fields, zip(*rows)):
+                result[field] = text_column(column)
+    return result
+
+# regular expression that finds the lines of the given message types
+def message_lines(names):
+    return re.compile(r"^(" + "|".join([ re.escape(n) for n in names ]) + r"),(.*)$", re.M)
+
+# stream a text log, yielding {message name: {column name: array}} for
+# every chunk_bytes (approximately) of the log.  names limits the message
+# types that are accumulated (default: all).  The lines of a chunk are
+# dispatched on their message name by one regular expression scan and the
+# numbers are parsed in bulk.  With time_range = (t0, t1) parsing stops at
+# the first message with a TimeUS past t1 (time stamps are assumed to
+# increase within each message type.)
+def iter_messages(filename, names=None, time_range=None, chunk_bytes=chunk_bytes):
+    columns = {}        # message name -> FMT column names
+    timed = {}          # message name -> first column is TimeUS
+    pattern = None
+    stop_us = None
+    if time_range is not None:
+        stop_us = time_range[1] * 1e6
+
+    with open(filename, "r") as f:
+        done = False
+        while not done:
+            text = f.read(chunk_bytes)
+            if not len(text):
+                break
+            text = "\n" + text + f.readline()
+            for line in fmt_lines.findall(text):
+                parts = [ p.strip() for p in line.split(",") ]
+                if len(parts) >= 4 and parts[2] != "FMT" \
+                   and (names is None or parts[2] in names) \
+                   and not parts[2] in columns:
+                    columns[parts[2]] = parts[4:]
+                    timed[parts[2]] = parts[4:5] == ["TimeUS"]
+                    pattern = message_lines(columns.keys())
+            if pattern is None:
+                continue
+            lines = {}
+            for name, line in pattern.findall(text):
+                lines.setdefault(name, []).append(line)
+            chunk = {}
+            for name in lines:
+                msg = parse_lines(lines[name], columns[name])
+                if not len(msg):
+                    continue
+                if stop_us is not None and timed[name] \
+                   and msg["TimeUS"].dtype.kind == "f":
+                    past = np.flatnonzero(msg["TimeUS"] > stop_us)
+                    if len(past):
+                        msg = columnar.select(msg, slice(0, past[0]))
+                        done = True
+                if columnar.size(msg):
+                    chunk[name] = msg
+            if len(chunk):
+                yield chunk
+
+# all the messages of a log: {message name: {column name: array}}
+def read_messages(filename, names=None, time_range=None):
+    chunks = {}
+    for chunk in iter_messages(filename, names, time_range):
+        for name, fields in chunk.items():
+            chunks.setdefault(name, []).append(fields)
+    result = {}
+    for name, parts in chunks.items():
+        result[name] = {}
+        for field in parts[0]:
+            result[name][field] = np.concatenate([ p[field] for p in parts ])
+    return result
+
+# the rows of a message type from the primary ekf core only (when the
+# message has a core column)
+def primary_core(msg):
+    if "C" in msg:
+        return columnar.select(msg, msg["C"] == 0)
+    return msg
+
+# "as of" join: the fields of the latest msg row at or before each of the
+# times (nan where there is none yet)
+def asof(msg, fields, times):
+    result = {}
+    if msg is None or not len(msg["TimeUS"]):
+        for field in fields:
+            result[field] = np.full(len(times), np.nan)
+        return result
+    i = np.searchsorted(msg["TimeUS"] / 1e6, times, side="right") - 1
+    valid = i >= 0
+    for field in fields:
+        values = np.full(len(times), np.nan)
+        values[valid] = msg[field][i[valid]]
+        result[field] = values
+    return result
+
+# index of the records whose time is inside time_range
+def in_range(times, time_range):
+    if time_range is None:
+        return np.ones(len(times), dtype=bool)
+    return (times >= time_range[0]) & (times <= time_range[1])
+
+# build the flight channels from the message arrays ({message name:
+# {column name: array}}, values in the text log units).  A channel record
+# is emitted per message of its trigger type, combined with the latest
+# values of the other message types it uses.
+def build_channels(msgs, time_range=None):
     result = {}
-    result["imu"] = []
-    result["gps"] = []
-    result["air"] = []
-    result["filter"] = []
-    result["pilot"] = []
-    #result["act"] = []
-    #result["ap"] = []
-
-    imu = {}
-    nav = {}
-    air = {}
-    
-    last_gps_time = -1.0
-    with open(csv_file, "r") as f:
-        reader = csv.reader(f)
-        for row in reader:
-            #print(row)
-            if row[0] == select_imu:
-                imu["time"] = float(row[1]) / 1e6
-                imu["p"] = float(row[2])
-                imu["q"] = float(row[3])
-                imu["r"] = float(row[4])
-                imu["ax"] = float(row[5])
-                imu["ay"] = float(row[6])
-                imu["az"] = float(row[7])
-                imu["temp"] = float(row[10])
-            if row[0] == select_mag:
-                imu["hx"] = float(row[2])
-                imu["hy"] = float(row[3])
-                imu["hz"] = float(row[4])
-                # hf = np.array( [hx, hy, hz] )
-                # norm = np.linalg.norm(hf)
-                # hf /= norm
-                # imu["hx"] = hf[0]
-                # imu["hy"] = hf[1]
-                # imu["hz"] = hf[2]
-                #print imu["hx, imu["hy, imu["hz
-                result["imu"].append( copy(imu) )
-            if row[0] == "GPS":
-                gps = {}
-                gps["time"] = float(row[1]) / 1e6
-                gps["unix_sec"] = gps["time"]
-                gps["lat"] = float(row[7])
-                gps["lon"] = float(row[8])
-                gps["alt"] = float(row[9])
-                speed_mps = float(row[10])
-                course_deg = float(row[11])
-                angle_rad = (90 - course_deg) * d2r
-                gps["vn"] = math.sin(angle_rad) * speed_mps
-                gps["ve"] = math.cos(angle_rad) * speed_mps
-                gps["vd"] = float(row[12])
-                gps["sats"] = int(row[5])
-                if gps["sats"] >= 5 and gps["unix_sec"] > last_gps_time:
-                    result["gps"].append(gps)
-                last_gps_time = gps["unix_sec"]
-
-            if row[0] == "ARSP":
-                air["airspeed"] = float(row[2]) * mps2kt
-                air["diff_press"] = float(row[3])
-            if row[0] == "BARO":
-                air["time"] = float(row[1]) / 1e6
-                air["static_press"] = float(row[3])
-                air["temp"] = float(row[4])
-                air["alt_press"] = float(row[2])
-                air["alt_true"] = 0.0
-                result["air"].append( copy(air) )
-
-            if row[0] == "NKF1":
-                nav["vn"] = float(row[5])
-                nav["ve"] = float(row[6])
-                nav["vd"] = float(row[7])
-                nav["p_bias"] = float(row[12])*d2r
-                nav["q_bias"] = float(row[13])*d2r
-                nav["r_bias"] = float(row[14])*d2r
-            if row[0] == "NKF2":
-                nav["az_bias"] = float(row[3])
-            if row[0] == "AHR2":
-                nav["time"] = float(row[1]) / 1e6
-                nav["lat"] = float(row[6])*d2r
-                nav["lon"] = float(row[7])*d2r
-                nav["alt"] = float(row[5])
-                nav["phi"] = float(row[2])*d2r
-                nav["the"] = float(row[3])*d2r
-                psi = float(row[4])
-                if psi > 180.0:
-                    psi = psi - 360.0
-                if psi < -180.0:
-                    psi = psi + 360.0
-                nav["psi"] = psi*d2r
-                nav["ax_bias"] = 0
-                nav["ay_bias"] = 0
-                result["filter"].append(copy(nav))
-
-            if row[0] == "AETR":
-                pilot = {
-                    "time": float(row[1]) / 1e6,
-                    "auto_manual": 0,
-                    "throttle_safety": 0,
-                    "aileron": float(row[2]) / 100.0,
-                    "elevator": float(row[3]) / 100.0,
-                    "throttle": float(row[4]) / 100.0,
-                    "rudder": float(row[5]) / 100.0,
-                    "flaps": 0,
-                    "aux1": 0,
-                    "geare": 0
-                }
-                result["pilot"].append(pilot)
-                
-            if row[0] == "AUTO":
-                ap = Record()
-                ap.time = imu.time
-                ap.hdg = my_float(row["ATSP_YawSP"]) * r2d
-                ap.roll = my_float(row["ATSP_RollSP"]) * r2d
-                ap.alt = my_float(row["GPSP_Alt"]) * m2ft
-                ap.pitch = my_float(row["ATSP_PitchSP"]) * r2d
-                ap.speed = my_float(row["TECS_AsSP"]) * mps2kt
-                result["ap"].append(ap)
-                
-            if row[0] == "EFF":
-                act = Record()
-                ch0 = (float(row["OUT0_Out0"]) - 1500) / 500
-                ch1 = (float(row["OUT0_Out1"]) - 1500) / 500 
-                ch2 = (float(row["OUT0_Out2"]) - 1000) / 1000
-                ch3 = (float(row["OUT0_Out3"]) - 1500) / 500
-                #print ch0, ch1, ch2, ch3
-                act.time = imu.time
-                act.aileron = (ch0 - ch1)
-                act.elevator = -(ch0 + ch1)
-                act.throttle = ch2
-                act.rudder = ch3
-                act.gear = 0.0
-                act.flaps = 0.0
-                act.aux1 = 0.0
-                act.auto_manual = 0.0
-                result["act"].append(act)
+    empty = np.zeros(0)
+
+    # imu: one record per magnetometer sample with the latest imu sample
+    imu = msgs.get(select_imu)
+    mag = msgs.get(select_mag)
+    if mag is not None and imu is not None:
+        mag_time = mag["TimeUS"] / 1e6
+        latest = asof(imu, ["TimeUS", "GyrX", "GyrY", "GyrZ", "AccX", "AccY", "AccZ", "T"], mag_time)
+        keep = in_range(mag_time, time_range) & np.isfinite(latest["TimeUS"])
+        result["imu"] = columnar.select({
+            "time": latest["TimeUS"] / 1e6,
+            "p": latest["GyrX"],
+            "q": latest["GyrY"],
+            "r": latest["GyrZ"],
+            "ax": latest["AccX"],
+            "ay": latest["AccY"],
+            "az": latest["AccZ"],
+            "temp": latest["T"],
+            "hx": mag["MagX"],
+            "hy": mag["MagY"],
+            "hz": mag["MagZ"]
+        }, keep)
+    else:
+        result["imu"] = { "time": empty }
+
+    gps = msgs.get("GPS")
+    if gps is not None:
+        time = gps["TimeUS"] / 1e6
+        speed_mps = gps["Spd"]
+        angle_rad = (90 - gps["GCrs"]) * d2r
+        sats = gps["NSats"].astype(int)
+        last_gps_time = np.concatenate( ([-1.0], time[:-1]) )
+        keep = (sats >= 5) & (time > last_gps_time) & in_range(time, time_range)
+        result["gps"] = columnar.select({
+            "time": time,
+            "unix_sec": time,
+            "lat": gps["Lat"],
+            "lon": gps["Lng"],
+            "alt": gps["Alt"],
+            "vn": np.sin(angle_rad) * speed_mps,
+            "ve": np.cos(angle_rad) * speed_mps,
+            "vd": gps["VZ"],
+            "sats": sats
+        }, keep)
+    else:
+        result["gps"] = { "time": empty }
+
+    # air: one record per baro sample with the latest airspeed sample
+    baro = msgs.get("BARO")
+    if baro is not None:
+        time = baro["TimeUS"] / 1e6
+        arsp = asof(msgs.get("ARSP"), ["Airspeed", "DiffPress"], time)
+        result["air"] = columnar.select({
+            "time": time,
+            "airspeed": arsp["Airspeed"] * mps2kt,
+            "diff_press": arsp["DiffPress"],
+            "static_press": baro["Press"],
+            "temp": baro["Temp"],
+            "alt_press": baro["Alt"],
+            "alt_true": np.zeros(len(time))
+        }, in_range(time, time_range))
+    else:
+        result["air"] = { "time": empty }
+
+    # filter: one record per AHR2 sample with the latest ekf velocities
+    # and biases
+    ahr2 = msgs.get("AHR2")
+    if ahr2 is not None:
+        time = ahr2["TimeUS"] / 1e6
+        nkf1 = msgs.get("NKF1")
+        nkf2 = msgs.get("NKF2")
+        if nkf1 is not None:
+            nkf1 = primary_core(nkf1)
+        if nkf2 is not None:
+            nkf2 = primary_core(nkf2)
+        ekf1 = asof(nkf1, ["VN", "VE", "VD", "GX", "GY", "GZ"], time)
+        ekf2 = asof(nkf2, ["AZbias"], time)
+        psi = ahr2["Yaw"]
+        psi = np.where(psi > 180.0, psi - 360.0, psi)
+        psi = np.where(psi < -180.0, psi + 360.0, psi)
+        result["filter"] = columnar.select({
+            "time": time,
+            "lat": ahr2["Lat"]*d2r,
+            "lon": ahr2["Lng"]*d2r,
+            "alt": ahr2["Alt"],
+            "vn": ekf1["VN"],
+            "ve": ekf1["VE"],
+            "vd": ekf1["VD"],
+            "phi": ahr2["Roll"]*d2r,
+            "the": ahr2["Pitch"]*d2r,
+            "psi": psi*d2r,
+            "p_bias": ekf1["GX"]*d2r,
+            "q_bias": ekf1["GY"]*d2r,
+            "r_bias": ekf1["GZ"]*d2r,
+            "ax_bias": np.zeros(len(time), dtype=int),
+            "ay_bias": np.zeros(len(time), dtype=int),
+            "az_bias": ekf2["AZbias"]
+        }, in_range(time, time_range))
+    else:
+        result["filter"] = { "time": empty }
+
+    aetr = msgs.get("AETR")
+    if aetr is not None:
+        time = aetr["TimeUS"] / 1e6
+        zeros = np.zeros(len(time), dtype=int)
+        result["pilot"] = columnar.select({
+            "time": time,
+            "auto_manual": zeros,
+            "throttle_safety": zeros,
+            "aileron": aetr["Ail"] / 100.0,
+            "elevator": aetr["Elev"] / 100.0,
+            "throttle": aetr["Thr"] / 100.0,
+            "rudder": aetr["Rudd"] / 100.0,
+            "flaps": zeros,
+            "aux1": zeros,
+            "gear": zeros
+        }, in_range(time, time_range))
+    else:
+        result["pilot"] = { "time": empty }
+
+    # autopilot targets and effector outputs (px4 style field names) are
+    # stamped with the latest imu time
+    auto = msgs.get("AUTO")
+    auto_fields = ["ATSP_YawSP", "ATSP_RollSP", "GPSP_Alt", "ATSP_PitchSP", "TECS_AsSP"]
+    if auto is not None and imu is not None and all([ f in auto for f in auto_fields ]):
+        time = asof(imu, ["TimeUS"], auto["TimeUS"] / 1e6)["TimeUS"] / 1e6
+        result["ap"] = columnar.select({
+            "time": time,
+            "hdg": auto["ATSP_YawSP"] * r2d,
+            "roll": auto["ATSP_RollSP"] * r2d,
+            "alt": auto["GPSP_Alt"] * m2ft,
+            "pitch": auto["ATSP_PitchSP"] * r2d,
+            "speed": auto["TECS_AsSP"] * mps2kt
+        }, in_range(time, time_range))
+    eff = msgs.get("EFF")
+    eff_fields = [ "OUT0_Out%d" % i for i in range(4) ]
+    if eff is not None and imu is not None and all([ f in eff for f in eff_fields ]):
+        time = asof(imu, ["TimeUS"], eff["TimeUS"] / 1e6)["TimeUS"] / 1e6
+        ch0 = (eff["OUT0_Out0"] - 1500) / 500
+        ch1 = (eff["OUT0_Out1"] - 1500) / 500
+        ch2 = (eff["OUT0_Out2"] - 1000) / 1000
+        ch3 = (eff["OUT0_Out3"] - 1500) / 500
+        zeros = np.zeros(len(time))
+        result["act"] = columnar.select({
+            "time": time,
+            "aileron": (ch0 - ch1),
+            "elevator": -(ch0 + ch1),
+            "throttle": ch2,
+            "rudder": ch3,
+            "gear": zeros,
+            "flaps": zeros,
+            "aux1": zeros,
+            "auto_manual": zeros
+        }, in_range(time, time_range))
 
     return result
+
+# load the flight as a dict of channels, each channel a dict of field name
+# -> numpy array.  time_range = (t0, t1) only keeps records inside that
+# window and stops parsing the log once past t1
+def load_columns(csv_file, time_range=None):
+    msgs = read_messages(csv_file, used_messages(), time_range)
+    return build_channels(msgs, time_range)
+
+def load(csv_file, time_range=None):
+    return columnar.flight_to_records(load_columns(csv_file, time_range))
+
+# ardupilot text log (starts with the FMT message definitions)
+def sniff(path):
+    if formats.extension(path) == ".log" \
+       and formats.read_head(path).lstrip().startswith(b"FMT"):
+        return path
+    return None
+
+formats.register("ardupilot_log", sys.modules[__name__], sniff,
+                 description="ardupilot log", time_range=True)
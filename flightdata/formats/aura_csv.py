@@ -3,296 +3,306 @@
 import csv
 import os
 import math
+import numpy as np
+import pandas as pd
 import re
+import sys
+
+from .. import columnar
+from .. import formats
 
  # from . import imucal
 
 d2r = math.pi / 180.0
 
+# rows per chunk when a time_range read stops early
+chunk_rows = 20000
+
 # empty class we'll fill in with data members
 # class Record: pass (deprecated)
 
-def load(flight_dir):
-    result = {}
+# read a whole csv log file with the pandas C parser into a dict of column
+# name -> numpy array (the header is read once, the numbers are parsed in
+# bulk and round trip exactly like float()).  With time_range = (t0, t1)
+# the file is read in chunks and parsing stops with the chunk that passes
+# t1, then the rows before t0 and everything from the first row past t1 on
+# are dropped.
+def read_columns(filename, time_range=None):
+    options = { 'engine': 'c', 'float_precision': 'round_trip' }
+    try:
+        if time_range is None:
+            df = pd.read_csv(filename, **options)
+        else:
+            chunks = []
+            for chunk in pd.read_csv(filename, chunksize=chunk_rows, **options):
+                chunks.append(chunk)
+                if (chunk['timestamp'].to_numpy(dtype=float) > time_range[1]).any():
+                    break
+            if not len(chunks):
+                return {}
+            df = pd.concat(chunks)
+    except pd.errors.EmptyDataError:
+        return {}
+    columns = {}
+    for key in df.columns:
+        columns[key] = df[key].to_numpy()
+    if time_range is not None and 'timestamp' in columns:
+        time = np.asarray(columns['timestamp'], dtype=float)
+        past = np.flatnonzero(time > time_range[1])
+        end = past[0] if len(past) else len(time)
+        keep = time[:end] >= time_range[0]
+        for key in columns:
+            columns[key] = columns[key][:end][keep]
+    return columns
 
-    # load imu/gps data files
-    event_file = os.path.join(flight_dir, "event-0.csv")
-    imu_file = os.path.join(flight_dir, "imu-0.csv")
-    # imucal_json = os.path.join(flight_dir, "imucal.json")
-    gps_file = os.path.join(flight_dir, "gps-0.csv")
-    air_file = os.path.join(flight_dir, "air-0.csv")
-    filter_file = os.path.join(flight_dir, "filter-0.csv")
-    filter_post = os.path.join(flight_dir, "filter-post.csv")
-    pilot_file = os.path.join(flight_dir, "pilot-0.csv")
-    act_file = os.path.join(flight_dir, "act-0.csv")
-    ap_file = os.path.join(flight_dir, "ap-0.csv")
-    health_file = os.path.join(flight_dir, "health-0.csv")
-    imu_bias_file = os.path.join(flight_dir, "imubias.csv")
+# a column as floats (an empty array if the file had no header at all)
+def floats(columns, key):
+    if not len(columns):
+        return np.zeros(0)
+    return np.asarray(columns[key], dtype=float)
+
+def ints(columns, key):
+    if not len(columns):
+        return np.zeros(0, dtype=int)
+    return np.asarray(columns[key]).astype(int)
+
+# the first of several alternative column names present in the file
+def first_column(columns, keys):
+    for key in keys:
+        if key in columns:
+            return key
+    return None
+
+# wrap angle (radians) into the +/- pi range (single wrap, like the
+# original per-record code.)
+def wrap_pi(psi):
+    psi = np.where(psi > math.pi, psi - 2*math.pi, psi)
+    psi = np.where(psi < -math.pi, psi + 2*math.pi, psi)
+    return psi
 
+# the events inside time_range, and the pilot input mapping (scanned from
+# all the events)
+def load_events(flight_dir, time_range=None):
     pilot_mapping = 'Aura3'       # APM2 or Aura3
-    result['event'] = []
-    with open(event_file, 'r') as fevent:
+    time = []
+    message = []
+    with open(os.path.join(flight_dir, "event-0.csv"), 'r') as fevent:
         reader = csv.DictReader(fevent)
         for row in reader:
             msg = row['message']
             if type(msg) == bytes:
                 msg = msg.decode()
-            event = {
-                'time': float(row['timestamp']),
-                'message': msg
-            }
-            if 'Aura3' in event['message']:
+            t = float(row['timestamp'])
+            if 'Aura3' in msg:
                 pilot_mapping = 'Aura3'
-            elif 'APM2' in event['message']:
+            elif 'APM2' in msg:
                 pilot_mapping = 'APM2'
-            result['event'].append( event )
+            # all events are scanned for the pilot mapping, but only those
+            # inside the time range are kept
+            if time_range is None or (t >= time_range[0] and t <= time_range[1]):
+                time.append(t)
+                message.append(msg)
+    event = {
+        'time': np.array(time, dtype=float),
+        'message': np.array(message, dtype=str)
+    }
+    return event, pilot_mapping
 
-    result['imu'] = []
-    with open(imu_file, 'r') as fimu:
-        reader = csv.DictReader(fimu)
-        for row in reader:
-            imu = {
-                'time': float(row['timestamp']),
-                'p': float(row['p_rad_sec']),
-                'q': float(row['q_rad_sec']),
-                'r': float(row['r_rad_sec']),
-                'ax': float(row['ax_mps_sec']),
-                'ay': float(row['ay_mps_sec']),
-                'az': float(row['az_mps_sec']),
-                'hx': float(row['hx']),
-                'hy': float(row['hy']),
-                'hz': float(row['hz']),
-                'temp': float(row['temp_C'])
-            }
-            result['imu'].append( imu )
-
-    result['gps'] = []
-    last_time = -1.0
-    with open(gps_file, 'r') as fgps:
-        reader = csv.DictReader(fgps)
-        for row in reader:
-            # Note: aurauas logs unix time of the gps record, not tow,
-            # but for the purposes of the insgns algorithm, it's only
-            # important to have a properly incrementing clock, it doesn't
-            # really matter what the zero reference point of time is here.
-            time = float(row['timestamp'])
-            sats = int(row['satellites'])
-            if sats >= 5 and time > last_time:
-                gps = {
-                    'time': time,
-                    'unix_sec': float(row['unix_time_sec']),
-                    'lat': float(row['latitude_deg']),
-                    'lon': float(row['longitude_deg']),
-                    'alt': float(row['altitude_m']),
-                    'vn': float(row['vn_ms']),
-                    've': float(row['ve_ms']),
-                    'vd': float(row['vd_ms']),
-                    'sats': sats
-                }
-                result['gps'].append(gps)
-            last_time = time
-
-    result['air'] = []
-    with open(air_file, 'r') as fair:
-        reader = csv.DictReader(fair)
-        for row in reader:
-            air = {
-                'time': float(row['timestamp']),
-                'static_press': float(row['pressure_mbar']),
-                'diff_press': 0.0, # not directly available in aura flight log
-                'temp': float(row['temp_C']),
-                'airspeed': float(row['airspeed_smoothed_kt']),
-                'alt_press': float(row['altitude_smoothed_m']),
-                'alt_true': float(row['altitude_true_m']),
-                'wind_dir': float(row['wind_dir_deg']),
-                'wind_speed': float(row['wind_speed_kt']),
-                'pitot_scale': float(row['pitot_scale_factor'])
-            }
-            result['air'].append( air )
-
-    # load filter records if they exist (for comparison purposes)
-    result['filter'] = []
-    with open(filter_file, 'r') as ffilter:
-        reader = csv.DictReader(ffilter)
-        for row in reader:
-            lat = float(row['latitude_deg'])
-            lon = float(row['longitude_deg'])
-            psi_deg = float(row['heading_deg'])
-            psi = psi_deg*d2r
-            if psi > math.pi:
-                psi -= 2*math.pi
-            if psi < -math.pi:
-                psi += 2*math.pi
-            psix = math.cos(psi)
-            psiy = math.sin(psi)
-            if abs(lat) > 0.0001 and abs(lon) > 0.0001:
-                nav = {
-                    'time': float(row['timestamp']),
-                    'lat': lat*d2r,
-                    'lon': lon*d2r,
-                    'alt': float(row['altitude_m']),
-                    'vn': float(row['vn_ms']),
-                    've': float(row['ve_ms']),
-                    'vd': float(row['vd_ms']),
-                    'phi': float(row['roll_deg'])*d2r,
-                    'the': float(row['pitch_deg'])*d2r,
-                    'psi': psi,
-                    'psix': psix,
-                    'psiy': psiy,
-                    'p_bias': float(row['p_bias']),
-                    'q_bias': float(row['q_bias']),
-                    'r_bias': float(row['r_bias']),
-                    'ax_bias': float(row['ax_bias']),
-                    'ay_bias': float(row['ay_bias']),
-                    'az_bias': float(row['az_bias'])
-                }
-                result['filter'].append(nav)
-
-    # load filter (post process) records if they exist (for comparison
-    # purposes)
-    if os.path.exists(filter_post):
-        result['filter_post'] = []
-        with open(filter_post, 'r') as ffilter:
-            reader = csv.DictReader(ffilter)
-            for row in reader:
-                lat = float(row['latitude_deg'])
-                lon = float(row['longitude_deg'])
-                psi_deg = float(row['heading_deg'])
-                psi = psi_deg*d2r
-                if psi > math.pi:
-                    psi -= 2*math.pi
-                if psi < -math.pi:
-                    psi += 2*math.pi
-                psix = math.cos(psi)
-                psiy = math.sin(psi)
-                if abs(lat) > 0.0001 and abs(lon) > 0.0001:
-                    nav = {
-                        'time': float(row['timestamp']),
-                        'lat': lat*d2r,
-                        'lon': lon*d2r,
-                        'alt': float(row['altitude_m']),
-                        'vn': float(row['vn_ms']),
-                        've': float(row['ve_ms']),
-                        'vd': float(row['vd_ms']),
-                        'phi': float(row['roll_deg'])*d2r,
-                        'the': float(row['pitch_deg'])*d2r,
-                        'psi': psi,
-                        'psix': psix,
-                        'psiy': psiy,
-                        'p_bias': float(row['p_bias']),
-                        'q_bias': float(row['q_bias']),
-                        'r_bias': float(row['r_bias']),
-                        'ax_bias': float(row['ax_bias']),
-                        'ay_bias': float(row['ay_bias']),
-                        'az_bias': float(row['az_bias'])
-                    }
-                    result['filter_post'].append(nav)
+def load_imu(flight_dir, time_range=None):
+    imu = read_columns(os.path.join(flight_dir, "imu-0.csv"), time_range)
+    return {
+        'time': floats(imu, 'timestamp'),
+        'p': floats(imu, 'p_rad_sec'),
+        'q': floats(imu, 'q_rad_sec'),
+        'r': floats(imu, 'r_rad_sec'),
+        'ax': floats(imu, 'ax_mps_sec'),
+        'ay': floats(imu, 'ay_mps_sec'),
+        'az': floats(imu, 'az_mps_sec'),
+        'hx': floats(imu, 'hx'),
+        'hy': floats(imu, 'hy'),
+        'hz': floats(imu, 'hz'),
+        'temp': floats(imu, 'temp_C')
+    }
+
+def load_gps(flight_dir, time_range=None):
+    gps = read_columns(os.path.join(flight_dir, "gps-0.csv"), time_range)
+    # Note: aurauas logs unix time of the gps record, not tow,
+    # but for the purposes of the insgns algorithm, it's only
+    # important to have a properly incrementing clock, it doesn't
+    # really matter what the zero reference point of time is here.
+    time = floats(gps, 'timestamp')
+    sats = ints(gps, 'satellites')
+    last_time = np.concatenate( ([-1.0], time[:-1]) )
+    valid = (sats >= 5) & (time > last_time)
+    result = {
+        'time': time,
+        'unix_sec': floats(gps, 'unix_time_sec'),
+        'lat': floats(gps, 'latitude_deg'),
+        'lon': floats(gps, 'longitude_deg'),
+        'alt': floats(gps, 'altitude_m'),
+        'vn': floats(gps, 'vn_ms'),
+        've': floats(gps, 've_ms'),
+        'vd': floats(gps, 'vd_ms'),
+        'sats': sats
+    }
+    return columnar.select(result, valid)
+
+def load_air(flight_dir, time_range=None):
+    air = read_columns(os.path.join(flight_dir, "air-0.csv"), time_range)
+    time = floats(air, 'timestamp')
+    return {
+        'time': time,
+        'static_press': floats(air, 'pressure_mbar'),
+        'diff_press': np.zeros(len(time)), # not directly available in aura flight log
+        'temp': floats(air, 'temp_C'),
+        'airspeed': floats(air, 'airspeed_smoothed_kt'),
+        'alt_press': floats(air, 'altitude_smoothed_m'),
+        'alt_true': floats(air, 'altitude_true_m'),
+        'wind_dir': floats(air, 'wind_dir_deg'),
+        'wind_speed': floats(air, 'wind_speed_kt'),
+        'pitot_scale': floats(air, 'pitot_scale_factor')
+    }
+
+# filter records (for comparison purposes), from filter-0.csv or the post
+# processed filter-post.csv
+def load_filter(filename, time_range=None):
+    nav = read_columns(filename, time_range)
+    lat = floats(nav, 'latitude_deg')
+    lon = floats(nav, 'longitude_deg')
+    psi = wrap_pi(floats(nav, 'heading_deg')*d2r)
+    result = {
+        'time': floats(nav, 'timestamp'),
+        'lat': lat*d2r,
+        'lon': lon*d2r,
+        'alt': floats(nav, 'altitude_m'),
+        'vn': floats(nav, 'vn_ms'),
+        've': floats(nav, 've_ms'),
+        'vd': floats(nav, 'vd_ms'),
+        'phi': floats(nav, 'roll_deg')*d2r,
+        'the': floats(nav, 'pitch_deg')*d2r,
+        'psi': psi,
+        'psix': np.cos(psi),
+        'psiy': np.sin(psi),
+        'p_bias': floats(nav, 'p_bias'),
+        'q_bias': floats(nav, 'q_bias'),
+        'r_bias': floats(nav, 'r_bias'),
+        'ax_bias': floats(nav, 'ax_bias'),
+        'ay_bias': floats(nav, 'ay_bias'),
+        'az_bias': floats(nav, 'az_bias')
+    }
+    valid = (np.abs(lat) > 0.0001) & (np.abs(lon) > 0.0001)
+    return columnar.select(result, valid)
+
+def load_pilot(flight_dir, pilot_mapping, time_range=None):
+    pilot = read_columns(os.path.join(flight_dir, "pilot-0.csv"), time_range)
+    time = floats(pilot, 'timestamp')
+    ch = [ floats(pilot, 'channel[%d]' % j) for j in range(8) ]
+    if pilot_mapping == 'Aura3':
+        return {
+            'time': time,
+            'auto_manual': ch[0],
+            'throttle_safety': ch[1],
+            'throttle': ch[2],
+            'aileron': ch[3],
+            'elevator': ch[4],
+            'rudder': ch[5],
+            'flaps': ch[6],
+            'aux1': ch[7],
+            'gear': np.zeros(len(time), dtype=int)
+        }
+    elif pilot_mapping == 'APM2':
+        return {
+            'time': time,
+            'aileron': ch[0],
+            'elevator': -ch[1],
+            'throttle': ch[2],
+            'rudder': ch[3],
+            'gear': ch[4],
+            'flaps': ch[5],
+            'aux1': ch[6],
+            'auto_manual': ch[7],
+            'throttle_safety': np.zeros(len(time))
+        }
+    return {}
+
+def load_act(flight_dir, time_range=None):
+    act = read_columns(os.path.join(flight_dir, "act-0.csv"), time_range)
+    return {
+        'time': floats(act, 'timestamp'),
+        'aileron': floats(act, 'aileron_norm'),
+        'elevator': floats(act, 'elevator_norm'),
+        'throttle': floats(act, 'throttle_norm'),
+        'rudder': floats(act, 'rudder_norm'),
+        'gear': floats(act, 'channel5_norm'),
+        'flaps': floats(act, 'flaps_norm'),
+        'aux1': floats(act, 'channel7_norm'),
+        'auto_manual': floats(act, 'channel8_norm')
+    }
+
+def load_ap(flight_dir, time_range=None):
+    ap = read_columns(os.path.join(flight_dir, "ap-0.csv"), time_range)
+    hdg = floats(ap, 'groundtrack_deg')
+    return {
+        'time': floats(ap, 'timestamp'),
+        'master_switch': ints(ap, 'master_switch'),
+        'pilot_pass_through': ints(ap, 'pilot_pass_through'),
+        'hdg': hdg,
+        'hdgx': np.cos(hdg*d2r),
+        'hdgy': np.sin(hdg*d2r),
+        'roll': floats(ap, 'roll_deg'),
+        'alt': floats(ap, 'altitude_msl_ft'),
+        'pitch': floats(ap, 'pitch_deg'),
+        'speed': floats(ap, 'airspeed_kt'),
+        'ground': floats(ap, 'altitude_ground_m')
+    }
 
+def load_health(flight_dir, time_range=None):
+    health = read_columns(os.path.join(flight_dir, "health-0.csv"), time_range)
+    result = {
+        'time': floats(health, 'timestamp'),
+        'load_avg': floats(health, 'system_load_avg')
+    }
+    # newer and older names of the same fields
+    alternatives = [ ('avionics_vcc', ['avionics_vcc', 'board_vcc']),
+                     ('main_vcc', ['main_vcc', 'extern_volts']),
+                     ('cell_vcc', ['cell_vcc', 'extern_cell_volts']),
+                     ('main_amps', ['main_amps', 'extern_amps']),
+                     ('main_mah', ['total_mah', 'extern_current_mah']) ]
+    for field, keys in alternatives:
+        key = first_column(health, keys)
+        if key is not None:
+            result[field] = floats(health, key)
+    return result
+
+# load the flight as a dict of channels, each channel a dict of field name
+# -> numpy array.  Every csv file is parsed in bulk and the unit
+# conversions and validity filters are whole array operations.
+def load_columns(flight_dir, time_range=None):
+    result = {}
+
+    # imucal_json = os.path.join(flight_dir, "imucal.json")
+    filter_post = os.path.join(flight_dir, "filter-post.csv")
+    pilot_file = os.path.join(flight_dir, "pilot-0.csv")
+    act_file = os.path.join(flight_dir, "act-0.csv")
+    ap_file = os.path.join(flight_dir, "ap-0.csv")
+    health_file = os.path.join(flight_dir, "health-0.csv")
+
+    result['event'], pilot_mapping = load_events(flight_dir, time_range)
+    result['imu'] = load_imu(flight_dir, time_range)
+    result['gps'] = load_gps(flight_dir, time_range)
+    result['air'] = load_air(flight_dir, time_range)
+    result['filter'] = load_filter(os.path.join(flight_dir, "filter-0.csv"), time_range)
+    if os.path.exists(filter_post):
+        result['filter_post'] = load_filter(filter_post, time_range)
     if os.path.exists(pilot_file):
         print('Pilot input mapping:', pilot_mapping)
-        result['pilot'] = []
-        with open(pilot_file, 'r') as fpilot:
-            reader = csv.DictReader(fpilot)
-            for row in reader:
-                if pilot_mapping == 'Aura3':
-                    pilot = {
-                        'time': float(row['timestamp']),
-                        'auto_manual': float(row['channel[0]']),
-                        'throttle_safety': float(row['channel[1]']),
-                        'throttle': float(row['channel[2]']),
-                        'aileron': float(row['channel[3]']),
-                        'elevator': float(row['channel[4]']),
-                        'rudder': float(row['channel[5]']),
-                        'flaps': float(row['channel[6]']),
-                        'aux1': float(row['channel[7]']),
-                        'gear': 0
-                    }
-                elif pilot_mapping == 'APM2':
-                    pilot = {
-                        'time': float(row['timestamp']),
-                        'aileron': float(row['channel[0]']),
-                        'elevator': -float(row['channel[1]']),
-                        'throttle': float(row['channel[2]']),
-                        'rudder': float(row['channel[3]']),
-                        'gear': float(row['channel[4]']),
-                        'flaps': float(row['channel[5]']),
-                        'aux1': float(row['channel[6]']),
-                        'auto_manual': float(row['channel[7]']),
-                        'throttle_safety': 0.0
-                    }
-                result['pilot'].append(pilot)
-
+        result['pilot'] = load_pilot(flight_dir, pilot_mapping, time_range)
     if os.path.exists(act_file):
-        result['act'] = []
-        with open(act_file, 'r') as fact:
-            reader = csv.DictReader(fact)
-            for row in reader:
-                act = {
-                    'time': float(row['timestamp']),
-                    'aileron': float(row['aileron_norm']),
-                    'elevator': float(row['elevator_norm']),
-                    'throttle': float(row['throttle_norm']),
-                    'rudder': float(row['rudder_norm']),
-                    'gear': float(row['channel5_norm']),
-                    'flaps': float(row['flaps_norm']),
-                    'aux1': float(row['channel7_norm']),
-                    'auto_manual': float(row['channel8_norm'])
-                }
-                result['act'].append(act)
-
+        result['act'] = load_act(flight_dir, time_range)
     if os.path.exists(ap_file):
-        result['ap'] = []
-        with open(ap_file, 'r') as fap:
-            reader = csv.DictReader(fap)
-            for row in reader:
-                hdg = float(row['groundtrack_deg'])
-                hdgx = math.cos(hdg*d2r)
-                hdgy = math.sin(hdg*d2r)
-                ap = {
-                    'time': float(row['timestamp']),
-                    'master_switch': int(row['master_switch']),
-                    'pilot_pass_through': int(row['pilot_pass_through']),
-                    'hdg': hdg,
-                    'hdgx': hdgx,
-                    'hdgy': hdgy,
-                    'roll': float(row['roll_deg']),
-                    'alt': float(row['altitude_msl_ft']),
-                    'pitch': float(row['pitch_deg']),
-                    'speed': float(row['airspeed_kt']),
-                    'ground': float(row['altitude_ground_m'])
-                }
-                result['ap'].append(ap)
-
+        result['ap'] = load_ap(flight_dir, time_range)
     if os.path.exists(health_file):
-        result['health'] = []
-        with open(health_file, 'r') as fhealth:
-            reader = csv.DictReader(fhealth)
-            for row in reader:
-                health = {
-                    'time': float(row['timestamp']),
-                    'load_avg': float(row['system_load_avg'])
-                }
-                if 'avionics_vcc' in row:
-                    health['avionics_vcc'] = float(row['avionics_vcc'])
-                elif 'board_vcc' in row:
-                    health['avionics_vcc'] = float(row['board_vcc'])
-                if 'main_vcc' in row:
-                    health['main_vcc'] = float(row['main_vcc'])
-                elif 'extern_volts' in row:
-                    health['main_vcc'] = float(row['extern_volts'])
-                if 'cell_vcc' in row:
-                    health['cell_vcc'] = float(row['cell_vcc'])
-                elif 'extern_cell_volts' in row:
-                    health['cell_vcc'] = float(row['extern_cell_volts'])
-                if 'main_amps' in row:
-                    health['main_amps'] = float(row['main_amps'])
-                elif 'extern_amps' in row:
-                    health['main_amps'] = float(row['extern_amps'])
-                if 'total_mah' in row:
-                    health['main_mah'] = float(row['total_mah'])
-                elif 'extern_current_mah' in row:
-                    health['main_mah'] = float(row['extern_current_mah'])
-                result['health'].append(health)
+        result['health'] = load_health(flight_dir, time_range)
 
     # let us not do this by default, but this could be done externally if
     # the calling script wanted original 'raw' values ... which is probably
@@ -315,6 +325,42 @@ def load(flight_dir):
 
     return result
 
+def load(flight_dir, time_range=None):
+    return columnar.flight_to_records(load_columns(flight_dir, time_range))
+
+# the first and last time stamp of a csv log file.  Only the header, the
+# first row, and the tail of the file are read.
+def time_span(filename, tail_size=4096):
+    with open(filename, 'rb') as f:
+        header = f.readline().decode().strip().split(',')
+        col = header.index('timestamp')
+        first = f.readline().decode().strip()
+        if not len(first):
+            return []
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - tail_size))
+        lines = f.read().decode(errors='replace').strip().splitlines()
+        last = lines[-1]
+    return [ float(first.split(',')[col]), float(last.split(',')[col]) ]
+
+# the small subset of a flight needed to catalog it: the first and last imu
+# time stamp, the gps fixes, and the events
+def load_summary(flight_dir):
+    result = {}
+    result['imu'] = { 'time': time_span(os.path.join(flight_dir, "imu-0.csv")) }
+    gps = read_columns(os.path.join(flight_dir, "gps-0.csv"))
+    result['gps'] = columnar.select( {
+        'time': floats(gps, 'timestamp'),
+        'unix_sec': floats(gps, 'unix_time_sec'),
+        'lat': floats(gps, 'latitude_deg'),
+        'lon': floats(gps, 'longitude_deg')
+    }, ints(gps, 'satellites') >= 5 )
+    if os.path.exists(os.path.join(flight_dir, "event-0.csv")):
+        result['event'], pilot_mapping = load_events(flight_dir)
+    else:
+        result['event'] = { 'time': np.zeros(0), 'message': np.array([], dtype=str) }
+    return result
+
 def save_filter_result(filename, nav):
     keys = ['timestamp', 'latitude_deg', 'longitude_deg', 'altitude_m',
             'vn_ms', 've_ms', 'vd_ms', 'roll_deg', 'pitch_deg', 'heading_deg',
@@ -344,3 +390,12 @@ def save_filter_result(filename, nav):
             row['az_bias'] = '%.3f' % navpt['abz']
             row['status'] = '%d' % 0
             writer.writerow(row)
+
+# a flight directory of aura csv logs
+def sniff(path):
+    if os.path.isfile(os.path.join(path, 'imu-0.csv')):
+        return path
+    return None
+
+formats.register('aura_csv', sys.modules[__name__], sniff,
+                 description='aura csv', time_range=True)
@@ -2,415 +2,320 @@ import csv
 import h5py
 import os
 import math
+import numpy as np
 import re
+import sys
+
+from .. import columnar
+from .. import formats
+from ..lazy_flight import LazyFlight, whole_channel
 
 d2r = math.pi / 180.0
 
 # empty class we'll fill in with data members
 # class Record: pass (deprecated)
 
-def load(h5_filename):
-    filepath = h5_filename
-    flight_dir = os.path.dirname(filepath)
+# wrap angle (radians) into the +/- pi range (single wrap, like the
+# original per-record code.)
+def wrap_pi(psi):
+    psi = np.where(psi > math.pi, psi - 2*math.pi, psi)
+    psi = np.where(psi < -math.pi, psi + 2*math.pi, psi)
+    return psi
 
-    # open the hdf5 file
-    data = h5py.File(filepath, 'r')
+def load_events(data, time_range=None):
+    sl = columnar.time_slice(data['/events/timestamp'], time_range)
+    timestamp = data['/events/timestamp'][sl]
+    message = data['/events/message'][sl]
+    return {
+        'time': timestamp,
+        'message': np.array([str(m) for m in message])
+    }
 
-    result = {}
-    timestamp = data['/events/timestamp'][()]
-    message = data['/events/message'][()]
-    result['event'] = []
+# scan the event messages for the autopilot type tag to determine the
+# pilot input channel mapping
+def find_pilot_mapping(messages):
     pilot_mapping = 'Aura3'       # APM2 or Aura3
-    for i in range(len(timestamp)):
-        event = {
-            'time': timestamp[i],
-            'message': str(message[i])
-        }
-        if 'Aura3' in event['message']:
+    for message in messages:
+        if 'Aura3' in message:
             pilot_mapping = 'Aura3'
-        elif 'APM2' in event['message']:
+        elif 'APM2' in message:
             pilot_mapping = 'APM2'
-        result['event'].append(event)
-        
-    timestamp = data['/sensors/imu/timestamp'][()]
-    gx = data['/sensors/imu/p_rad_sec'][()]
-    gy = data['/sensors/imu/q_rad_sec'][()]
-    gz = data['/sensors/imu/r_rad_sec'][()]
-    ax = data['/sensors/imu/ax_mps_sec'][()]
-    ay = data['/sensors/imu/ay_mps_sec'][()]
-    az = data['/sensors/imu/az_mps_sec'][()]
+    return pilot_mapping
+
+def load_imu(data, time_range=None):
+    sl = columnar.time_slice(data['/sensors/imu/timestamp'], time_range)
+    imu = {
+        'time': data['/sensors/imu/timestamp'][sl],
+        'p': data['/sensors/imu/p_rad_sec'][sl],
+        'q': data['/sensors/imu/q_rad_sec'][sl],
+        'r': data['/sensors/imu/r_rad_sec'][sl],
+        'ax': data['/sensors/imu/ax_mps_sec'][sl],
+        'ay': data['/sensors/imu/ay_mps_sec'][sl],
+        'az': data['/sensors/imu/az_mps_sec'][sl],
+        'hx': data['/sensors/imu/hx'][sl],
+        'hy': data['/sensors/imu/hy'][sl],
+        'hz': data['/sensors/imu/hz'][sl],
+        'temp': data['/sensors/imu/temp_C'][sl]
+    }
     if '/sensors/imu/ax_raw' in data:
-        ax_raw = data['/sensors/imu/ax_raw'][()]
-        ay_raw = data['/sensors/imu/ay_raw'][()]
-        az_raw = data['/sensors/imu/az_raw'][()]
-    hx = data['/sensors/imu/hx'][()]
-    hy = data['/sensors/imu/hy'][()]
-    hz = data['/sensors/imu/hz'][()]
+        imu['ax_raw'] = data['/sensors/imu/ax_raw'][sl]
+        imu['ay_raw'] = data['/sensors/imu/ay_raw'][sl]
+        imu['az_raw'] = data['/sensors/imu/az_raw'][sl]
     if '/sensors/imu/hx_raw' in data:
-        hx_raw = data['/sensors/imu/hx_raw'][()]
-        hy_raw = data['/sensors/imu/hy_raw'][()]
-        hz_raw = data['/sensors/imu/hz_raw'][()]
-    temp = data['/sensors/imu/temp_C'][()]
-    result['imu'] = []
-    for i in range(len(timestamp)):
-        imu = {
-            'time': timestamp[i],
-            'p': gx[i],
-            'q': gy[i],
-            'r': gz[i],
-            'ax': ax[i],
-            'ay': ay[i],
-            'az': az[i],
-            'hx': hx[i],
-            'hy': hy[i],
-            'hz': hz[i],
-            'temp': temp[i]
-        }
-        if '/sensors/imu/ax_raw' in data:
-            imu['ax_raw'] = ax_raw[i]
-            imu['ay_raw'] = ay_raw[i]
-            imu['az_raw'] = az_raw[i]
-        if '/sensors/imu/hx_raw' in data:
-            imu['hx_raw'] = hx_raw[i]
-            imu['hy_raw'] = hy_raw[i]
-            imu['hz_raw'] = hz_raw[i]
-        result['imu'].append(imu)
+        imu['hx_raw'] = data['/sensors/imu/hx_raw'][sl]
+        imu['hy_raw'] = data['/sensors/imu/hy_raw'][sl]
+        imu['hz_raw'] = data['/sensors/imu/hz_raw'][sl]
+    return imu
 
-    timestamp = data['/sensors/gps/timestamp'][()]
-    last_time = timestamp[0]
-    unix_sec = data['/sensors/gps/unix_time_sec'][()]
-    lat_deg = data['/sensors/gps/latitude_deg'][()]
-    lon_deg = data['/sensors/gps/longitude_deg'][()]
-    alt = data['/sensors/gps/altitude_m'][()]
-    last_alt = alt[0]
-    vn = data['/sensors/gps/vn_ms'][()]
-    ve = data['/sensors/gps/ve_ms'][()]
-    vd = data['/sensors/gps/vd_ms'][()]
-    sats = data['/sensors/gps/satellites'][()]
-    result['gps'] = []
-    for i in range(len(timestamp)):
-        dt = timestamp[i] - last_time
-        if dt > 0.001:
-            da = -(alt[i] - last_alt) / dt
-        else:
-            da = 0.0
-        last_time = timestamp[i]
-        last_alt = alt[i]
-        if sats[i] > 5:
-            gps = {
-                'time': timestamp[i],
-                'unix_sec': unix_sec[i],
-                'lat': lat_deg[i],
-                'lon': lon_deg[i],
-                'alt': alt[i],
-                'vn': vn[i],
-                've': ve[i],
-                'vd': vd[i],
-                'vd_est': da,
-                'sats': sats[i]
-            }
-            result['gps'].append(gps)
+def load_gps(data, time_range=None):
+    sl = columnar.time_slice(data['/sensors/gps/timestamp'], time_range)
+    timestamp = data['/sensors/gps/timestamp'][sl]
+    alt = data['/sensors/gps/altitude_m'][sl]
+    sats = data['/sensors/gps/satellites'][sl]
 
-    if 'sensors/gpsraw' in data:
-        timestamp = data['/sensors/gpsraw/timestamp'][()]
-        receiver_tow = data['/sensors/gpsraw/receiver_tow'][()]
-        num_sats = data['/sensors/gpsraw/num_sats'][()]
-        result['gpsraw'] = []
-        doppler = []
-        pseudorange = []
-        svid = []
-        for j in range(12):
-            doppler.append( data['/sensors/gpsraw/doppler[%d]' % j] )
-            pseudorange.append( data['/sensors/gpsraw/pseudorange[%d]' % j] )
-            svid.append( data['/sensors/gpsraw/svid[%d]' % j] )
-        for i in range(len(timestamp)):
-            gpsraw = {
-                'time': timestamp[i],
-                'receiver_tow': receiver_tow[i],
-                'num_sats': num_sats[i],
-                'doppler': [],
-                'pseudorange': [],
-                'svid': []
-            }
-            for j in range(12):
-                gpsraw['doppler'].append( doppler[j][i] )
-                gpsraw['pseudorange'].append( pseudorange[j][i] )
-                gpsraw['svid'].append( svid[j][i] )
-            # print(gpsraw)
-            result['gpsraw'].append(gpsraw)
+    # estimate vertical velocity by differencing altitude
+    dt = np.diff(timestamp, prepend=timestamp[:1])
+    da = np.diff(alt, prepend=alt[:1])
+    valid = dt > 0.001
+    vd_est = np.zeros(len(timestamp))
+    vd_est[valid] = -da[valid] / dt[valid]
 
-    timestamp = data['/sensors/air/timestamp'][()]
-    static_press = data['/sensors/air/pressure_mbar'][()]
-    temp = data['/sensors/air/temp_C'][()]
-    airspeed = data['/sensors/air/airspeed_smoothed_kt'][()]
-    alt_press = data['/sensors/air/altitude_smoothed_m'][()]
-    alt_true = data['/sensors/air/altitude_true_m'][()]
-    tecs_error_total = data['/sensors/air/tecs_error_total'][()]
-    tecs_error_diff = data['/sensors/air/tecs_error_diff'][()]
-    wind_dir = data['/sensors/air/wind_dir_deg'][()]
-    wind_speed = data['/sensors/air/wind_speed_kt'][()]
-    pitot_scale = data['/sensors/air/pitot_scale_factor'][()]
-    result['air'] = []
-    for i in range(len(timestamp)):
-        air = {
-            'time': timestamp[i],
-            'static_press': static_press[i],
-            'diff_press': 0.0, # not directly available in aura flight log
-            'temp': temp[i],
-            'airspeed': airspeed[i],
-            'alt_press': alt_press[i],
-            'alt_true': alt_true[i],
-            'tecs_error_total': tecs_error_total[i],
-            'tecs_error_diff': tecs_error_diff[i],
-            'wind_dir': wind_dir[i],
-            'wind_speed': wind_speed[i],
-            'pitot_scale': pitot_scale[i]
-        }
-        result['air'].append( air )
+    gps = {
+        'time': timestamp,
+        'unix_sec': data['/sensors/gps/unix_time_sec'][sl],
+        'lat': data['/sensors/gps/latitude_deg'][sl],
+        'lon': data['/sensors/gps/longitude_deg'][sl],
+        'alt': alt,
+        'vn': data['/sensors/gps/vn_ms'][sl],
+        've': data['/sensors/gps/ve_ms'][sl],
+        'vd': data['/sensors/gps/vd_ms'][sl],
+        'vd_est': vd_est,
+        'sats': sats
+    }
+    return columnar.select(gps, sats > 5)
 
-    timestamp = data['/navigation/filter/timestamp'][()]
-    lat = data['/navigation/filter/latitude_deg'][()]*d2r
-    lon = data['/navigation/filter/longitude_deg'][()]*d2r
-    alt = data['/navigation/filter/altitude_m'][()]
-    vn = data['/navigation/filter/vn_ms'][()]
-    ve = data['/navigation/filter/ve_ms'][()]
-    vd = data['/navigation/filter/vd_ms'][()]
-    roll = data['/navigation/filter/roll_deg'][()]
-    pitch = data['/navigation/filter/pitch_deg'][()]
-    yaw = data['/navigation/filter/heading_deg'][()]
-    gbx = data['/navigation/filter/p_bias'][()]
-    gby = data['/navigation/filter/q_bias'][()]
-    gbz = data['/navigation/filter/r_bias'][()]
-    abx = data['/navigation/filter/ax_bias'][()]
-    aby = data['/navigation/filter/ay_bias'][()]
-    abz = data['/navigation/filter/az_bias'][()]
-    if '/navigation/filter/max_pos_cov' in data:
-        max_pos_cov = data['/navigation/filter/max_pos_cov'][()]
-        max_vel_cov = data['/navigation/filter/max_vel_cov'][()]
-        max_att_cov = data['/navigation/filter/max_att_cov'][()]
-    result['filter'] = []
-    for i in range(len(timestamp)):
-        psi = yaw[i]*d2r
-        if psi > math.pi:
-            psi -= 2*math.pi
-        if psi < -math.pi:
-            psi += 2*math.pi
-        psix = math.cos(psi)
-        psiy = math.sin(psi)
-        if abs(lat[i]) > 0.0001 and abs(lon[i]) > 0.0001:
-            filter = {
-                'time': timestamp[i],
-                'lat': lat[i],
-                'lon': lon[i],
-                'alt': alt[i],
-                'vn': vn[i],
-                've': ve[i],
-                'vd': vd[i],
-                'phi': roll[i]*d2r,
-                'the': pitch[i]*d2r,
-                'psi': psi,
-                'psix': psix,
-                'psiy': psiy,
-                'p_bias': gbx[i],
-                'q_bias': gby[i],
-                'r_bias': gbz[i],
-                'ax_bias': abx[i],
-                'ay_bias': aby[i],
-                'az_bias': abz[i]
-            }
-            if '/navigation/filter/max_pos_cov' in data:
-                filter['max_pos_cov'] = max_pos_cov[i]
-                filter['max_vel_cov'] = max_vel_cov[i]
-                filter['max_att_cov'] = max_att_cov[i]
-            result['filter'].append(filter)
+def load_gpsraw(data, time_range=None):
+    sl = columnar.time_slice(data['/sensors/gpsraw/timestamp'], time_range)
+    gpsraw = {
+        'time': data['/sensors/gpsraw/timestamp'][sl],
+        'receiver_tow': data['/sensors/gpsraw/receiver_tow'][sl],
+        'num_sats': data['/sensors/gpsraw/num_sats'][sl]
+    }
+    for key in ['doppler', 'pseudorange', 'svid']:
+        gpsraw[key] = np.column_stack(
+            [ data['/sensors/gpsraw/%s[%d]' % (key, j)][sl] for j in range(12) ]
+        )
+    return gpsraw
 
-    # load filter (post process) records if they exist (for comparison
-    # purposes)
-    # if os.path.exists(filter_post):
-    #     result['filter_post'] = []
-    #     with open(filter_post, 'r') as ffilter:
-    #         reader = csv.DictReader(ffilter)
-    #         for row in reader:
-    #             lat = float(row['latitude_deg'])
-    #             lon = float(row['longitude_deg'])
-    #             psi_deg = float(row['heading_deg'])
-    #             psi = psi_deg*d2r
-    #             if psi > math.pi:
-    #                 psi -= 2*math.pi
-    #             if psi < -math.pi:
-    #                 psi += 2*math.pi
-    #             psix = math.cos(psi)
-    #             psiy = math.sin(psi)
-    #             if abs(lat) > 0.0001 and abs(lon) > 0.0001:
-    #                 nav = {
-    #                     'time': float(row['timestamp']),
-    #                     'lat': lat*d2r,
-    #                     'lon': lon*d2r,
-    #                     'alt': float(row['altitude_m']),
-    #                     'vn': float(row['vn_ms']),
-    #                     've': float(row['ve_ms']),
-    #                     'vd': float(row['vd_ms']),
-    #                     'phi': float(row['roll_deg'])*d2r,
-    #                     'the': float(row['pitch_deg'])*d2r,
-    #                     'psi': psi,
-    #                     'psix': psix,
-    #                     'psiy': psiy,
-    #                     'p_bias': float(row['p_bias']),
-    #                     'q_bias': float(row['q_bias']),
-    #                     'r_bias': float(row['r_bias']),
-    #                     'ax_bias': float(row['ax_bias']),
-    #                     'ay_bias': float(row['ay_bias']),
-    #                     'az_bias': float(row['az_bias'])
-    #                 }
-    #                 result['filter_post'].append(nav)
+def load_air(data, time_range=None):
+    sl = columnar.time_slice(data['/sensors/air/timestamp'], time_range)
+    timestamp = data['/sensors/air/timestamp'][sl]
+    return {
+        'time': timestamp,
+        'static_press': data['/sensors/air/pressure_mbar'][sl],
+        'diff_press': np.zeros(len(timestamp)), # not directly available in aura flight log
+        'temp': data['/sensors/air/temp_C'][sl],
+        'airspeed': data['/sensors/air/airspeed_smoothed_kt'][sl],
+        'alt_press': data['/sensors/air/altitude_smoothed_m'][sl],
+        'alt_true': data['/sensors/air/altitude_true_m'][sl],
+        'tecs_error_total': data['/sensors/air/tecs_error_total'][sl],
+        'tecs_error_diff': data['/sensors/air/tecs_error_diff'][sl],
+        'wind_dir': data['/sensors/air/wind_dir_deg'][sl],
+        'wind_speed': data['/sensors/air/wind_speed_kt'][sl],
+        'pitot_scale': data['/sensors/air/pitot_scale_factor'][sl]
+    }
 
-    print('Pilot input mapping:', pilot_mapping)
-    timestamp = data['/sensors/pilot/timestamp'][()]
-    ch0 = data['/sensors/pilot/channel[0]'][()]
-    ch1 = data['/sensors/pilot/channel[1]'][()]
-    ch2 = data['/sensors/pilot/channel[2]'][()]
-    ch3 = data['/sensors/pilot/channel[3]'][()]
-    ch4 = data['/sensors/pilot/channel[4]'][()]
-    ch5 = data['/sensors/pilot/channel[5]'][()]
-    ch6 = data['/sensors/pilot/channel[6]'][()]
-    ch7 = data['/sensors/pilot/channel[7]'][()]
-    result['pilot'] = []
-    for i in range(len(timestamp)):
-        if pilot_mapping == 'Aura3':
-            pilot = {
-                'time': timestamp[i],
-                'auto_manual': ch0[i],
-                'throttle_safety': ch1[i],
-                'throttle': ch2[i],
-                'aileron': ch3[i],
-                'elevator': ch4[i],
-                'rudder': ch5[i],
-                'flaps': ch6[i],
-                'aux1': ch7[i],
-                'gear': 0
-            }
-        elif pilot_mapping == 'APM2':
-            pilot = {
-                'time': timestamp[i],
-                'aileron': ch0[i],
-                'elevator': -ch1[i],
-                'throttle': ch2[i],
-                'rudder': ch3[i],
-                'gear': ch4[i],
-                'flaps': ch5[i],
-                'aux1': ch6[i],
-                'auto_manual': ch7[i],
-                'throttle_safety': 0.0
-            }
-        else:
-            pilot = {}
-        result['pilot'].append(pilot)
+def load_filter(data, time_range=None):
+    sl = columnar.time_slice(data['/navigation/filter/timestamp'], time_range)
+    lat = data['/navigation/filter/latitude_deg'][sl]*d2r
+    lon = data['/navigation/filter/longitude_deg'][sl]*d2r
+    psi = wrap_pi(data['/navigation/filter/heading_deg'][sl]*d2r)
+    filter = {
+        'time': data['/navigation/filter/timestamp'][sl],
+        'lat': lat,
+        'lon': lon,
+        'alt': data['/navigation/filter/altitude_m'][sl],
+        'vn': data['/navigation/filter/vn_ms'][sl],
+        've': data['/navigation/filter/ve_ms'][sl],
+        'vd': data['/navigation/filter/vd_ms'][sl],
+        'phi': data['/navigation/filter/roll_deg'][sl]*d2r,
+        'the': data['/navigation/filter/pitch_deg'][sl]*d2r,
+        'psi': psi,
+        'psix': np.cos(psi),
+        'psiy': np.sin(psi),
+        'p_bias': data['/navigation/filter/p_bias'][sl],
+        'q_bias': data['/navigation/filter/q_bias'][sl],
+        'r_bias': data['/navigation/filter/r_bias'][sl],
+        'ax_bias': data['/navigation/filter/ax_bias'][sl],
+        'ay_bias': data['/navigation/filter/ay_bias'][sl],
+        'az_bias': data['/navigation/filter/az_bias'][sl]
+    }
+    if '/navigation/filter/max_pos_cov' in data:
+        filter['max_pos_cov'] = data['/navigation/filter/max_pos_cov'][sl]
+        filter['max_vel_cov'] = data['/navigation/filter/max_vel_cov'][sl]
+        filter['max_att_cov'] = data['/navigation/filter/max_att_cov'][sl]
+    valid = (np.abs(lat) > 0.0001) & (np.abs(lon) > 0.0001)
+    return columnar.select(filter, valid)
 
-    timestamp = data['/actuators/act/timestamp'][()]
-    ail = data['/actuators/act/aileron_norm'][()]
-    elev = data['/actuators/act/elevator_norm'][()]
-    thr = data['/actuators/act/throttle_norm'][()]
-    rud = data['/actuators/act/rudder_norm'][()]
-    gear = data['/actuators/act/channel5_norm'][()]
-    flaps = data['/actuators/act/flaps_norm'][()]
-    aux1 = data['/actuators/act/channel7_norm'][()]
-    auto_manual = data['/actuators/act/channel8_norm'][()]
-    result['act'] = []
-    for i in range(len(timestamp)):
-        act = {
-            'time': timestamp[i],
-            'aileron': ail[i],
-            'elevator': elev[i],
-            'throttle': thr[i],
-            'rudder': rud[i],
-            'gear': gear[i],
-            'flaps': flaps[i],
-            'aux1': aux1[i],
-            'auto_manual': auto_manual[i]
+def load_pilot(data, pilot_mapping=None, time_range=None):
+    if pilot_mapping is None:
+        pilot_mapping = find_pilot_mapping(load_events(data)['message'])
+    sl = columnar.time_slice(data['/sensors/pilot/timestamp'], time_range)
+    timestamp = data['/sensors/pilot/timestamp'][sl]
+    ch = [ data['/sensors/pilot/channel[%d]' % j][sl] for j in range(8) ]
+    if pilot_mapping == 'Aura3':
+        pilot = {
+            'time': timestamp,
+            'auto_manual': ch[0],
+            'throttle_safety': ch[1],
+            'throttle': ch[2],
+            'aileron': ch[3],
+            'elevator': ch[4],
+            'rudder': ch[5],
+            'flaps': ch[6],
+            'aux1': ch[7],
+            'gear': np.zeros(len(timestamp), dtype=int)
+        }
+    elif pilot_mapping == 'APM2':
+        pilot = {
+            'time': timestamp,
+            'aileron': ch[0],
+            'elevator': -ch[1],
+            'throttle': ch[2],
+            'rudder': ch[3],
+            'gear': ch[4],
+            'flaps': ch[5],
+            'aux1': ch[6],
+            'auto_manual': ch[7],
+            'throttle_safety': np.zeros(len(timestamp))
         }
-        result['act'].append(act)
+    else:
+        pilot = {}
+    return pilot
 
+def load_act(data, time_range=None):
+    sl = columnar.time_slice(data['/actuators/act/timestamp'], time_range)
+    return {
+        'time': data['/actuators/act/timestamp'][sl],
+        'aileron': data['/actuators/act/aileron_norm'][sl],
+        'elevator': data['/actuators/act/elevator_norm'][sl],
+        'throttle': data['/actuators/act/throttle_norm'][sl],
+        'rudder': data['/actuators/act/rudder_norm'][sl],
+        'gear': data['/actuators/act/channel5_norm'][sl],
+        'flaps': data['/actuators/act/flaps_norm'][sl],
+        'aux1': data['/actuators/act/channel7_norm'][sl],
+        'auto_manual': data['/actuators/act/channel8_norm'][sl]
+    }
 
-    timestamp = data['/autopilot/timestamp'][()]
-    master = data['/autopilot/master_switch'][()]
-    pass_through = data['/autopilot/pilot_pass_through'][()]
-    hdg = data['/autopilot/groundtrack_deg'][()]
-    roll = data['/autopilot/roll_deg'][()]
-    alt = data['/autopilot/altitude_msl_ft'][()]
-    pitch = data['/autopilot/pitch_deg'][()]
-    speed = data['/autopilot/airspeed_kt'][()]
-    ground = data['/autopilot/altitude_ground_m'][()]
-    tecs_tot = data['/autopilot/tecs_target_tot'][()]
+def load_ap(data, time_range=None):
+    sl = columnar.time_slice(data['/autopilot/timestamp'], time_range)
+    timestamp = data['/autopilot/timestamp'][sl]
+    hdg = data['/autopilot/groundtrack_deg'][sl]
     if '/autopilot/current_task' in data:
-        current_task = data['/autopilot/current_task'][()]
+        current_task = data['/autopilot/current_task'][sl]
     else:
-        current_task = None
+        current_task = np.zeros(len(timestamp), dtype=int)
     if '/autopilot/task_attribute' in data:
-        task_attrib = data['/autopilot/task_attribute'][()]
+        task_attrib = data['/autopilot/task_attribute'][sl]
     else:
-        task_attrib = None
-    route_size = data['/autopilot/route_size'][()]
-    target_waypoint_idx = data['/autopilot/target_waypoint_idx'][()]
-    wpt_index = data['/autopilot/wpt_index'][()]
-    wpt_latitude_deg = data['/autopilot/wpt_latitude_deg'][()]
-    wpt_longitude_deg = data['/autopilot/wpt_longitude_deg'][()]
-    result['ap'] = []
-    for i in range(len(timestamp)):
-        hdgx = math.cos(hdg[i]*d2r)
-        hdgy = math.sin(hdg[i]*d2r)
-        if not current_task is None:
-            cur_task = current_task[i]
-        else:
-            cur_task = 0
-        if not task_attrib is None:
-            attrib = task_attrib[i]
-        else:
-            attrib = 0
-        ap = {
-            'time': timestamp[i],
-            'master_switch': master[i],
-            'pilot_pass_through': pass_through[i],
-            'hdg': hdg[i],
-            'hdgx': hdgx,
-            'hdgy': hdgy,
-            'roll': roll[i],
-            'alt': alt[i],
-            'pitch': pitch[i],
-            'speed': speed[i],
-            'ground': ground[i],
-            'tecs_target_tot': tecs_tot[i],
-            'current_task': cur_task,
-            'task_attrib': attrib,
-            'route_size': route_size[i],
-            'target_waypoint_idx': target_waypoint_idx[i],
-            'wpt_index': wpt_index[i],
-            'wpt_latitude_deg': wpt_latitude_deg[i],
-            'wpt_longitude_deg': wpt_longitude_deg[i]
-        }
-        result['ap'].append(ap)
+        task_attrib = np.zeros(len(timestamp), dtype=int)
+    return {
+        'time': timestamp,
+        'master_switch': data['/autopilot/master_switch'][sl],
+        'pilot_pass_through': data['/autopilot/pilot_pass_through'][sl],
+        'hdg': hdg,
+        'hdgx': np.cos(hdg*d2r),
+        'hdgy': np.sin(hdg*d2r),
+        'roll': data['/autopilot/roll_deg'][sl],
+        'alt': data['/autopilot/altitude_msl_ft'][sl],
+        'pitch': data['/autopilot/pitch_deg'][sl],
+        'speed': data['/autopilot/airspeed_kt'][sl],
+        'ground': data['/autopilot/altitude_ground_m'][sl],
+        'tecs_target_tot': data['/autopilot/tecs_target_tot'][sl],
+        'current_task': current_task,
+        'task_attrib': task_attrib,
+        'route_size': data['/autopilot/route_size'][sl],
+        'target_waypoint_idx': data['/autopilot/target_waypoint_idx'][sl],
+        'wpt_index': data['/autopilot/wpt_index'][sl],
+        'wpt_latitude_deg': data['/autopilot/wpt_latitude_deg'][sl],
+        'wpt_longitude_deg': data['/autopilot/wpt_longitude_deg'][sl]
+    }
 
-    timestamp = data['/sensors/health/timestamp'][()]
-    load_avg = data['/sensors/health/system_load_avg'][()]
-    avionics_vcc = data['/sensors/health/avionics_vcc'][()]
-    main_vcc = data['/sensors/health/main_vcc'][()]
-    cell_vcc = data['/sensors/health/cell_vcc'][()]
-    main_amps = data['/sensors/health/main_amps'][()]
-    total_mah = data['/sensors/health/total_mah'][()]
-    result['health'] = []
-    for i in range(len(timestamp)):
-        health = {
-            'time': timestamp[i],
-            'load_avg': load_avg[i],
-            'avionics_vcc': avionics_vcc[i],
-            'main_vcc': main_vcc[i],
-            'cell_vcc': cell_vcc[i],
-            'main_amps': main_amps[i],
-            'total_mah': total_mah[i]
-        }
-        result['health'].append(health)
+def load_health(data, time_range=None):
+    sl = columnar.time_slice(data['/sensors/health/timestamp'], time_range)
+    return {
+        'time': data['/sensors/health/timestamp'][sl],
+        'load_avg': data['/sensors/health/system_load_avg'][sl],
+        'avionics_vcc': data['/sensors/health/avionics_vcc'][sl],
+        'main_vcc': data['/sensors/health/main_vcc'][sl],
+        'cell_vcc': data['/sensors/health/cell_vcc'][sl],
+        'main_amps': data['/sensors/health/main_amps'][sl],
+        'total_mah': data['/sensors/health/total_mah'][sl]
+    }
 
+# channels in the file mapped to their loader functions (for LazyFlight).
+# Aura channels are read whole the first time any field is requested.
+def lazy_channels(data):
+    result = {
+        'event': whole_channel(load_events),
+        'imu': whole_channel(load_imu),
+        'gps': whole_channel(load_gps),
+        'air': whole_channel(load_air),
+        'filter': whole_channel(load_filter),
+        'pilot': whole_channel(load_pilot),
+        'act': whole_channel(load_act),
+        'ap': whole_channel(load_ap),
+        'health': whole_channel(load_health)
+    }
+    if 'sensors/gpsraw' in data:
+        result['gpsraw'] = whole_channel(load_gpsraw)
     return result
 
+def lazy_load(h5_filename, layout='records', time_range=None):
+    return LazyFlight(h5_filename, lazy_channels, layout, time_range)
+
+# load the flight as a dict of channels, each channel a dict of field name
+# -> numpy array.  All derived fields are computed as whole array
+# operations.
+def load_columns(h5_filename, time_range=None):
+    # open the hdf5 file
+    data = h5py.File(h5_filename, 'r')
+
+    result = {}
+    result['event'] = load_events(data, time_range)
+    # use all the events (not just those in time_range) to find the mapping
+    pilot_mapping = find_pilot_mapping(load_events(data)['message'])
+    result['imu'] = load_imu(data, time_range)
+    result['gps'] = load_gps(data, time_range)
+    if 'sensors/gpsraw' in data:
+        result['gpsraw'] = load_gpsraw(data, time_range)
+    result['air'] = load_air(data, time_range)
+    result['filter'] = load_filter(data, time_range)
+    print('Pilot input mapping:', pilot_mapping)
+    result['pilot'] = load_pilot(data, pilot_mapping, time_range)
+    result['act'] = load_act(data, time_range)
+    result['ap'] = load_ap(data, time_range)
+    result['health'] = load_health(data, time_range)
+
+    data.close()
+    return result
+
+# the small subset of a flight needed to catalog it: the first and last imu
+# time stamp, the gps fixes, and the events
+def load_summary(h5_filename):
+    data = h5py.File(h5_filename, 'r')
+    timestamp = data['/sensors/imu/timestamp']
+    result = {
+        'imu': { 'time': np.array([ timestamp[i] for i in [0, -1][:len(timestamp)] ]) },
+        'gps': load_gps(data),
+        'event': load_events(data)
+    }
+    data.close()
+    return result
+
+def load(h5_filename, time_range=None):
+    return columnar.flight_to_records(load_columns(h5_filename, time_range))
+
 def save_filter_result(filename, nav):
     keys = ['timestamp', 'latitude_deg', 'longitude_deg', 'altitude_m',
             'vn_ms', 've_ms', 'vd_ms', 'roll_deg', 'pitch_deg', 'heading_deg',
@@ -439,3 +344,21 @@ def save_filter_result(filename, nav):
             row['az_bias'] = '%.3f' % navpt['abz']
             row['status'] = '%d' % 0
             writer.writerow(row)
+
+# an AuraUAS hdf5 log, or a flight directory containing flight.h5 (older
+# aura flights have no /metadata format, anything but a UMN3 file counts)
+def sniff(path):
+    directory = os.path.isdir(path)
+    if directory:
+        path = os.path.join(path, 'flight.h5')
+    info = formats.hdf5_info(path)
+    if info is None:
+        return None
+    if info[0] == 'AuraUAS':
+        return path
+    if directory and not info[0] and not 'Sensors' in info[1]:
+        return path
+    return None
+
+formats.register('aura_hdf5', sys.modules[__name__], sniff,
+                 description='AuraUAS hdf5', time_range=True)
@@ -3,6 +3,10 @@
 from math import pi
 import numpy as np
 import pickle
+import pickletools
+import sys
+
+from .. import formats
 
 d2r = pi / 180.0
 r2d = 180.0 / pi
@@ -236,3 +240,17 @@ def load(pkl_file):
         del result["effectors"][segment[0]:segment[1]]
 
     return result
+
+# cirrus in-house pickle: a .pkl file starting with a pickle opcode
+# (PROTO 0x80 for protocol 2+, protocol 0/1 pickles start right away with
+# their first opcode, e.g. "(" or "}")
+def sniff(path):
+    if formats.extension(path) != ".pkl":
+        return None
+    head = formats.read_head(path, 1)
+    if len(head) and chr(head[0]) in pickletools.code2op:
+        return path
+    return None
+
+formats.register("cirrus_pkl", sys.modules[__name__], sniff,
+                 description="cirrus pkl")
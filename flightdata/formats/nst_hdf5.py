@@ -1,127 +1,199 @@
 import csv
 import h5py
 import math
+import numpy as np
+import sys
+
+from .. import columnar
+from .. import formats
+from ..lazy_flight import LazyFlight
 
 d2r = math.pi / 180.0
 
-def subload(data, branch, name):
+# wrap angle (radians) into the +/- pi range
+def wrap_pi(psi):
+    psi = np.where(psi > math.pi, psi - 2*math.pi, psi)
+    psi = np.where(psi < -math.pi, psi + 2*math.pi, psi)
+    return psi
+
+# read the fields of an hdf5 group into a dict of numpy arrays (all
+# fields, or just the listed ones that exist in the group.)  If time_range
+# is given only the matching hyperslab is read, located by a binary search
+# on the group's time_field (millis.)
+def subload(data, branch, name, fields=None, time_field="millis",
+            time_range=None):
     path = branch + "/" + name
     print("subload:", path)
 
     subtree = data[path]
-    fields = subtree.keys()
-    subdata = {}
+    if fields is None:
+        fields = subtree.keys()
+    if time_range is not None and time_field in subtree:
+        sl = columnar.time_slice(subtree[time_field], time_range, 0.001)
+    else:
+        sl = slice(None)
+    result = {}
     for f in fields:
-        subdata[f] = subtree[f][()]
-    count = len(subdata[f])  # depend on f still containing the last value of the loop
-    result = []
-    for i in range(count):
-        record = {}
+        if f in subtree:
+            result[f] = subtree[f][sl]
+    if "millis" in result:
+        result["timestamp"] = result["millis"] / 1000.0
+    print("  %s: %d records." % (name, columnar.size(result)))
+    return result
+
+# per-group post processing.  Each fixup only computes the derived fields
+# whose source fields were read so it also works on partial loads.
+
+def fixup_gps(subdata):
+    if "unix_usec" in subdata:
+        subdata["unix_sec"] = subdata["unix_usec"] / 1000000.0
+    if "latitude_raw" in subdata:
+        subdata["latitude_deg"] = subdata["latitude_raw"] / 10000000.0
+    if "longitude_raw" in subdata:
+        subdata["longitude_deg"] = subdata["longitude_raw"] / 10000000.0
+    return subdata
+
+def fixup_env(subdata):
+    if "flight_timer_millis" in subdata:
+        subdata["flight_timer_sec"] = subdata["flight_timer_millis"] / 1000.0
+    return subdata
+
+def fixup_nav(subdata):
+    if "latitude_raw" in subdata:
+        subdata["latitude_deg"] = subdata["latitude_raw"] / 10000000.0
+    if "longitude_raw" in subdata:
+        subdata["longitude_deg"] = subdata["longitude_raw"] / 10000000.0
+    if "yaw_deg" in subdata:
+        psi = wrap_pi(subdata["yaw_deg"]*d2r)
+        subdata["psix"] = np.cos(psi)
+        subdata["psiy"] = np.sin(psi)
+    # filter only 'legit' nav solution
+    return columnar.select(subdata, subdata["status"] >= 2)
+
+def fixup_nav_metrics(subdata):
+    if "metrics_millis" in subdata:
+        subdata["timestamp"] = subdata["metrics_millis"] / 1000.0
+    return subdata
+
+effector_names = ["throttle", "aileron", "elevator", "rudder", "flaps",
+                  "gear", "aux1", "aux2"]
+
+def fixup_effectors(subdata):
+    if "channel" in subdata:
+        channel = subdata["channel"]
+        for i, name in enumerate(effector_names):
+            subdata[name] = channel[:,i]
+    return subdata
+
+def fixup_refs(subdata):
+    if "groundtrack_deg" in subdata:
+        psi = wrap_pi(subdata["groundtrack_deg"]*d2r)
+        subdata["groundtrack_x"] = np.cos(psi)
+        subdata["groundtrack_y"] = np.sin(psi)
+    return subdata
+
+def fixup_mission(subdata):
+    if "wpt_latitude_raw" in subdata:
+        subdata["wpt_latitude_deg"] = subdata["wpt_latitude_raw"] / 10000000.0
+    if "wpt_longitude_raw" in subdata:
+        subdata["wpt_longitude_deg"] = subdata["wpt_longitude_raw"] / 10000000.0
+    return subdata
+
+# channel name -> (branch, group name, fixup function, time source field,
+# derived field -> source fields, fields always needed by the fixup)
+channels = {
+    "events": ("", "events", None, "millis", {}, []),
+    "imu": ("/sensors", "imu", None, "millis", {}, []),
+    "gps": ("/sensors", "gps", fixup_gps, "millis",
+            { "unix_sec": ["unix_usec"],
+              "latitude_deg": ["latitude_raw"],
+              "longitude_deg": ["longitude_raw"] }, []),
+    "airdata": ("/sensors", "airdata", None, "millis", {}, []),
+    "env": ("/filters", "env", fixup_env, "millis",
+            { "flight_timer_sec": ["flight_timer_millis"] }, []),
+    "nav": ("/filters", "nav", fixup_nav, "millis",
+            { "latitude_deg": ["latitude_raw"],
+              "longitude_deg": ["longitude_raw"],
+              "psix": ["yaw_deg"],
+              "psiy": ["yaw_deg"] }, ["status"]),
+    "nav_metrics": ("/filters", "nav_metrics", fixup_nav_metrics,
+                    "metrics_millis", {}, []),
+    "inceptors": ("/sensors", "inceptors", None, "millis", {}, []),
+    "fcs_outputs": ("/fcs", "outputs", None, "millis", {}, []),
+    "effectors": ("/fcs", "effectors", fixup_effectors, "millis",
+                  dict([ (name, ["channel"]) for name in effector_names ]), []),
+    "fcs_refs": ("/fcs", "refs", fixup_refs, "millis",
+                 { "groundtrack_x": ["groundtrack_deg"],
+                   "groundtrack_y": ["groundtrack_deg"] }, []),
+    "mission": ("", "mission", fixup_mission, "millis",
+                { "wpt_latitude_deg": ["wpt_latitude_raw"],
+                  "wpt_longitude_deg": ["wpt_longitude_raw"] }, []),
+    "power": ("/sensors", "power", None, "millis", {}, []),
+}
+
+# load one channel (all fields, or only the requested ones plus whatever
+# they are derived from) as a dict of numpy arrays
+def load_channel(data, name, fields=None, time_range=None):
+    branch, group, fixup, time_field, derived, needed = channels[name]
+    if fields is None:
+        read = None
+    else:
+        read = [ time_field ] + needed
         for f in fields:
-            record[f] = subdata[f][i]
-        if "millis" in record:
-            record["timestamp"] = record["millis"] / 1000.0
-        result.append(record)
-    print("  %s: %d records." % (name, len(result)))
+            read += derived.get(f, [f])
+        read = list(dict.fromkeys(read))
+    subdata = subload(data, branch, group, read, time_field, time_range)
+    if fixup is not None:
+        subdata = fixup(subdata)
+    if fields is not None:
+        keep = set(fields) | set(["timestamp"])
+        subdata = dict([ (f, v) for f, v in subdata.items() if f in keep ])
+    return subdata
+
+def channel_loader(name):
+    return lambda data, fields=None, time_range=None: load_channel(data, name, fields, time_range)
+
+# channels in the file mapped to their loader functions (for LazyFlight)
+def lazy_channels(data):
+    result = {}
+    for name in channels:
+        branch, group = channels[name][0], channels[name][1]
+        if branch + "/" + group in data:
+            result[name] = channel_loader(name)
     return result
 
-def load(h5_filename):
+def lazy_load(h5_filename, layout="records", time_range=None):
+    return LazyFlight(h5_filename, lazy_channels, layout, time_range)
+
+# load the flight as a dict of channels, each channel a dict of field name
+# -> numpy array.  All per-group fixups are whole array expressions.
+def load_columns(h5_filename, time_range=None):
     # open the hdf5 file
     data = h5py.File(h5_filename, "r")
 
     result = {}
+    for name in channels:
+        result[name] = load_channel(data, name, time_range=time_range)
 
-    subdata = subload(data, "", "events")
-    result["events"] = subdata
-
-    subdata = subload(data, "/sensors", "imu")
-    result["imu"] = subdata
-
-    subdata = subload(data, "/sensors", "gps")
-    for i in range(len(subdata)):
-        record = subdata[i]
-        record["unix_sec"] = record["unix_usec"] / 1000000.0
-        record["latitude_deg"] = record["latitude_raw"] / 10000000.0
-        record["longitude_deg"] = record["longitude_raw"] / 10000000.0
-    result["gps"] = subdata
-
-    subdata = subload(data, "/sensors", "airdata")
-    result["airdata"] = subdata
-
-    subdata = subload(data, "/filters", "env")
-    for i in range(len(subdata)):
-        record = subdata[i]
-        record["flight_timer_sec"] = record["flight_timer_millis"] / 1000.0
-    result["env"] = subdata
-
-    subdata = subload(data, "/filters", "nav")
-    for i in range(len(subdata)):
-        record = subdata[i]
-        record["latitude_deg"] = record["latitude_raw"] / 10000000.0
-        record["longitude_deg"] = record["longitude_raw"] / 10000000.0
-        psi = record["yaw_deg"]*d2r
-        if psi > math.pi:
-            psi -= 2*math.pi
-        if psi < -math.pi:
-            psi += 2*math.pi
-        record["psix"] = math.cos(psi)
-        record["psiy"] = math.sin(psi)
-    # filter only 'legit' nav solution
-    result["nav"] = []
-    for i in range(len(subdata)):
-        record = subdata[i]
-        if record["status"] >= 2:
-            result["nav"].append(record)
-
-    subdata = subload(data, "/filters", "nav_metrics")
-    for i in range(len(subdata)):
-        record = subdata[i]
-        record["timestamp"] = record["metrics_millis"] / 1000.0
-    result["nav_metrics"] = subdata
-
-    subdata = subload(data, "/sensors", "inceptors")
-    result["inceptors"] = subdata
-
-    subdata = subload(data, "/fcs", "outputs")
-    result["fcs_outputs"] = subdata
-
-    subdata = subload(data, "/fcs", "effectors")
-    for i in range(len(subdata)):
-        record = subdata[i]
-        record["throttle"] = record["channel"][0]
-        record["aileron"] = record["channel"][1]
-        record["elevator"] = record["channel"][2]
-        record["rudder"] = record["channel"][3]
-        record["flaps"] = record["channel"][4]
-        record["gear"] = record["channel"][5]
-        record["aux1"] = record["channel"][6]
-        record["aux2"] = record["channel"][7]
-    result["effectors"] = subdata
-
-    subdata = subload(data, "/fcs", "refs")
-    for i in range(len(subdata)):
-        record = subdata[i]
-        psi = record["groundtrack_deg"]*d2r
-        if psi > math.pi:
-            psi -= 2*math.pi
-        if psi < -math.pi:
-            psi += 2*math.pi
-        record["groundtrack_x"] = math.cos(psi)
-        record["groundtrack_y"] = math.sin(psi)
-    result["fcs_refs"] = subdata
-
-    subdata = subload(data, "", "mission")
-    for i in range(len(subdata)):
-        record = subdata[i]
-        record["wpt_latitude_deg"] = record["wpt_latitude_raw"] / 10000000.0
-        record["wpt_longitude_deg"] = record["wpt_longitude_raw"] / 10000000.0
-    result["mission"] = subdata
-
-    subdata = subload(data, "/sensors", "power")
-    result["power"] = subdata
+    data.close()
+    return result
 
+# the small subset of a flight needed to catalog it: the first and last imu
+# time stamp, the gps position and time fields, and the events
+def load_summary(h5_filename):
+    data = h5py.File(h5_filename, "r")
+    millis = data["/sensors/imu/millis"]
+    result = {
+        "imu": { "timestamp": np.array([ millis[i] for i in [0, -1][:len(millis)] ]) / 1000.0 },
+        "gps": load_channel(data, "gps", ["unix_sec", "latitude_deg", "longitude_deg"]),
+        "events": load_channel(data, "events", ["message"])
+    }
+    data.close()
     return result
 
+def load(h5_filename, time_range=None):
+    return columnar.flight_to_records(load_columns(h5_filename, time_range))
+
 def save_filter_result(filename, nav):
     keys = ["timestamp", "latitude_deg", "longitude_deg", "altitude_m",
             "vn_ms", "ve_ms", "vd_ms", "roll_deg", "pitch_deg", "heading_deg",
@@ -150,3 +222,12 @@ def save_filter_result(filename, nav):
             row["az_bias"] = "%.3f" % navpt["abz"]
             row["status"] = "%d" % 0
             writer.writerow(row)
+
+def sniff(path):
+    info = formats.hdf5_info(path)
+    if info is not None and info[0] == "NorthStarUAS":
+        return path
+    return None
+
+formats.register("nst_hdf5", sys.modules[__name__], sniff,
+                 description="NorthStarUAS hdf5", time_range=True)
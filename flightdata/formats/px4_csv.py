@@ -7,6 +7,10 @@ import numpy as np
 import os
 from scipy import interpolate # strait up linear interpolation, nothing fancy
 import re
+import sys
+
+from .. import formats
+from . import quaternion
 
 # empty class we'll fill in with data members
 class Record: pass
@@ -15,48 +19,6 @@ d2r = math.pi / 180.0
 r2d = 180.0 / math.pi
 mps2kt = 1.94384
 
-# create rotation matrix for the quaternion
-def px4_quat2dcm(q):
-    R = np.zeros( (3,3) )
-    aSq = q[0] * q[0]
-    bSq = q[1] * q[1]
-    cSq = q[2] * q[2]
-    dSq = q[3] * q[3]
-    R[0,0] = aSq + bSq - cSq - dSq
-    R[0,1] = 2.0 * (q[1] * q[2] - q[0] * q[3])
-    R[0,2] = 2.0 * (q[0] * q[2] + q[1] * q[3])
-    R[1,0] = 2.0 * (q[1] * q[2] + q[0] * q[3])
-    R[1,1] = aSq - bSq + cSq - dSq
-    R[1,2] = 2.0 * (q[2] * q[3] - q[0] * q[1])
-    R[2,0] = 2.0 * (q[1] * q[3] - q[0] * q[2])
-    R[2,1] = 2.0 * (q[0] * q[1] + q[2] * q[3])
-    R[2,2] = aSq - bSq - cSq + dSq
-    return R
-
-def px4_norm(q):
-    return math.sqrt(q[0]*q[0] + q[1]*q[1] + q[2]*q[2] + q[3]*q[3])
-
-def px4_normquat(q):
-    norm = px4_norm(q)
-    for i in range(4):
-        q[i] /= norm
-    return q
-    
-def px4_quat2euler(q):
-    #print q
-    norm = px4_norm(q)
-    if norm > 0.000001:
-        # normalize quat
-        for i in range(4):
-            q[i] /= norm
-    # create Euler angles vector from the quaternion
-    roll = math.atan2(2.0 * (q[0] * q[1] + q[2] * q[3]),
-                      1.0 - 2.0 * (q[1] * q[1] + q[2] * q[2]))
-    pitch = math.asin(2.0 * (q[0] * q[2] - q[3] * q[1]))
-    yaw = math.atan2(2.0 * (q[0] * q[3] + q[1] * q[2]),
-                     1.0 - 2.0 * (q[2] * q[2] + q[3] * q[3]))
-    return (roll, pitch, yaw)
-
 def load(csv_base):
     result = {}
 
@@ -126,18 +88,19 @@ def load(csv_base):
             air.alt_true = gps.alt
             result['air'].append( air )
 
-    att = []
+    att_time = []
+    att_q = []
     with open(att_path, 'rb') as f:
         reader = csv.DictReader(f)
         for row in reader:
-            time = float(row['timestamp']) / 1000000.0
-            q = [ float(row['q[0]']),
-                  float(row['q[1]']),
-                  float(row['q[2]']),
-                  float(row['q[3]']) ]
-            # either of these will work ...
-            (roll, pitch, yaw) = px4_quat2euler(q)
-            att.append( [time, yaw, pitch, roll] )
+            att_time.append( float(row['timestamp']) / 1000000.0 )
+            att_q.append( [ float(row['q[0]']),
+                            float(row['q[1]']),
+                            float(row['q[2]']),
+                            float(row['q[3]']) ] )
+    # convert the whole topic at once
+    (roll, pitch, yaw) = quaternion.quat2euler(np.array(att_q).reshape(-1, 4))
+    att = list(zip(att_time, yaw.tolist(), pitch.tolist(), roll.tolist()))
         
     pos = []
     with open(pos_path, 'rb') as f:
@@ -254,3 +217,13 @@ def load(csv_base):
                 result['act'].append(act)
                 
     return result
+
+# family of csv files exported from a ulog (path is the common prefix)
+def sniff(path):
+    if os.path.isfile(path + "_sensor_combined_0.csv"):
+        return path
+    return None
+
+formats.register("px4_csv", sys.modules[__name__], sniff,
+                 description="px4 ulog (csv family of files)",
+                 supported=False)
@@ -4,6 +4,9 @@ import csv
 import math
 import numpy as np
 import re
+import sys
+
+from .. import formats
 
 # empty class we'll fill in with data members
 class Record: pass
@@ -148,3 +151,11 @@ def load(csv_file):
                 result['act'].append(act)
 
     return result
+
+def sniff(path):
+    if formats.extension(path) == ".px4_csv":
+        return path
+    return None
+
+formats.register("px4_sdlog2", sys.modules[__name__], sniff,
+                 description="px4 ulog (single csv file)", supported=False)
@@ -1,354 +1,226 @@
 # load px4 ulog file
+#
+# The topics are read with the in tree ulog_reader (numpy structured arrays
+# per topic) and converted to the flight channels with whole array math:
+# the slower topics (temperature, mag, position, wind, airspeed) are
+# interpolated to the sample times of the channel they are merged into.
 
-from copy import copy
 import math
 import numpy as np
 from scipy import interpolate
+import sys
 
-from pyulog.core import ULog    # pip install pyulog
+from .. import columnar
+from .. import formats
+from . import quaternion
+from .ulog_reader import ULogReader, ulog_magic
 
 d2r = math.pi / 180.0
 r2d = 180.0/ math.pi
 mps2kt = 1.94384
 m2ft = 1.0 / 0.3048
 
-def px4_norm(q):
-    return math.sqrt(q[0]*q[0] + q[1]*q[1] + q[2]*q[2] + q[3]*q[3])
-
-def px4_quat2euler(q):
-    #print q
-    norm = px4_norm(q)
-    if norm > 0.000001:
-        # normalize quat
-        for i in range(4):
-            q[i] /= norm
-    # create Euler angles vector from the quaternion
-    phi = math.atan2(2.0 * (q[0] * q[1] + q[2] * q[3]),
-                     1.0 - 2.0 * (q[1] * q[1] + q[2] * q[2]))
-    the = math.asin(2.0 * (q[0] * q[2] - q[3] * q[1]))
-    psi = math.atan2(2.0 * (q[0] * q[3] + q[1] * q[2]),
-                     1.0 - 2.0 * (q[2] * q[2] + q[3] * q[3]))
-    return (phi, the, psi)
-
-def get_section(data, name, id):
+# the topics the loader uses
+messages = ["actuator_outputs",
+            "airspeed",
+            "sensor_accel",
+            "sensor_combined",
+            "vehicle_air_data",
+            "vehicle_attitude",
+            "vehicle_attitude_setpoint",
+            "vehicle_local_position",
+            "vehicle_global_position",
+            "vehicle_gps_position",
+            "vehicle_magnetometer",
+            "wind_estimate"]
+
+def get_section(ulog, name, id):
     print("section:", name, id)
-    for d in data:
-        if d.name == name and d.multi_id == id:
-            for f in d.field_data:
-                print(" ", f.field_name)
-            return d
-    return None
-
-def load(ulog_file):
-    result = {}
-    result["imu"] = []
-    result["gps"] = []
-    result["airdata"] = []
-    result["nav"] = []
-    #result["inceptors"] = []
-    result["effectors"] = []
-    result["ap"] = []
-
-    nav = {}
-
-    messages = ["actuator_outputs",
-                "airspeed",
-                "sensor_accel",
-                "sensor_combined",
-                "vehicle_air_data",
-                "vehicle_attitude",
-                "vehicle_attitude_setpoint",
-                "vehicle_local_position",
-                "vehicle_global_position",
-                "vehicle_gps_position",
-                "vehicle_magnetometer",
-                "wind_estimate"]
-
-    ulog = ULog(ulog_file, messages)
-    data = ulog.data_list
-    temp_interp = None
-
-    d = get_section(data, "sensor_accel", 0)
-    if d is not None:
-        imu_temps = []
-        for i in range(len(d.data["timestamp"])):
-            temp = [
-                d.data["timestamp"][i],
-                d.data["temperature"][i]
-            ]
-            imu_temps.append(temp)
-        imu_temps = np.array(imu_temps)
-        temp_interp = interpolate.interp1d(imu_temps[:,0], imu_temps[:,1],
-                                           bounds_error=False,
-                                           fill_value='extrapolate')
-
-    hx_interp = None
-    hy_interp = None
-    hz_interp = None
-    d = get_section(data, "vehicle_magnetometer", 0)
+    d = ulog.get(name, id)
     if d is not None:
-        mags = []
-        for i in range(len(d.data["timestamp"])):
-            mag = [
-                d.data["timestamp"][i],
-                d.data["magnetometer_ga[0]"][i],
-                d.data["magnetometer_ga[1]"][i],
-                d.data["magnetometer_ga[2]"][i]
-            ]
-            mags.append(mag)
-        mags = np.array(mags)
-        hx_interp = interpolate.interp1d(mags[:,0], mags[:,1],
-                                         bounds_error=False,
-                                         fill_value='extrapolate')
-        hy_interp = interpolate.interp1d(mags[:,0], mags[:,2],
-                                         bounds_error=False,
-                                         fill_value='extrapolate')
-        hz_interp = interpolate.interp1d(mags[:,0], mags[:,3],
-                                         bounds_error=False,
-                                         fill_value='extrapolate')
-
-    d = get_section(data, "sensor_combined", 0)
-    if d is not None:
-        for i in range(len(d.data["timestamp"])):
-            t = d.data["timestamp"][i]
-            if temp_interp is None:
-                temp = 15
-            else:
-                temp = float(temp_interp(t))
-            imu = {
-                "timestamp": t / 1e6,
-                "p_rps": d.data["gyro_rad[0]"][i],
-                "q_rps": d.data["gyro_rad[1]"][i],
-                "r_rps": d.data["gyro_rad[2]"][i],
-                "ax_mps2": d.data["accelerometer_m_s2[0]"][i],
-                "ay_mps2": d.data["accelerometer_m_s2[1]"][i],
-                "az_mps2": d.data["accelerometer_m_s2[2]"][i],
-                "temp_C": temp
-            }
-            if hx_interp is not None:
-                imu["hx"] = float(hx_interp(t))
-                imu["hy"] = float(hy_interp(t))
-                imu["hz"] = float(hz_interp(t))
-            else:
-                imu["hx"] = d.data["magnetometer_ga[0]"][i]
-                imu["hy"] = d.data["magnetometer_ga[1]"][i]
-                imu["hz"] = d.data["magnetometer_ga[2]"][i]
+        for field in d.dtype.names:
+            print(" ", field)
+    return d
+
+# linear interpolation (and extrapolation past the ends) of samples y(x)
+# at times t
+def interp(t, x, y):
+    f = interpolate.interp1d(np.asarray(x, dtype=float), np.asarray(y, dtype=float),
+                             bounds_error=False, fill_value='extrapolate')
+    return f(np.asarray(t, dtype=float))
+
+# load the flight as a dict of channels, each channel a dict of field name
+# -> numpy array.  time_range = (t0, t1) (seconds) only keeps the samples
+# inside that window
+def load_columns(ulog_file, time_range=None):
+    result = {}
+    for key in ["imu", "gps", "airdata", "nav", "effectors", "ap"]:
+        result[key] = { "timestamp": np.zeros(0) }
 
-            result["imu"].append(imu)
+    ulog = ULogReader(ulog_file, messages)
 
-    d = get_section(data, "vehicle_gps_position", 0)
+    accel = get_section(ulog, "sensor_accel", 0)
+    mag = get_section(ulog, "vehicle_magnetometer", 0)
+    d = get_section(ulog, "sensor_combined", 0)
     if d is not None:
-        for i in range(len(d.data["timestamp"])):
-            gps = {
-                "timestamp": d.data["timestamp"][i] / 1e6,
-                "unix_sec": d.data["time_utc_usec"][i] / 1e6,
-                "latitude_deg": d.data["lat"][i] / 1e7,
-                "longitude_deg": d.data["lon"][i] / 1e7,
-                "altitude_m": d.data["alt"][i] / 1e3,
-                "vn_mps": d.data["vel_n_m_s"][i],
-                "ve_mps": d.data["vel_e_m_s"][i],
-                "vd_mps": d.data["vel_d_m_s"][i],
-                "num_sats": d.data["satellites_used"][i]
-            }
-            if gps["num_sats"] >= 5:
-                result["gps"].append(gps)
-
-    d = get_section(data, "airspeed", 0)
+        t = d["timestamp"]
+        if accel is not None:
+            temp = interp(t, accel["timestamp"], accel["temperature"])
+        else:
+            temp = np.full(len(t), 15)
+        imu = {
+            "timestamp": t / 1e6,
+            "p_rps": d["gyro_rad[0]"],
+            "q_rps": d["gyro_rad[1]"],
+            "r_rps": d["gyro_rad[2]"],
+            "ax_mps2": d["accelerometer_m_s2[0]"],
+            "ay_mps2": d["accelerometer_m_s2[1]"],
+            "az_mps2": d["accelerometer_m_s2[2]"],
+            "temp_C": temp
+        }
+        if mag is not None:
+            imu["hx"] = interp(t, mag["timestamp"], mag["magnetometer_ga[0]"])
+            imu["hy"] = interp(t, mag["timestamp"], mag["magnetometer_ga[1]"])
+            imu["hz"] = interp(t, mag["timestamp"], mag["magnetometer_ga[2]"])
+        else:
+            imu["hx"] = d["magnetometer_ga[0]"]
+            imu["hy"] = d["magnetometer_ga[1]"]
+            imu["hz"] = d["magnetometer_ga[2]"]
+        result["imu"] = imu
+
+    d = get_section(ulog, "vehicle_gps_position", 0)
     if d is not None:
-        airspeed = []
-        for i in range(len(d.data["timestamp"])):
-            air = [
-                d.data["timestamp"][i],
-                d.data["indicated_airspeed_m_s"][i]
-            ]
-            airspeed.append(air)
-        airspeed = np.array(airspeed)
-        asi_interp = interpolate.interp1d(airspeed[:,0], airspeed[:,1],
-                                          bounds_error=False,
-                                          fill_value='extrapolate')
+        gps = {
+            "timestamp": d["timestamp"] / 1e6,
+            "unix_sec": d["time_utc_usec"] / 1e6,
+            "latitude_deg": d["lat"] / 1e7,
+            "longitude_deg": d["lon"] / 1e7,
+            "altitude_m": d["alt"] / 1e3,
+            "vn_mps": d["vel_n_m_s"],
+            "ve_mps": d["vel_e_m_s"],
+            "vd_mps": d["vel_d_m_s"],
+            "num_sats": d["satellites_used"]
+        }
+        result["gps"] = columnar.select(gps, gps["num_sats"] >= 5)
+
+    airspeed = get_section(ulog, "airspeed", 0)
+    wind = get_section(ulog, "wind_estimate", 0)
+    if wind is not None and np.sum(wind["windspeed_north"]) > 0.1 and np.sum(wind["windspeed_east"]) > 0.1:
+        wn = wind["windspeed_north"].astype(float)
+        we = wind["windspeed_east"].astype(float)
+        wind_deg = 90 - np.arctan2(-wn, -we) * r2d
+        wind_kt = np.sqrt( we*we + wn*wn ) * mps2kt
+        print("sum wind:", np.sum(wind_deg), np.sum(wind_kt))
     else:
-        asi_interp = None
-    d = get_section(data, "wind_estimate", 0)
-    if d is not None and np.sum(d.data["windspeed_north"]) > 0.1 and np.sum(d.data["windspeed_east"]) > 0.1:
-        wind = []
-        for i in range(len(d.data["timestamp"])):
-            wn = d.data["windspeed_north"][i]
-            we = d.data["windspeed_east"][i]
-            wind_deg = 90 - math.atan2(-wn, -we) * r2d
-            wind_kt = math.sqrt( we*we + wn*wn ) * mps2kt
-            w = [
-                d.data["timestamp"][i],
-                wind_deg,
-                wind_kt
-            ]
-            wind.append(w)
-        wind = np.array(wind)
-        print("sum wind:", np.sum(wind[:,1]), np.sum(wind[:,2]))
-        wind_deg_interp = interpolate.interp1d(wind[:,0], wind[:,1],
-                                               bounds_error=False,
-                                               fill_value='extrapolate')
-        wind_kt_interp = interpolate.interp1d(wind[:,0], wind[:,2],
-                                              bounds_error=False,
-                                              fill_value='extrapolate')
-    else:
-        wind_deg_interp = None
-        wind_kt_interp = None
+        wind = None
 
-    d = get_section(data, "vehicle_air_data", 0)
+    d = get_section(ulog, "vehicle_air_data", 0)
     if d is not None:
-        for i in range(len(d.data["timestamp"])):
-            t = d.data["timestamp"][i]
-            if asi_interp is not None:
-                asi_mps = float(asi_interp(t))
-            else:
-                asi_mps = 0
-            if wind_deg_interp is not None:
-                wind_deg = float(wind_deg_interp(t))
-            else:
-                wind_deg = 0
-            if wind_kt_interp is not None:
-                wind_kt = float(wind_kt_interp(t))
-            else:
-                wind_kt = 0
-            airdata = {
-                "timestamp": t / 1e6,
-                "static_press": d.data["baro_pressure_pa"][i],
-                "diff_press": 0.0,
-                "temp": d.data["baro_temp_celcius"][i],
-                "airspeed_mps": asi_mps,
-                "alt_press": d.data["baro_alt_meter"][i],
-                "alt_true": 0,
-                "tecs_error_total": 0,
-                "tecs_error_diff": 0,
-                "wind_dir": wind_deg,
-                "wind_speed": wind_kt,
-                "pitot_scale": 1
-            }
-            result["airdata"].append(airdata)
-    else:
-        d = get_section(data, "airspeed", 0)
-        if d is not None:
-            airspeed = []
-            for i in range(len(d.data["timestamp"])):
-                t = d.data["timestamp"][i]
-                airdata = {
-                    "timestamp": t / 1e6,
-                    "airspeed_mps": d.data["indicated_airspeed_m_s"][i],
-                    "pitot_scale": 1
-                }
-                if wind_deg_interp is not None:
-                    airdata["wind_dir"] = float(wind_deg_interp(t))
-                    airdata["wind_speed"] = float(wind_kt_interp(t))
-                result["airdata"].append(airdata)
-
-    d = get_section(data, "vehicle_local_position", 0)
-
-    d = get_section(data, "vehicle_global_position", 0)
+        t = d["timestamp"]
+        zeros = np.zeros(len(t))
+        if airspeed is not None:
+            asi_mps = interp(t, airspeed["timestamp"], airspeed["indicated_airspeed_m_s"])
+        else:
+            asi_mps = zeros
+        if wind is not None:
+            wind_dir = interp(t, wind["timestamp"], wind_deg)
+            wind_speed = interp(t, wind["timestamp"], wind_kt)
+        else:
+            wind_dir = zeros
+            wind_speed = zeros
+        result["airdata"] = {
+            "timestamp": t / 1e6,
+            "static_press": d["baro_pressure_pa"],
+            "diff_press": zeros,
+            "temp": d["baro_temp_celcius"],
+            "airspeed_mps": asi_mps,
+            "alt_press": d["baro_alt_meter"],
+            "alt_true": zeros,
+            "tecs_error_total": zeros,
+            "tecs_error_diff": zeros,
+            "wind_dir": wind_dir,
+            "wind_speed": wind_speed,
+            "pitot_scale": np.ones(len(t))
+        }
+    elif airspeed is not None:
+        t = airspeed["timestamp"]
+        airdata = {
+            "timestamp": t / 1e6,
+            "airspeed_mps": airspeed["indicated_airspeed_m_s"],
+            "pitot_scale": np.ones(len(t))
+        }
+        if wind is not None:
+            airdata["wind_dir"] = interp(t, wind["timestamp"], wind_deg)
+            airdata["wind_speed"] = interp(t, wind["timestamp"], wind_kt)
+        result["airdata"] = airdata
+
+    pos = get_section(ulog, "vehicle_global_position", 0)
+    d = get_section(ulog, "vehicle_attitude", 0)
     if d is not None:
-        poses = []
-        for i in range(len(d.data["timestamp"])):
-            if "vel_n" in d.data:
-                vn = d.data["vel_n"][i]
-                ve = d.data["vel_e"][i]
-                vd = d.data["vel_d"][i]
+        t = d["timestamp"]
+        zeros = np.zeros(len(t))
+        q = np.column_stack([ d["q[%d]" % i] for i in range(4) ])
+        (phi, the, psi) = quaternion.quat2euler(q)
+        (psix, psiy) = quaternion.psixy(psi)
+        nav = { "timestamp": t / 1e6 }
+        fields = [ ("latitude_deg", "lat"), ("longitude_deg", "lon"),
+                   ("altitude_m", "alt"), ("vn_mps", "vel_n"),
+                   ("ve_mps", "vel_e"), ("vd_mps", "vel_d") ]
+        for key, field in fields:
+            if pos is not None and field in pos.dtype.names:
+                nav[key] = interp(t, pos["timestamp"], pos[field])
             else:
-                vn = 0
-                ve = 0
-                vd = 0
-            pos = [
-                d.data["timestamp"][i],
-                d.data["lat"][i],
-                d.data["lon"][i],
-                d.data["alt"][i],
-                vn,
-                ve,
-                vd
-            ]
-            poses.append(pos)
-        poses = np.array(poses)
-        lat_interp = interpolate.interp1d(poses[:,0], poses[:,1],
-                                          bounds_error=False,
-                                          fill_value='extrapolate')
-        lon_interp = interpolate.interp1d(poses[:,0], poses[:,2],
-                                          bounds_error=False,
-                                          fill_value='extrapolate')
-        alt_interp = interpolate.interp1d(poses[:,0], poses[:,3],
-                                          bounds_error=False,
-                                          fill_value='extrapolate')
-        vn_interp = interpolate.interp1d(poses[:,0], poses[:,4],
-                                         bounds_error=False,
-                                         fill_value='extrapolate')
-        ve_interp = interpolate.interp1d(poses[:,0], poses[:,5],
-                                         bounds_error=False,
-                                         fill_value='extrapolate')
-        vd_interp = interpolate.interp1d(poses[:,0], poses[:,6],
-                                         bounds_error=False,
-                                         fill_value='extrapolate')
-
-    d = get_section(data, "vehicle_attitude", 0)
+                nav[key] = zeros
+        nav.update({
+            "phi_deg": phi*r2d,
+            "theta_deg": the*r2d,
+            "psi_deg": psi*r2d,
+            "psix": psix,
+            "psiy": psiy,
+            "p_bias": zeros,
+            "q_bias": zeros,
+            "r_bias": zeros,
+            "ax_bias": zeros,
+            "ay_bias": zeros,
+            "az_bias": zeros
+        })
+        result["nav"] = nav
+
+    d = get_section(ulog, "vehicle_attitude_setpoint", 0)
     if d is not None:
-        for i in range(len(d.data["timestamp"])):
-            q = [ d.data["q[0]"][i],
-                  d.data["q[1]"][i],
-                  d.data["q[2]"][i],
-                  d.data["q[3]"][i] ]
-            (phi, the, psi) = px4_quat2euler(q)
-            t = d.data["timestamp"][i]
-            nav = {
-                "timestamp": t / 1e6,
-                "latitude_deg": float(lat_interp(t)),
-                "longitude_deg": float(lon_interp(t)),
-                "altitude_m": float(alt_interp(t)),
-                "vn_mps": float(vn_interp(t)),
-                "ve_mps": float(ve_interp(t)),
-                "vd_mps": float(vd_interp(t)),
-                "phi_deg": phi*r2d,
-                "theta_deg": the*r2d,
-                "psi_deg": psi*r2d,
-                "psix": math.cos(psi),
-                "psiy": math.sin(psi),
-                "p_bias": 0,
-                "q_bias": 0,
-                "r_bias": 0,
-                "ax_bias": 0,
-                "ay_bias": 0,
-                "az_bias": 0
-            }
-            result["nav"].append(nav)
-
-    d = get_section(data, "vehicle_attitude_setpoint", 0)
+        zeros = np.zeros(len(d))
+        result["ap"] = {
+            "timestamp": d["timestamp"] / 1e6,
+            "hdg": d["yaw_body"],
+            "roll": d["roll_body"],
+            "pitch": d["pitch_body"],
+            "alt": zeros,
+            "speed": zeros
+        }
+
+    d = get_section(ulog, "actuator_outputs", 0)
     if d is not None:
-        for i in range(len(d.data["timestamp"])):
-            t = d.data["timestamp"][i]
-            ap = {
-                "timestamp": t / 1e6,
-                "hdg": d.data["yaw_body"][i],
-                "roll": d.data["roll_body"][i],
-                "pitch": d.data["pitch_body"][i],
-                "alt": 0,
-                "speed": 0
-            }
-            result["ap"].append(ap)
-
-    d = get_section(data, "actuator_outputs", 0)
-    if d is not None:
-        for i in range(len(d.data["timestamp"])):
-            t = d.data["timestamp"][i]
-            act = {
-                "timestamp": t / 1e6,
-                "aileron": (d.data["output[0]"][i] - 1500) / 500,
-                "elevator": (d.data["output[1]"][i] - 1500) / 500,
-                "throttle": (d.data["output[2]"][i] - 1000) / 1000,
-                "rudder": -(d.data["output[3]"][i] - 1500) / 500,
-                "flaps": (d.data["output[5]"][i] - 1500) / 500,
-                "output[0]": d.data["output[0]"][i],
-                "output[1]": d.data["output[1]"][i],
-                "output[2]": d.data["output[2]"][i],
-                "output[3]": d.data["output[3]"][i],
-                "output[4]": d.data["output[4]"][i],
-                "output[5]": d.data["output[5]"][i],
-                "output[6]": d.data["output[6]"][i],
-            }
-            result["effectors"].append(act)
+        act = {
+            "timestamp": d["timestamp"] / 1e6,
+            "aileron": (d["output[0]"] - 1500) / 500,
+            "elevator": (d["output[1]"] - 1500) / 500,
+            "throttle": (d["output[2]"] - 1000) / 1000,
+            "rudder": -(d["output[3]"] - 1500) / 500,
+            "flaps": (d["output[5]"] - 1500) / 500
+        }
+        for i in range(7):
+            act["output[%d]" % i] = d["output[%d]" % i]
+        result["effectors"] = act
+
+    return columnar.clip_flight(result, time_range)
+
+def load(ulog_file, time_range=None):
+    return columnar.flight_to_records(load_columns(ulog_file, time_range))
+
+def sniff(path):
+    if formats.read_head(path, len(ulog_magic)) == ulog_magic:
+        return path
+    return None
 
-    return result
+formats.register("px4_ulog", sys.modules[__name__], sniff,
+                 description="px4 ulog", time_range=True)
@@ -0,0 +1,65 @@
+# quaternion / euler angle conversions shared by the px4 loaders
+#
+# Quaternions are [w, x, y, z] (px4 order), euler angles are (phi, the,
+# psi) = (roll, pitch, yaw) in radians, aerospace z-y-x rotation order.
+# Every function works on a whole topic at once: q is an N x 4 array (a
+# single quaternion of 4 values works too and gives scalar results), the
+# input arrays are never modified.
+
+import numpy as np
+
+# the quaternions scaled to unit length (quaternions with a norm of ~0 are
+# left as is)
+def normalize(q):
+    q = np.array(q, dtype=float)
+    norm = np.sqrt(np.sum(q*q, axis=-1))
+    norm = np.where(norm > 0.000001, norm, 1.0)
+    return q / norm[...,None]
+
+# euler angles (phi, the, psi) of the quaternions
+def quat2euler(q):
+    q = normalize(q)
+    w, x, y, z = q[...,0], q[...,1], q[...,2], q[...,3]
+    phi = np.arctan2(2.0 * (w * x + y * z), 1.0 - 2.0 * (x * x + y * y))
+    the = np.arcsin(np.clip(2.0 * (w * y - z * x), -1.0, 1.0))
+    psi = np.arctan2(2.0 * (w * z + x * y), 1.0 - 2.0 * (y * y + z * z))
+    return phi, the, psi
+
+# quaternions (N x 4) of the euler angles
+def euler2quat(phi, the, psi):
+    cphi = np.cos(np.asarray(phi, dtype=float) * 0.5)
+    sphi = np.sin(np.asarray(phi, dtype=float) * 0.5)
+    cthe = np.cos(np.asarray(the, dtype=float) * 0.5)
+    sthe = np.sin(np.asarray(the, dtype=float) * 0.5)
+    cpsi = np.cos(np.asarray(psi, dtype=float) * 0.5)
+    spsi = np.sin(np.asarray(psi, dtype=float) * 0.5)
+    return np.stack([ cphi * cthe * cpsi + sphi * sthe * spsi,
+                      sphi * cthe * cpsi - cphi * sthe * spsi,
+                      cphi * sthe * cpsi + sphi * cthe * spsi,
+                      cphi * cthe * spsi - sphi * sthe * cpsi ], axis=-1)
+
+# rotation matrices (N x 3 x 3, body to ned) of the quaternions (not
+# normalized, like px4)
+def quat2dcm(q):
+    q = np.asarray(q, dtype=float)
+    a, b, c, d = q[...,0], q[...,1], q[...,2], q[...,3]
+    aSq = a * a
+    bSq = b * b
+    cSq = c * c
+    dSq = d * d
+    R = np.empty(q.shape[:-1] + (3, 3))
+    R[...,0,0] = aSq + bSq - cSq - dSq
+    R[...,0,1] = 2.0 * (b * c - a * d)
+    R[...,0,2] = 2.0 * (a * c + b * d)
+    R[...,1,0] = 2.0 * (b * c + a * d)
+    R[...,1,1] = aSq - bSq + cSq - dSq
+    R[...,1,2] = 2.0 * (c * d - a * b)
+    R[...,2,0] = 2.0 * (b * d - a * c)
+    R[...,2,1] = 2.0 * (a * b + c * d)
+    R[...,2,2] = aSq - bSq - cSq + dSq
+    return R
+
+# heading as a unit vector (psix, psiy), for interpolating and averaging
+# headings without the +/-180 wrap
+def psixy(psi):
+    return np.cos(psi), np.sin(psi)
@@ -0,0 +1,212 @@
+# read px4 ulog files
+#
+# A ulog file is a 16 byte header followed by messages, each a 3 byte
+# header (uint16 payload size, uint8 message type) and the payload.  The
+# definitions section describes the logged topics ("F" format messages),
+# the data section subscribes topic instances to message ids ("A") and
+# logs their samples ("D").  The file is memory mapped and walked once to
+# find the message offsets, then all the samples of a subscribed topic are
+# gathered at once into a numpy structured array (field names flattened
+# the same way as pyulog: "q[0]", "nested.field", "array[1].field".)
+#
+#   ulog = ULogReader("log.ulg", ["vehicle_attitude"])
+#   att = ulog.get("vehicle_attitude")
+#   att["timestamp"], att["q[0]"]
+
+import mmap
+import struct
+
+import numpy as np
+
+ulog_magic = b"ULog\x01\x12\x35"
+header_size = 16
+sync_magic = b"\x2f\x73\x13\x20\x25\x0c\xbb\x12"
+
+# ulog base type -> numpy dtype (bool and char as int8, like pyulog)
+base_types = {
+    "int8_t": "i1",
+    "uint8_t": "u1",
+    "int16_t": "<i2",
+    "uint16_t": "<u2",
+    "int32_t": "<i4",
+    "uint32_t": "<u4",
+    "int64_t": "<i8",
+    "uint64_t": "<u8",
+    "float": "<f4",
+    "double": "<f8",
+    "bool": "i1",
+    "char": "i1",
+}
+
+# struct codes of the base types (info and parameter values)
+struct_codes = {
+    "int8_t": "<b",
+    "uint8_t": "<B",
+    "int16_t": "<h",
+    "uint16_t": "<H",
+    "int32_t": "<i",
+    "uint32_t": "<I",
+    "int64_t": "<q",
+    "uint64_t": "<Q",
+    "float": "<f",
+    "double": "<d",
+    "bool": "<?",
+}
+
+message_types = set([ ord(c) for c in "BFIMPQADRSOLC" ])
+
+# split "type name" (type may be an array "float[4]") into (type, array
+# size or 0, name)
+def parse_field(field):
+    type_name, name = field.strip().split(" ", 1)
+    size = 0
+    if type_name.endswith("]"):
+        type_name, size = type_name[:-1].split("[")
+        size = int(size)
+    return type_name, size, name.strip()
+
+# decode an info or parameter value of the given type
+def parse_value(type_name, size, value):
+    if type_name == "char":
+        return value.decode("utf-8", "replace").rstrip("\x00")
+    if type_name in struct_codes and size == 0:
+        return struct.unpack(struct_codes[type_name], value)[0]
+    return value
+
+class ULogReader():
+    # messages: the topic names to read (default: all)
+    def __init__(self, filename, messages=None):
+        self.filename = filename
+        self.messages = messages
+        self.start_timestamp = 0
+        self.formats = {}       # format name -> [(type, array size, field)]
+        self.info = {}          # key -> value
+        self.params = {}        # name -> value
+        self.logged = []        # (timestamp, log level, text)
+        self.subscriptions = {} # message id -> (topic name, multi id)
+        self.data = {}          # (topic name, multi id) -> structured array
+        self.dtypes = {}
+        self.read()
+
+    # flat [(field name, numpy dtype)] of a format, nested types and
+    # arrays expanded
+    def flatten(self, format_name, prefix=""):
+        result = []
+        for type_name, size, name in self.formats[format_name]:
+            names = [ prefix + name ]
+            if size > 0:
+                names = [ "%s%s[%d]" % (prefix, name, i) for i in range(size) ]
+            for n in names:
+                if type_name in base_types:
+                    result.append( (n, base_types[type_name]) )
+                else:
+                    result += self.flatten(type_name, n + ".")
+        return result
+
+    # (dtype of the logged samples, size including the trailing padding,
+    # which isn't always logged)
+    def topic_dtype(self, name):
+        if not name in self.dtypes:
+            fields = self.flatten(name)
+            full = np.dtype(fields).itemsize
+            while len(fields) and fields[-1][0].startswith("_padding"):
+                fields.pop()
+            self.dtypes[name] = (np.dtype(fields), full)
+        return self.dtypes[name]
+
+    # walk the message headers, returns the offsets of every message
+    def scan(self, mm):
+        offsets = []
+        append = offsets.append
+        view = memoryview(mm)
+        p = header_size
+        n = len(mm)
+        try:
+            while p + 3 <= n:
+                if not view[p+2] in message_types:
+                    # corrupt, skip ahead to the next sync message
+                    p = mm.find(sync_magic, p + 1)
+                    if p < 0:
+                        p = n
+                        break
+                    p -= 3
+                    continue
+                append(p)
+                p += 3 + (view[p] | (view[p+1] << 8))
+        finally:
+            view.release()
+        if p > n:
+            # truncated last message
+            offsets.pop()
+        return np.array(offsets, dtype=np.int64)
+
+    def read(self):
+        with open(self.filename, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if mm[:len(ulog_magic)] != ulog_magic:
+                raise ValueError("not a ulog file: " + self.filename)
+            self.start_timestamp = struct.unpack("<Q", mm[8:16])[0]
+            offsets = self.scan(mm)
+            buf = np.frombuffer(mm, dtype=np.uint8)
+            types = buf[offsets + 2]
+            data = types == ord("D")
+            self.read_definitions(mm, offsets[~data], types[~data])
+            self.read_data(buf, offsets[data])
+            del buf
+        finally:
+            mm.close()
+
+    # the (few) non data messages, in log order
+    def read_definitions(self, mm, offsets, types):
+        for p, t in zip(offsets.tolist(), types.tolist()):
+            size = mm[p] | (mm[p+1] << 8)
+            payload = mm[p+3:p+3+size]
+            if t == ord("F"):
+                text = payload.decode("utf-8", "replace")
+                name, fields = text.split(":", 1)
+                self.formats[name] = [ parse_field(f) for f in fields.split(";") if len(f.strip()) ]
+            elif t == ord("A"):
+                multi_id, msg_id = struct.unpack("<BH", payload[:3])
+                name = payload[3:].decode("utf-8", "replace").rstrip("\x00")
+                self.subscriptions[msg_id] = (name, multi_id)
+            elif t in (ord("I"), ord("P")):
+                key_len = payload[0]
+                type_name, size, key = parse_field(payload[1:1+key_len].decode("utf-8", "replace"))
+                value = parse_value(type_name, size, payload[1+key_len:])
+                if t == ord("I"):
+                    self.info[key] = value
+                else:
+                    self.params[key] = value
+            elif t == ord("L") and size >= 9:
+                level, timestamp = struct.unpack("<BQ", payload[:9])
+                self.logged.append( (timestamp, level, payload[9:].decode("utf-8", "replace")) )
+            elif t == ord("C") and size >= 11:
+                level, tag, timestamp = struct.unpack("<BHQ", payload[:11])
+                self.logged.append( (timestamp, level, payload[11:].decode("utf-8", "replace")) )
+
+    # gather the samples of each wanted topic into a structured array.
+    # Samples shorter than the fields or longer than the fields plus the
+    # trailing padding are corrupt and dropped.
+    def read_data(self, buf, offsets):
+        sizes = (buf[offsets].astype(np.int64) | (buf[offsets + 1].astype(np.int64) << 8)) - 2
+        msg_ids = buf[offsets + 3].astype(np.int64) | (buf[offsets + 4].astype(np.int64) << 8)
+        for msg_id, (name, multi_id) in self.subscriptions.items():
+            if self.messages is not None and not name in self.messages:
+                continue
+            dtype, full_size = self.topic_dtype(name)
+            sel = (msg_ids == msg_id) & (sizes >= dtype.itemsize) & (sizes <= full_size)
+            starts = offsets[sel] + 5
+            if not len(starts):
+                continue
+            raw = buf[starts[:,None] + np.arange(dtype.itemsize)]
+            self.data[(name, multi_id)] = raw.view(dtype).reshape(-1)
+
+    # the samples of a topic instance as a structured array (index it by
+    # field name), or None if it wasn't logged
+    def get(self, name, multi_id=0):
+        return self.data.get( (name, multi_id) )
+
+    # the topic instances read: [(name, multi id)]
+    def topics(self):
+        return sorted(self.data.keys())
@@ -10,6 +10,8 @@ join = os.path.join
 import numpy as np
 from scipy import io as sio
 
+from .. import formats
+
 d2r = pi / 180.0
 r2d = 180.0 / pi
 mps2kt = 1.94384
@@ -223,3 +225,12 @@ def load(mat_filename):
         f.write(",".join(line) + "\n")
 
     return result
+
+# matlab v5 .mat file
+def sniff(path):
+    if formats.extension(path) == ".mat" \
+       and formats.read_head(path, 128).startswith(b"MATLAB"):
+        return path
+    return None
+
+formats.register("umn1", sys.modules[__name__], sniff, description="umn1")
@@ -8,103 +8,97 @@ join = os.path.join
 import numpy as np
 import datetime, calendar
 
+from .. import columnar
+from .. import formats
+from ..lazy_flight import LazyFlight, whole_channel
+
 mps2kt = 1.94384
 r2d = 180.0 / math.pi
 d2r = math.pi / 180.0
 
-def load(h5_filename):
-    # Name of .mat file that exists in the directory defined above and
-    # has the flight_data and flight_info structures
-    filepath = h5_filename
-    flight_dir = os.path.dirname(filepath)
-    
-    # Open flight data log file:
-    data = h5py.File(filepath, 'r')
-        
-    # create data structures for ekf processing
-    result = {}
-    
-    last_gps_lon = 0.0
-    last_gps_lat = 0.0
-    
-    size = len(data['/Sensors/Fmu/Time_us'])
-    timestamp = data['/Sensors/Fmu/Time_us'][()].astype(float) * 1e-6
-
-    result['imu'] = []
-    gx = data['/Sensors/Fmu/Mpu9250/GyroX_rads'][()].astype(float)
-    gy = data['/Sensors/Fmu/Mpu9250/GyroY_rads'][()].astype(float)
-    gz = data['/Sensors/Fmu/Mpu9250/GyroZ_rads'][()].astype(float)
-    ax = data['/Sensors/Fmu/Mpu9250/AccelX_mss'][()].astype(float)
-    ay = data['/Sensors/Fmu/Mpu9250/AccelY_mss'][()].astype(float)
-    az = data['/Sensors/Fmu/Mpu9250/AccelZ_mss'][()].astype(float)
-    hxa = data['/Sensors/Fmu/Mpu9250/MagX_uT'][()].astype(float)
-    hya = data['/Sensors/Fmu/Mpu9250/MagY_uT'][()].astype(float)
-    hza = data['/Sensors/Fmu/Mpu9250/MagZ_uT'][()].astype(float)
-    temp = data['/Sensors/Fmu/Mpu9250/Temperature_C'][()].astype(float)
+# all umn3 channels share the flight computer time vector (seconds)
+def load_time(data, sl=slice(None)):
+    return data['/Sensors/Fmu/Time_us'][sl].astype(float)[:,0] * 1e-6
+
+# the range of records inside time_range = (t0, t1), found with a binary
+# search on the shared time vector
+def time_slice(data, time_range):
+    return columnar.time_slice(data['/Sensors/Fmu/Time_us'], time_range, 1e-6)
+
+# read a (N, 1) dataset as a flat array
+def column(data, path, sl=slice(None)):
+    return data[path][sl][:,0]
+
+def load_imu(data, time_range=None):
+    sl = time_slice(data, time_range)
+    timestamp = load_time(data, sl)
+    gx = column(data, '/Sensors/Fmu/Mpu9250/GyroX_rads', sl).astype(float)
+    gy = column(data, '/Sensors/Fmu/Mpu9250/GyroY_rads', sl).astype(float)
+    gz = column(data, '/Sensors/Fmu/Mpu9250/GyroZ_rads', sl).astype(float)
+    ax = column(data, '/Sensors/Fmu/Mpu9250/AccelX_mss', sl).astype(float)
+    ay = column(data, '/Sensors/Fmu/Mpu9250/AccelY_mss', sl).astype(float)
+    az = column(data, '/Sensors/Fmu/Mpu9250/AccelZ_mss', sl).astype(float)
+    hx = column(data, '/Sensors/Fmu/Mpu9250/MagX_uT', sl).astype(float)
+    hy = column(data, '/Sensors/Fmu/Mpu9250/MagY_uT', sl).astype(float)
+    hz = column(data, '/Sensors/Fmu/Mpu9250/MagZ_uT', sl).astype(float)
+    temp = column(data, '/Sensors/Fmu/Mpu9250/Temperature_C', sl).astype(float)
 
     # temporary fault modeling for a specific project
     if '/Excitation/Fault_GyroBias_2/gyro_faultBias_rps' in data:
-        gx2 = data['/Excitation/Fault_GyroBias_2/gyro_faultBias_rps'][()].astype(float)
+        gx2 = column(data, '/Excitation/Fault_GyroBias_2/gyro_faultBias_rps', sl).astype(float)
     else:
         gx2 = None
     if '/Excitation/Fault_GyroBias_10/gyro_faultBias_rps' in data:
-        gx10 = data['/Excitation/Fault_GyroBias_10/gyro_faultBias_rps'][()].astype(float)
+        gx10 = column(data, '/Excitation/Fault_GyroBias_10/gyro_faultBias_rps', sl).astype(float)
     else:
         gx10 = None
-        
-    for i in range( size ):
-        aircraft = 'none'
-        if aircraft == 'Mjolner':
-            affine = np.array(
-                [[ 0.018620589,   0.0003888403, -0.0003962612, -0.229103659 ],
-                 [-0.0014668783,  0.0179526977,  0.0008107074, -1.0884978428],
-                 [-0.000477532,   0.0004510884,  0.016958479,   0.3941687691],
-                 [ 0.,            0.,            0.,            1.          ]]
-            )
-            mag = np.array([hxa[i][0], hya[i][0], hza[i][0], 1.0])
-            #raw = np.hstack((mag, 1.0))
-            cal = np.dot(affine, mag)
-            hx = cal[0]
-            hy = cal[1]
-            hz = cal[2]
-        else:
-            hx = hxa[i][0]
-            hy = hya[i][0]
-            hz = hza[i][0]
-        imu_pt = {
-            'time': timestamp[i][0],
-            'p': gx[i][0],
-            'q': gy[i][0],
-            'r': gz[i][0],
-            'ax': ax[i][0],
-            'ay': ay[i][0],
-            'az': az[i][0],
-            'hx': hx,
-            'hy': hy,
-            'hz': hz,
-            'temp': temp[i][0]
-        }
-        if imu_pt['time'] > 10000000:
-            continue
-        if not gx2 is None:
-            imu_pt['p'] -= gx2[i][0]
-        if not gx10 is None:
-            imu_pt['p'] -= gx10[i][0]
-        if not gx2 is None:
-            imu_pt['p'] -= gx2[i][0]
-        if not gx10 is None:
-            imu_pt['p'] -= gx10[i][0]
-        result['imu'].append(imu_pt)
-
-    result['gps'] = []
-    lat_rad = data['/Sensors/uBlox/Latitude_rad'][()]
-    lon_rad = data['/Sensors/uBlox/Longitude_rad'][()]
-    alt = data['/Sensors/uBlox/Altitude_m'][()]
-    vn = data['/Sensors/uBlox/NorthVelocity_ms'][()]
-    ve = data['/Sensors/uBlox/EastVelocity_ms'][()]
-    vd = data['/Sensors/uBlox/DownVelocity_ms'][()]
-    sats = data['/Sensors/uBlox/NumberSatellites'][()]
-    tow = data['/Sensors/uBlox/TOW'][()]
+
+    aircraft = 'none'
+    if aircraft == 'Mjolner':
+        affine = np.array(
+            [[ 0.018620589,   0.0003888403, -0.0003962612, -0.229103659 ],
+             [-0.0014668783,  0.0179526977,  0.0008107074, -1.0884978428],
+             [-0.000477532,   0.0004510884,  0.016958479,   0.3941687691],
+             [ 0.,            0.,            0.,            1.          ]]
+        )
+        mag = np.vstack( (hx, hy, hz, np.ones(len(hx))) )
+        cal = affine @ mag
+        hx = cal[0]
+        hy = cal[1]
+        hz = cal[2]
+
+    if not gx2 is None:
+        gx = gx - gx2
+    if not gx10 is None:
+        gx = gx - gx10
+    if not gx2 is None:
+        gx = gx - gx2
+    if not gx10 is None:
+        gx = gx - gx10
+
+    imu = {
+        'time': timestamp,
+        'p': gx,
+        'q': gy,
+        'r': gz,
+        'ax': ax,
+        'ay': ay,
+        'az': az,
+        'hx': hx,
+        'hy': hy,
+        'hz': hz,
+        'temp': temp
+    }
+    return columnar.select(imu, timestamp <= 10000000)
+
+def load_gps(data, time_range=None):
+    sl = time_slice(data, time_range)
+    timestamp = load_time(data, sl)
+    lat = column(data, '/Sensors/uBlox/Latitude_rad', sl) * r2d
+    lon = column(data, '/Sensors/uBlox/Longitude_rad', sl) * r2d
+    alt = column(data, '/Sensors/uBlox/Altitude_m', sl)
+    vd = column(data, '/Sensors/uBlox/DownVelocity_ms', sl)
+    tow = column(data, '/Sensors/uBlox/TOW', sl)
     year = data['/Sensors/uBlox/Year'][()]
     month = data['/Sensors/uBlox/Month'][()]
     day = data['/Sensors/uBlox/Day'][()]
@@ -114,322 +108,286 @@ def load(h5_filename):
     if year[0][0] > 0:
         d = datetime.datetime(year[0][0], month[0][0], day[0][0],
                               hour[0][0], minute[0][0], second[0][0])
-        unixbase = calendar.timegm(d.timetuple()) - timestamp[0][0]
+        unixbase = calendar.timegm(d.timetuple()) - load_time(data, slice(0, 1))[0]
     else:
         unixbase = 0
 
     est_vd = False
     if est_vd:
-        last_alt = alt[0][0]
-        last_time = timestamp[0][0]
-        last_tow = tow[0][0]
-        vd_list = []
-        vd_est = 0.0
         print("NOTICE: estimating gps velocity by differentiating altitude.")
-        for i in range( size ):
-            if tow[i][0] != last_tow:
-                dt = timestamp[i][0] - last_time
-                da = alt[i][0] - last_alt
-                print("sec: %.2f" % tow[i][0], "t: %.3f" % timestamp[i][0], "dt: %.3f" % dt,
-                      "alt: %.2f" % alt[i][0], "da: %.2f" % da)
-                if dt > 0.001:
-                    vd_est = -da / dt
-                else:
-                    vd_est = 0.0
-                last_alt = alt[i][0]
-                last_time = timestamp[i][0]
-                last_tow = tow[i][0]
-            vd_list.append(vd_est)
-        
-    for i in range( size ):
-        lat = lat_rad[i][0] * r2d
-        lon = lon_rad[i][0] * r2d
-        #print lon,lat,alt
-        if abs(lat - last_gps_lat) > 0.0000000001 or abs(lon - last_gps_lon) > 0.0000000000001:
-            last_gps_lat = lat
-            last_gps_lon = lon
-            if est_vd:
-                vd_pt = vd_list[i]
-            else:
-                vd_pt = vd[i][0]
-            gps_pt = {
-                'time': timestamp[i][0],
-                'unix_sec': unixbase + timestamp[i][0],
-                'lat': lat,
-                'lon': lon,
-                'alt': alt[i][0],
-                'vn': vn[i][0],
-                've': ve[i][0],
-                'vd': vd_pt,
-                'sats': int(sats[i][0])
-            }
-            result['gps'].append(gps_pt)
-            
-    result['air'] = []
+        # differentiate altitude between gps updates (tow changes) and hold
+        # the estimate until the next update
+        update = np.flatnonzero(np.diff(tow, prepend=tow[:1]) != 0)
+        prev = np.concatenate( ([0], update[:-1]) )
+        dt = timestamp[update] - timestamp[prev]
+        da = alt[update] - alt[prev]
+        est = np.zeros(len(update))
+        est[dt > 0.001] = -da[dt > 0.001] / dt[dt > 0.001]
+        vd_list = np.zeros(len(timestamp))
+        vd_list[update] = est
+        marks = np.zeros(len(timestamp), dtype=int)
+        marks[update] = update
+        vd = vd_list[np.maximum.accumulate(marks)]
+
+    # only keep records where the gps position changed
+    dlat = np.abs(np.diff(lat, prepend=0.0))
+    dlon = np.abs(np.diff(lon, prepend=0.0))
+    new = (dlat > 0.0000000001) | (dlon > 0.0000000000001)
+
+    gps = {
+        'time': timestamp,
+        'unix_sec': unixbase + timestamp,
+        'lat': lat,
+        'lon': lon,
+        'alt': alt,
+        'vn': column(data, '/Sensors/uBlox/NorthVelocity_ms', sl),
+        've': column(data, '/Sensors/uBlox/EastVelocity_ms', sl),
+        'vd': vd,
+        'sats': column(data, '/Sensors/uBlox/NumberSatellites', sl).astype(int)
+    }
+    return columnar.select(gps, new)
+
+def load_air(data, time_range=None):
+    sl = time_slice(data, time_range)
+    air = { 'time': load_time(data, sl) }
     if '/Sensor-Processing/Standard/vIAS_ms' in data:
-        airspeed = data['/Sensor-Processing/Standard/vIAS_ms'][()] * mps2kt
+        air['airspeed'] = column(data, '/Sensor-Processing/Standard/vIAS_ms', sl) * mps2kt
     elif '/Sensor-Processing/vIAS_ms' in data:
-        airspeed = data['/Sensor-Processing/vIAS_ms'][()] * mps2kt
-    else:
-        airspeed = None
+        air['airspeed'] = column(data, '/Sensor-Processing/vIAS_ms', sl) * mps2kt
     if '/Sensor-Processing/Altitude_m' in data:
-        altitude = data['/Sensor-Processing/Altitude_m'][()]
+        altitude = column(data, '/Sensor-Processing/Altitude_m', sl)
+        air['alt_press'] = altitude
+        air['alt_true'] = altitude
     if '/Sensors/5Hole/Tip/Temperature_C' in data:
-        temp = data['/Sensors/5Hole/Tip/Temperature_C'][()]
-    for i in range( size ):
-        air_pt = {
-            'time': timestamp[i][0],
-        }
-        if not airspeed is None:
-            air_pt['airspeed'] = airspeed[i][0]
-        if '/Sensor-Processing/Altitude_m' in data:
-            air_pt['alt_press'] = altitude[i][0]
-            air_pt['alt_true'] = altitude[i][0]
-        if '/Sensors/5Hole/Tip/Temperature_C' in data:
-            air_pt['temp'] = temp[i][0]
-        result['air'].append(air_pt)
-        
-    result['filter'] = []
+        air['temp'] = column(data, '/Sensors/5Hole/Tip/Temperature_C', sl)
+    return air
+
+def load_filter(data, time_range=None):
+    sl = time_slice(data, time_range)
     if '/Sensor-Processing/Baseline/INS' in data:
         path = '/Sensor-Processing/Baseline/INS'
     elif '/Sensor-Processing/Standard' in data:
         path = '/Sensor-Processing/Standard'
-    lat = data[path + '/Latitude_rad'][()]
-    lon = data[path + '/Longitude_rad'][()]
-    alt = data[path + '/Altitude_m'][()]
-    vn = data[path + '/NorthVelocity_ms'][()]
-    ve = data[path + '/EastVelocity_ms'][()]
-    vd = data[path + '/DownVelocity_ms'][()]
-    roll = data[path + '/Roll_rad'][()]
-    pitch = data[path + '/Pitch_rad'][()]
-    yaw = data[path + '/Heading_rad'][()]
-    gbx = data[path + '/GyroXBias_rads'][()]
-    gby = data[path + '/GyroYBias_rads'][()]
-    gbz = data[path + '/GyroZBias_rads'][()]
-    abx = data[path + '/AccelXBias_mss'][()]
-    aby = data[path + '/AccelYBias_mss'][()]
-    abz = data[path + '/AccelZBias_mss'][()]
-    for i in range( size ):
-        psi = yaw[i][0]
-        if psi > math.pi:
-            psi -= 2*math.pi
-        if psi < -math.pi:
-            psi += 2*math.pi
-        psix = math.cos(psi)
-        psiy = math.sin(psi)
-        nav = {
-            'time': timestamp[i][0],
-            'lat': lat[i][0],
-            'lon': lon[i][0],
-            'alt': alt[i][0],
-            'vn': vn[i][0],
-            've': ve[i][0],
-            'vd': vd[i][0],
-            'phi': roll[i][0],
-            'the': pitch[i][0],
-            'psi': psi,
-            'psix': psix,
-            'psiy': psiy,
-            'p_bias': gbx[i][0],
-            'q_bias': gby[i][0],
-            'r_bias': gbz[i][0],
-            'ax_bias': abx[i][0],
-            'ay_bias': aby[i][0],
-            'az_bias': abz[i][0]
-        }
-        if abs(nav['lat']) > 0.0001 and abs(nav['lon']) > 0.0001:
-            result['filter'].append(nav)
-
-    if False:
-        # load filter (post process) records if they exist (for comparison
-        # purposes)
-        filter_post = os.path.join(flight_dir, "filter-post.csv")
-        if os.path.exists(filter_post):
-            print('Also loading:', filter_post, '(because it exists)')
-            result['filter_post'] = []
-            with open(filter_post, 'r') as ffilter:
-                reader = csv.DictReader(ffilter)
-                for row in reader:
-                    lat = float(row['latitude_deg'])
-                    lon = float(row['longitude_deg'])
-                    if abs(lat) > 0.0001 and abs(lon) > 0.0001:
-                        psi_deg = float(row['heading_deg'])
-                        if psi_deg > 180.0:
-                            psi_deg = psi_deg - 360.0
-                        if psi_deg < -180.0:
-                            psi_deg = psi_deg + 360.0
-                        nav = {
-                            'time': float(row['timestamp']),
-                            'lat': lat*d2r,
-                            'lon': lon*d2r,
-                            'alt': float(row['altitude_m']),
-                            'vn': float(row['vn_ms']),
-                            've': float(row['ve_ms']),
-                            'vd': float(row['vd_ms']),
-                            'phi': float(row['roll_deg'])*d2r,
-                            'the': float(row['pitch_deg'])*d2r,
-                            'psi': psi_deg*d2r,
-                            'p_bias': float(row['p_bias']),
-                            'q_bias': float(row['q_bias']),
-                            'r_bias': float(row['r_bias']),
-                            'ax_bias': float(row['ax_bias']),
-                            'ay_bias': float(row['ay_bias']),
-                            'az_bias': float(row['az_bias'])
-                        }
-                        result['filter_post'].append(nav)
-
-    result['pilot'] = []
+    psi = column(data, path + '/Heading_rad', sl)
+    psi = np.where(psi > math.pi, psi - 2*math.pi, psi)
+    psi = np.where(psi < -math.pi, psi + 2*math.pi, psi)
+    nav = {
+        'time': load_time(data, sl),
+        'lat': column(data, path + '/Latitude_rad', sl),
+        'lon': column(data, path + '/Longitude_rad', sl),
+        'alt': column(data, path + '/Altitude_m', sl),
+        'vn': column(data, path + '/NorthVelocity_ms', sl),
+        've': column(data, path + '/EastVelocity_ms', sl),
+        'vd': column(data, path + '/DownVelocity_ms', sl),
+        'phi': column(data, path + '/Roll_rad', sl),
+        'the': column(data, path + '/Pitch_rad', sl),
+        'psi': psi,
+        'psix': np.cos(psi),
+        'psiy': np.sin(psi),
+        'p_bias': column(data, path + '/GyroXBias_rads', sl),
+        'q_bias': column(data, path + '/GyroYBias_rads', sl),
+        'r_bias': column(data, path + '/GyroZBias_rads', sl),
+        'ax_bias': column(data, path + '/AccelXBias_mss', sl),
+        'ay_bias': column(data, path + '/AccelYBias_mss', sl),
+        'az_bias': column(data, path + '/AccelZBias_mss', sl)
+    }
+    valid = (np.abs(nav['lat']) > 0.0001) & (np.abs(nav['lon']) > 0.0001)
+    return columnar.select(nav, valid)
+
+# pilot stick inputs (sbus channels if logged, otherwise the commands)
+def load_inputs(data, sl=slice(None)):
     if '/Sensors/Sbus/Channels/3' in data:
-        roll = data['/Sensors/Sbus/Channels/3'][()]
+        roll = column(data, '/Sensors/Sbus/Channels/3', sl)
     elif '/Control/cmdRoll_rads' in data:
-        roll = data['/Control/cmdRoll_rads'][()]
+        roll = column(data, '/Control/cmdRoll_rads', sl)
     elif '/Control/cmdRoll_rps' in data:
-        roll = data['/Control/cmdRoll_rps'][()]
-        
+        roll = column(data, '/Control/cmdRoll_rps', sl)
+
     if '/Sensors/Sbus/Channels/4' in data:
-        pitch = data['/Sensors/Sbus/Channels/4'][()]
+        pitch = column(data, '/Sensors/Sbus/Channels/4', sl)
     elif '/Control/cmdPitch_rads' in data:
-        pitch = data['/Control/cmdPitch_rads'][()]
+        pitch = column(data, '/Control/cmdPitch_rads', sl)
     elif '/Control/cmdPitch_rps' in data:
-        pitch = data['/Control/cmdPitch_rps'][()]
-        
+        pitch = column(data, '/Control/cmdPitch_rps', sl)
+
     if '/Sensors/Sbus/Channels/5' in data:
-        yaw = data['/Sensors/Sbus/Channels/5'][()]
+        yaw = column(data, '/Sensors/Sbus/Channels/5', sl)
     elif '/Control/cmdYaw_rads' in data:
-        yaw = data['/Control/cmdYaw_rads'][()]
+        yaw = column(data, '/Control/cmdYaw_rads', sl)
     elif '/Control/cmdYaw_rps' in data:
-        yaw = data['/Control/cmdYaw_rps'][()]
+        yaw = column(data, '/Control/cmdYaw_rps', sl)
 
     if '/Sensors/Sbus/Channels/7' in data:
-        motor = data['/Sensors/Sbus/Channels/7'][()]
+        motor = column(data, '/Sensors/Sbus/Channels/7', sl)
     elif '/Control/cmdMotor_nd' in data:
-        motor = data['/Control/cmdMotor_nd'][()]
-        
+        motor = column(data, '/Control/cmdMotor_nd', sl)
+
     if '/Sensors/Sbus/Channels/6' in data:
-        flaps = data['/Sensors/Sbus/Channels/6'][()]
+        flaps = column(data, '/Sensors/Sbus/Channels/6', sl)
     elif '/Control/cmdFlap_nd' in data:
-        flaps = data['/Control/cmdFlap_nd'][()]
-        
-    auto = data['/Mission/socEngage'][()]
-    for i in range( size ):
-        pilot = {
-            'time': timestamp[i][0],
-            'aileron': roll[i][0],
-            'elevator': pitch[i][0],
-            'throttle': motor[i][0],
-            'rudder': yaw[i][0],
-            'flaps': flaps[i][0],
-            'gear': 0.0,
-            'aux1': 0.0,
-            'auto_manual': auto[i][0]
-        }
-        result['pilot'].append(pilot)
-        
-    result['act'] = []
-    for i in range( size ):
-        act = {
-            'time': timestamp[i][0],
-            'aileron': roll[i][0],
-            'elevator': pitch[i][0],
-            'rudder': yaw[i][0],
-            'throttle': motor[i][0],
-            'flaps': flaps[i][0],
-            'gear': 0.0,
-            'aux1': 0.0
-        }
-        result['act'].append(act)
-                
-    result['ap'] = []
+        flaps = column(data, '/Control/cmdFlap_nd', sl)
+
+    return roll, pitch, yaw, motor, flaps
+
+def load_pilot(data, time_range=None):
+    sl = time_slice(data, time_range)
+    timestamp = load_time(data, sl)
+    roll, pitch, yaw, motor, flaps = load_inputs(data, sl)
+    return {
+        'time': timestamp,
+        'aileron': roll,
+        'elevator': pitch,
+        'throttle': motor,
+        'rudder': yaw,
+        'flaps': flaps,
+        'gear': np.zeros(len(timestamp)),
+        'aux1': np.zeros(len(timestamp)),
+        'auto_manual': column(data, '/Mission/socEngage', sl)
+    }
+
+def load_act(data, time_range=None):
+    sl = time_slice(data, time_range)
+    timestamp = load_time(data, sl)
+    roll, pitch, yaw, motor, flaps = load_inputs(data, sl)
+    return {
+        'time': timestamp,
+        'aileron': roll,
+        'elevator': pitch,
+        'rudder': yaw,
+        'throttle': motor,
+        'flaps': flaps,
+        'gear': np.zeros(len(timestamp)),
+        'aux1': np.zeros(len(timestamp))
+    }
+
+def load_ap(data, time_range=None):
+    sl = time_slice(data, time_range)
+    timestamp = load_time(data, sl)
+    auto = column(data, '/Mission/socEngage', sl)
+    zeros = np.zeros(len(timestamp))
+    ap = {
+        'time': timestamp,
+        'master_switch': (auto > 0).astype(int),
+        'pilot_pass_through': np.zeros(len(timestamp), dtype=int),
+        'hdg': zeros,
+        'alt': zeros,
+        'ground': zeros
+    }
     if '/Control/refPhi_rad' in data:
-        roll = data['/Control/refPhi_rad'][()]
+        ap['roll'] = column(data, '/Control/refPhi_rad', sl) * r2d
     else:
-        roll = None
+        ap['roll'] = zeros
     if '/Control/refTheta_rad' in data:
-        pitch = data['/Control/refTheta_rad'][()]
+        ap['pitch'] = column(data, '/Control/refTheta_rad', sl) * r2d
     else:
-        pitch = None
+        ap['pitch'] = zeros
     if '/Control/refV_ms' in data:
-        vel = data['/Control/refV_ms'][()]
+        ap['speed'] = column(data, '/Control/refV_ms', sl) * mps2kt
     else:
-        vel = None
-    for i in range( size ):
-        ap = {
-            'time': timestamp[i][0],
-            'master_switch': int(auto[i][0] > 0),
-            'pilot_pass_through': int(0),
-            'hdg': 0.0,
-            'alt': 0.0,
-            'ground': 0.0
-        }
-        if not roll is None:
-            ap['roll'] = roll[i][0] * r2d
-        else:
-            ap['roll'] = 0.0
-        if not pitch is None:
-            ap['pitch'] = pitch[i][0] * r2d
-        else:
-            ap['pitch'] = 0.0
-        if not vel is None:
-            ap['speed'] = vel[i][0] * mps2kt
-        else:
-            ap['speed'] = 0.0
-        result['ap'].append(ap)
-
-    result['health'] = []
-    vcc = data['/Sensors/Fmu/Voltage/Input_V']
-    for i in range( size ):
-        health = {
-            'time': timestamp[i][0],
-            'main_vcc': vcc[i][0]
-            #'test_index': indxTest[i][0],
-            #'excite_mode': exciteMode[i][0]
-        }
-        result['health'].append(health)
-
-    result['event'] = []
-    socEngage = data['/Mission/socEngage'][()]
+        ap['speed'] = zeros
+    return ap
+
+def load_health(data, time_range=None):
+    sl = time_slice(data, time_range)
+    return {
+        'time': load_time(data, sl),
+        'main_vcc': column(data, '/Sensors/Fmu/Voltage/Input_V', sl)
+        #'test_index': indxTest[i][0],
+        #'excite_mode': exciteMode[i][0]
+    }
+
+# generate events from the changes in the mission state flags
+def load_events(data, time_range=None):
+    timestamp = load_time(data)
+    socEngage = column(data, '/Mission/socEngage')
     if '/Mission/testPtID' in data:
-        indxTest = data['/Mission/testPtID'][()] 
+        indxTest = column(data, '/Mission/testPtID')
     elif '/Mission/testID' in data:
-        indxTest = data['/Mission/testID'][()] 
+        indxTest = column(data, '/Mission/testID')
     #exciteMode = data['/Mission/testSel'][()]
-    exciteEngage = data['/Mission/excitEngage'][()]
-    last_soc = 0
-    last_id = -1
-    last_excite = 0
-    for i in range( size ):
-        soc = socEngage[i][0]
-        test_id = indxTest[i][0]
-        excite = exciteEngage[i][0]
-        if soc != last_soc:
-            event = {
-                'time': timestamp[i][0]
-            }
-            if soc:
-                event['message'] = "SOC Engaged"
-            else:
-                event['message'] = "SOC Disengaged"
-            result['event'].append(event)
-            last_soc = soc
-        if test_id != last_id:
-            event = {
-                'time': timestamp[i][0]
-            }
-            event['message'] = 'Test ID = %d' % test_id
-            result['event'].append(event)
-            last_id = test_id
-        if excite != last_excite:
-            event = {
-                'time': timestamp[i][0]
-            }
-            if excite:
-                event['message'] = "Excitation Start"
-            else:
-                event['message'] = "Excitation End"
-            result['event'].append(event)
-
-            last_excite = excite
-            
+    exciteEngage = column(data, '/Mission/excitEngage')
+
+    events = []                 # (index, order, message)
+    for i in np.flatnonzero(np.diff(socEngage, prepend=0) != 0):
+        if socEngage[i]:
+            events.append( (i, 0, "SOC Engaged") )
+        else:
+            events.append( (i, 0, "SOC Disengaged") )
+    for i in np.flatnonzero(np.diff(indxTest, prepend=-1) != 0):
+        events.append( (i, 1, 'Test ID = %d' % indxTest[i]) )
+    for i in np.flatnonzero(np.diff(exciteEngage, prepend=0) != 0):
+        if exciteEngage[i]:
+            events.append( (i, 2, "Excitation Start") )
+        else:
+            events.append( (i, 2, "Excitation End") )
+    events.sort()
+    index = np.array([ e[0] for e in events ], dtype=int)
+    result = {
+        'time': timestamp[index],
+        'message': np.array([ e[2] for e in events ], dtype=str)
+    }
+    # find the state changes over the whole flight so a time window
+    # doesn't produce spurious events at its start
+    return columnar.clip_time(result, time_range)
+
+# channels in the file mapped to their loader functions (for LazyFlight).
+# umn3 channels are read whole the first time any field is requested.
+def lazy_channels(data):
+    return {
+        'imu': whole_channel(load_imu),
+        'gps': whole_channel(load_gps),
+        'air': whole_channel(load_air),
+        'filter': whole_channel(load_filter),
+        'pilot': whole_channel(load_pilot),
+        'act': whole_channel(load_act),
+        'ap': whole_channel(load_ap),
+        'health': whole_channel(load_health),
+        'event': whole_channel(load_events)
+    }
+
+def lazy_load(h5_filename, layout='records', time_range=None):
+    return LazyFlight(h5_filename, lazy_channels, layout, time_range)
+
+# load the flight as a dict of channels, each channel a dict of field name
+# -> numpy array
+def load_columns(h5_filename, time_range=None):
+    # Open flight data log file:
+    data = h5py.File(h5_filename, 'r')
+
+    result = {}
+    result['imu'] = load_imu(data, time_range)
+    result['gps'] = load_gps(data, time_range)
+    result['air'] = load_air(data, time_range)
+    result['filter'] = load_filter(data, time_range)
+    result['pilot'] = load_pilot(data, time_range)
+    result['act'] = load_act(data, time_range)
+    result['ap'] = load_ap(data, time_range)
+    result['health'] = load_health(data, time_range)
+    result['event'] = load_events(data, time_range)
+
+    data.close()
+    return result
+
+# the small subset of a flight needed to catalog it: the first and last
+# time stamp and the gps fixes
+def load_summary(h5_filename):
+    data = h5py.File(h5_filename, 'r')
+    time_us = data['/Sensors/Fmu/Time_us']
+    result = {
+        'imu': { 'time': np.array([ time_us[i][0] for i in [0, -1][:len(time_us)] ]) * 1e-6 },
+        'gps': load_gps(data)
+    }
+    data.close()
+    return result
+
+def load(h5_filename, time_range=None):
+    result = columnar.flight_to_records(load_columns(h5_filename, time_range))
+    export_txt(h5_filename, result)
+    return result
+
+# write simple text versions of the imu, gps, and filter data next to the
+# flight log
+def export_txt(h5_filename, result):
     dir = os.path.dirname(h5_filename)
     # print('dir:', dir)
     
@@ -452,4 +410,12 @@ def load(h5_filename):
             line = [ '%.5f' % filtpt['time'], '%.10f' % filtpt['lat'], '%.10f' % filtpt['lon'], '%.4f' % filtpt['alt'], '%.4f' % filtpt['vn'], '%.4f' % filtpt['ve'], '%.4f' % filtpt['vd'], '%.4f' % (filtpt['phi']*r2d), '%.4f' % (filtpt['the']*r2d), '%.4f' % (filtpt['psi']*r2d), '0' ]
             f.write(','.join(line) + '\n')
 
-    return result
+# hdf5 without a /metadata group but with the goldy3 /Sensors tree
+def sniff(path):
+    info = formats.hdf5_info(path)
+    if info is not None and info[0] is None and 'Sensors' in info[1]:
+        return path
+    return None
+
+formats.register('umn3', sys.modules[__name__], sniff,
+                 description='UMN3 (hdf5)', time_range=True)
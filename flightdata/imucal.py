@@ -7,6 +7,85 @@ from props import PropertyNode, root, getNode
 import props_json
 import props_xml
 
+from . import columnar
+
+# calibrated imu axes (bias and scale fits) and the magnetometer axes
+axes = ['p', 'q', 'r', 'ax', 'ay', 'az']
+mag_axes = ['hx', 'hy', 'hz']
+
+# evaluate one polynomial per row of coeffs (highest power first, like
+# np.polyval) at every temperature with Horner's rule.  Returns a
+# (rows, len(temp)) array.
+def polyval_rows(coeffs, temp):
+    result = np.zeros( (coeffs.shape[0], len(temp)) )
+    for i in range(coeffs.shape[1]):
+        result = result * temp + coeffs[:,i:i+1]
+    return result
+
+# stack polynomial coefficient arrays into rows, lower order fits are
+# padded with leading zeros
+def stack_coeffs(polys):
+    n = max([ len(p) for p in polys ])
+    result = np.zeros( (len(polys), n) )
+    for i, p in enumerate(polys):
+        result[i,n-len(p):] = p
+    return result
+
+# polynomial coefficients as a space separated string (%g keeps the
+# precision of the small higher order terms)
+def format_coeffs(coeffs):
+    return ' '.join([ '%.10g' % x for x in coeffs ])
+
+# the lookup table file saved next to a calibration file
+def table_filename(cal_file):
+    return os.path.splitext(cal_file)[0] + '_table.npz'
+
+# linear interpolation of the bias and scale tables (all twelve columns
+# at once) at each (already clamped) temperature.  Returns two (6, N)
+# arrays.
+def table_lookup(table, temp):
+    grid = table['temp']
+    values = table['values']
+    if not 'slope' in table:
+        table['slope'] = np.diff(values, axis=0)
+    if grid[-1] > grid[0]:
+        x = (temp - grid[0]) * ((len(grid) - 1) / (grid[-1] - grid[0]))
+    else:
+        x = np.zeros(len(temp))
+    i = np.clip(x.astype(int), 0, len(grid) - 2)
+    f = x - i
+    result = np.take(values, i, axis=0)
+    result += np.take(table['slope'], i, axis=0) * f[:,np.newaxis]
+    return result[:,:len(axes)].T, result[:,len(axes):].T
+
+# apply a 4x4 affine matrix to the hx, hy, hz columns.  Returns an (N, 4)
+# array.
+def mag_transform(affine, imu):
+    hx = np.asarray(imu['hx'], dtype=np.float64)
+    hs = np.column_stack( (hx, np.asarray(imu['hy']), np.asarray(imu['hz']),
+                           np.ones(len(hx))) )
+    return hs @ affine.T
+
+# imu data as a dict of arrays: columnar channels are used as is, a list of
+# records is converted once
+def as_columns(data):
+    if isinstance(data, dict):
+        return data
+    return columnar.records_to_columns(data)
+
+# store the given fields back into the original data (columnar channel or
+# list of records) and return it
+def write_back(data, columns, fields):
+    fields = [ f for f in fields if f in columns ]
+    if isinstance(data, dict):
+        for f in fields:
+            data[f] = columns[f]
+    else:
+        values = [ np.asarray(columns[f]).tolist() for f in fields ]
+        for record, row in zip(data, zip(*values)):
+            record.update(zip(fields, row))
+    return data
+
 class Calibration():
     def __init__(self):
         self.valid = False
@@ -29,6 +108,8 @@ class Calibration():
         self.az_scale = np.array([0.0, 0.0, 1.0])
         self.mag_affine = np.identity(4)
         self.mag_affine_inv = np.linalg.inv(self.mag_affine)
+        # optional bias/scale lookup table (see build_table())
+        self.table = None
 
     # load/parse an xml calibration file
     def load(self, cal_file):
@@ -52,47 +133,12 @@ class Calibration():
         self.min_temp = config.getFloat('min_temp_C')
         self.max_temp = config.getFloat('max_temp_C')
         
-        node = config.getChild('p')
-        if node:
-            p1, p2, p3 = node.getString('bias').split()
-            self.p_bias = np.array([p1, p2, p3], dtype=np.float64)
-            p1, p2, p3 = node.getString('scale').split()
-            self.p_scale = np.array([p1, p2, p3], dtype=np.float64)
-
-        node = config.getChild('q')
-        if node:
-            p1, p2, p3 = node.getString('bias').split()
-            self.q_bias = np.array([p1, p2, p3], dtype=np.float64)
-            p1, p2, p3 = node.getString('scale').split()
-            self.q_scale = np.array([p1, p2, p3], dtype=np.float64)
-
-        node = config.getChild('r')
-        if node:
-            p1, p2, p3 = node.getString('bias').split()
-            self.r_bias = np.array([p1, p2, p3], dtype=np.float64)
-            p1, p2, p3 = node.getString('scale').split()
-            self.r_scale = np.array([p1, p2, p3], dtype=np.float64)
-
-        node = config.getChild('ax')
-        if node:
-            p1, p2, p3 = node.getString('bias').split()
-            self.ax_bias = np.array([p1, p2, p3], dtype=np.float64)
-            p1, p2, p3 = node.getString('scale').split()
-            self.ax_scale = np.array([p1, p2, p3], dtype=np.float64)
-
-        node = config.getChild('ay')
-        if node:
-            p1, p2, p3 = node.getString('bias').split()
-            self.ay_bias = np.array([p1, p2, p3], dtype=np.float64)
-            p1, p2, p3 = node.getString('scale').split()
-            self.ay_scale = np.array([p1, p2, p3], dtype=np.float64)
-
-        node = config.getChild('az')
-        if node:
-            p1, p2, p3 = node.getString('bias').split()
-            self.az_bias = np.array([p1, p2, p3], dtype=np.float64)
-            p1, p2, p3 = node.getString('scale').split()
-            self.az_scale = np.array([p1, p2, p3], dtype=np.float64)
+        # polynomial fits (highest power first) of any order
+        for a in axes:
+            node = config.getChild(a)
+            if node:
+                setattr(self, a + '_bias', np.array(node.getString('bias').split(), dtype=np.float64))
+                setattr(self, a + '_scale', np.array(node.getString('scale').split(), dtype=np.float64))
 
         tokens = config.getString('mag_affine').split()
         if len(tokens) == 16:
@@ -110,49 +156,34 @@ class Calibration():
         #print('mag_affine:\n', self.mag_affine)
         #print('mag_affine_inv:\n', self.mag_affine_inv)
 
+        # use a previously saved lookup table if it matches this calibration
+        self.table = None
+        table_file = table_filename(cal_file)
+        if os.path.exists(table_file):
+            with np.load(table_file) as data:
+                table = dict(data)
+            if table['coeffs'].shape == self.coeffs().shape \
+               and np.allclose(table['coeffs'], self.coeffs(), rtol=0, atol=1e-7) \
+               and table['temp'][0] == self.min_temp \
+               and table['temp'][-1] == self.max_temp:
+                table['coeffs'] = self.coeffs()
+                self.table = table
+            else:
+                print('ignoring stale lookup table:', table_file)
+
         return True
     
-    # save a configuration file
-    def save(self, cal_file):
+    # save a configuration file (and the lookup table next to it if
+    # save_table is set, building it first if needed)
+    def save(self, cal_file, save_table=False):
         config = PropertyNode()
         config.setFloat('min_temp_C', self.min_temp)
         config.setFloat('max_temp_C', self.max_temp)
 
-        node = config.getChild('p', create=True)
-        p = self.p_bias
-        node.setString('bias', "%.8f %.8f %.8f" % (p[0], p[1], p[2]))
-        p = self.p_scale
-        node.setString('scale', "%.8f %.8f %.8f" % (p[0], p[1], p[2]))
-
-        node = config.getChild('q', create=True)
-        p = self.q_bias
-        node.setString('bias', "%.8f %.8f %.8f" % (p[0], p[1], p[2]))
-        p = self.q_scale
-        node.setString('scale', "%.8f %.8f %.8f" % (p[0], p[1], p[2]))
-
-        node = config.getChild('r', create=True)
-        p = self.r_bias
-        node.setString('bias', "%.8f %.8f %.8f" % (p[0], p[1], p[2]))
-        p = self.r_scale
-        node.setString('scale', "%.8f %.8f %.8f" % (p[0], p[1], p[2]))
-
-        node = config.getChild('ax', create=True)
-        p = self.ax_bias
-        node.setString('bias', "%.8f %.8f %.8f" % (p[0], p[1], p[2]))
-        p = self.ax_scale
-        node.setString('scale', "%.8f %.8f %.8f" % (p[0], p[1], p[2]))
-
-        node = config.getChild('ay', create=True)
-        p = self.ay_bias
-        node.setString('bias', "%.8f %.8f %.8f" % (p[0], p[1], p[2]))
-        p = self.ay_scale
-        node.setString('scale', "%.8f %.8f %.8f" % (p[0], p[1], p[2]))
-
-        node = config.getChild('az', create=True)
-        p = self.az_bias
-        node.setString('bias', "%.8f %.8f %.8f" % (p[0], p[1], p[2]))
-        p = self.az_scale
-        node.setString('scale', "%.8f %.8f %.8f" % (p[0], p[1], p[2]))
+        for a in axes:
+            node = config.getChild(a, create=True)
+            node.setString('bias', format_coeffs(getattr(self, a + '_bias')))
+            node.setString('scale', format_coeffs(getattr(self, a + '_scale')))
 
         affine_str = []
         for x in self.mag_affine.flat:
@@ -166,97 +197,133 @@ class Calibration():
             print("error saving " + cal_file + ": " + str(sys.exc_info()[1]))
             return
 
-    # correct the IMU data given the current bias and scale errors
+        if save_table:
+            if not self.table_valid():
+                self.build_table()
+            np.savez(table_filename(cal_file), temp=self.table['temp'],
+                     values=self.table['values'], coeffs=self.table['coeffs'])
+
+    # all the bias and scale fit coefficients: a (12, order+1) array, the
+    # six bias rows followed by the six scale rows
+    def coeffs(self):
+        return stack_coeffs([ getattr(self, a + '_bias') for a in axes ]
+                            + [ getattr(self, a + '_scale') for a in axes ])
+
+    # tabulate bias and scale of every axis over [min_temp, max_temp] at
+    # step (C) intervals so corrections can use a cheap linear table lookup
+    # instead of evaluating the polynomials at every sample
+    def build_table(self, step=0.05):
+        n = max(2, int(np.ceil((self.max_temp - self.min_temp) / step)) + 1)
+        temp = np.linspace(self.min_temp, self.max_temp, n)
+        coeffs = self.coeffs()
+        self.table = {
+            'temp': temp,
+            'values': polyval_rows(coeffs, temp).T,    # (n, 12)
+            'coeffs': coeffs
+        }
+
+    # the table exists and was built from the current coefficients
+    def table_valid(self):
+        if self.table is None:
+            return False
+        coeffs = self.coeffs()
+        return self.table['coeffs'].shape == coeffs.shape \
+            and np.array_equal(self.table['coeffs'], coeffs) \
+            and self.table['temp'][0] == self.min_temp \
+            and self.table['temp'][-1] == self.max_temp
+
+    # bias and scale of every axis (see axes) at each temperature, the
+    # temperature is clamped to the calibrated range.  Returns two (6, N)
+    # arrays.  Uses the lookup table when there is a current one.
+    def bias_scale(self, temp):
+        temp = np.clip(np.asarray(temp, dtype=np.float64), self.min_temp, self.max_temp)
+        if self.table_valid():
+            return table_lookup(self.table, temp)
+        values = polyval_rows(self.coeffs(), temp)
+        return values[:len(axes)], values[len(axes):]
+
+    # corrected copy of a columnar imu channel (the input is not changed)
+    def correct_columns(self, imu):
+        result = dict(imu)
+        bias, scale = self.bias_scale(imu['temp'])
+        for i, a in enumerate(axes):
+            result[a] = (np.asarray(imu[a]) - bias[i]) * scale[i]
+        if 'hx' in imu:
+            hf = mag_transform(self.mag_affine, imu)
+            result['hx'] = hf[:,0]
+            result['hy'] = hf[:,1]
+            result['hz'] = hf[:,2]
+        return result
+
+    # correct the IMU data given the current bias and scale errors.
+    # imu_data may be a columnar channel (dict of arrays) or a list of
+    # record dicts, it is updated in place and returned.
     def correct(self, imu_data):
-        imu_corrected = []
-        p_bias_func = np.poly1d(self.p_bias)
-        q_bias_func = np.poly1d(self.q_bias)
-        r_bias_func = np.poly1d(self.r_bias)
-        ax_bias_func = np.poly1d(self.ax_bias)
-        ay_bias_func = np.poly1d(self.ay_bias)
-        az_bias_func = np.poly1d(self.az_bias)
-        p_scale_func = np.poly1d(self.p_scale)
-        q_scale_func = np.poly1d(self.q_scale)
-        r_scale_func = np.poly1d(self.r_scale)
-        ax_scale_func = np.poly1d(self.ax_scale)
-        ay_scale_func = np.poly1d(self.ay_scale)
-        az_scale_func = np.poly1d(self.az_scale)
-        for imu in imu_data:
-            temp = imu.temp
-            if temp < self.min_temp:
-                temp = self.min_temp
-            if temp > self.max_temp:
-                temp = self.max_temp    
-            imu.p = (imu.p - p_bias_func(temp)) * p_scale_func(temp)
-            imu.q = (imu.q - q_bias_func(temp)) * q_scale_func(temp)
-            imu.r = (imu.r - r_bias_func(temp)) * r_scale_func(temp)
-            imu.ax = (imu.ax - ax_bias_func(temp)) * ax_scale_func(temp)
-            imu.ay = (imu.ay - ay_bias_func(temp)) * ay_scale_func(temp)
-            imu.az = (imu.az - az_bias_func(temp)) * az_scale_func(temp)
-            hs = [imu.hx, imu.hy, imu.hz, 1.0]
-            hf = np.dot(self.mag_affine, hs)
-            norm = np.linalg.norm(hf[:3])
-            #hf[:3] /= norm
-            imu.hx = hf[0]
-            imu.hy = hf[1]
-            imu.hz = hf[2]
-    
+        imu = as_columns(imu_data)
+        if not columnar.size(imu):
+            return imu_data
+        imu = self.correct_columns(imu)
+        return write_back(imu_data, imu, axes + mag_axes)
+
+    # streaming correction: take an iterator of imu chunks (columnar dicts
+    # of arrays, or lists of record dicts, e.g. from columnar.iter_chunks())
+    # and yield a corrected copy of each chunk in the same form.  The input
+    # chunks are never modified and only one chunk is held at a time.
+    # Builds the lookup table first if there isn't a current one.
+    def correct_stream(self, chunks):
+        if not self.table_valid():
+            self.build_table()
+        for chunk in chunks:
+            if isinstance(chunk, dict):
+                if columnar.size(chunk):
+                    chunk = self.correct_columns(chunk)
+                yield chunk
+            else:
+                records = [ dict(record) for record in chunk ]
+                yield self.correct(records)
+
     # back correct the IMU data given the current bias and scale errors
-    # (i.e. assuming corrected data, generate the raw values)
+    # (i.e. assuming corrected data, generate the raw values.)  imu_data
+    # and filter_data may be columnar channels or lists of record dicts,
+    # they are updated in place.
     def back_correct(self, imu_data, filter_data):
         if not self.valid:
             return
-        
-        p_bias_func = np.poly1d(self.p_bias)
-        q_bias_func = np.poly1d(self.q_bias)
-        r_bias_func = np.poly1d(self.r_bias)
-        ax_bias_func = np.poly1d(self.ax_bias)
-        ay_bias_func = np.poly1d(self.ay_bias)
-        az_bias_func = np.poly1d(self.az_bias)
-        p_scale_func = np.poly1d(self.p_scale)
-        q_scale_func = np.poly1d(self.q_scale)
-        r_scale_func = np.poly1d(self.r_scale)
-        ax_scale_func = np.poly1d(self.ax_scale)
-        ay_scale_func = np.poly1d(self.ay_scale)
-        az_scale_func = np.poly1d(self.az_scale)
+        imu = as_columns(imu_data)
+        if not columnar.size(imu):
+            return
+        temp = np.asarray(imu['temp'], dtype=np.float64)
+        bias, scale = self.bias_scale(temp)
+        result = {}
+        for i, a in enumerate(axes):
+            result[a] = np.asarray(imu[a]) / scale[i] + bias[i]
+        # note: corrected mags are currently being logged so don't
+        # back correct mags here... unless we are generating the
+        # calibration database files, then we do want to back correct
+        # the mags.
+        back_correct_mags = True
+        if back_correct_mags:
+            hf = mag_transform(self.mag_affine_inv, imu)
+            result['hx'] = hf[:,0]
+            result['hy'] = hf[:,1]
+            result['hz'] = hf[:,2]
+        write_back(imu_data, result, list(result.keys()))
 
-        for imu in imu_data:
-            temp = imu['temp']
-            if temp < self.min_temp:
-                temp = self.min_temp
-            if temp > self.max_temp:
-                temp = self.max_temp    
-            imu['p'] = imu['p'] / p_scale_func(temp) + p_bias_func(temp)
-            imu['q'] = imu['q'] / q_scale_func(temp) + q_bias_func(temp)
-            imu['r'] = imu['r'] / r_scale_func(temp) + r_bias_func(temp)
-            imu['ax'] = imu['ax'] / ax_scale_func(temp) + ax_bias_func(temp)
-            imu['ay'] = imu['ay'] / ay_scale_func(temp) + ay_bias_func(temp)
-            imu['az'] = imu['az'] / az_scale_func(temp) + az_bias_func(temp)
-            # note: corrected mags are currently being logged so don't
-            # back correct mags here... unless we are generating the
-            # calibration database files, then we do want to back correct
-            # the mags.
-            back_correct_mags = True
-            if back_correct_mags:
-                hs = [imu['hx'], imu['hy'], imu['hz'], 1.0]
-                hf = np.dot(self.mag_affine_inv, hs)
-                norm = np.linalg.norm(hf[:3])
-                # #hf[:3] /= norm
-                imu['hx'] = hf[0]
-                imu['hy'] = hf[1]
-                imu['hz'] = hf[2]
-                # print("bc mag:", hf)
-            else:
-                imu['hx'] = imu['hx']
-                imu['hy'] = imu['hy']
-                imu['hz'] = imu['hz']
-        
-        for filt in filter_data:
-            # onboard ekf and biases are computed with calibrated sensor
-            # data so also back-correct the biases.
-            filt['p_bias'] = filt['p_bias'] / p_scale_func(temp) + p_bias_func(temp)
-            filt['q_bias'] = filt['q_bias'] / q_scale_func(temp) + q_bias_func(temp)
-            filt['r_bias'] = filt['r_bias'] / r_scale_func(temp) + r_bias_func(temp)
-            filt['ax_bias'] = filt['ax_bias'] / ax_scale_func(temp) + ax_bias_func(temp)
-            filt['ay_bias'] = filt['ay_bias'] / ay_scale_func(temp) + ay_bias_func(temp)
-            filt['az_bias'] = filt['az_bias'] / az_scale_func(temp) + az_bias_func(temp)
+        # onboard ekf and biases are computed with calibrated sensor data
+        # so also back-correct the biases (at the imu temperature of each
+        # filter sample.)
+        filt = as_columns(filter_data)
+        if not columnar.size(filt):
+            return
+        imu_time = columnar.time_key(imu)
+        filt_time = columnar.time_key(filt)
+        if imu_time is not None and filt_time is not None:
+            filt_temp = np.interp(filt[filt_time], imu[imu_time], temp)
+        else:
+            filt_temp = np.full(columnar.size(filt), temp[-1])
+        bias, scale = self.bias_scale(filt_temp)
+        result = {}
+        for i, a in enumerate(axes):
+            key = a + '_bias'
+            result[key] = np.asarray(filt[key]) / scale[i] + bias[i]
+        write_back(filter_data, result, list(result.keys()))
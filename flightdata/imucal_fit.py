@@ -0,0 +1,285 @@
+# fit imu temperature vs. bias calibrations from the onboard filter
+#
+# The onboard filter continuously estimates the p, q, r, ax, ay, az sensor
+# biases.  Collected over many flights (at many temperatures) these
+# estimates give the bias vs. temperature curve of each axis.  Each flight
+# is reduced to per temperature bin sums (BiasBins) in a worker process,
+# the bins of all the flights are merged, and a weighted least squares
+# polynomial is fit to the bin means of all six axes at once.
+#
+#   cal = imucal_fit.fit_flights(paths, order=2, workers=8)
+#   imucal_fit.fit_mag_flights(paths, cal, workers=8)
+#   cal.save("imucal.json")
+#
+# The magnetometer calibration (mag_affine) is fit from the raw hx, hy, hz
+# samples, see fit_mag_affine().
+
+import functools
+
+import numpy as np
+
+from . import columnar
+from . import flight_loader
+from .imucal import Calibration, axes
+from .lazy_flight import LazyFlight
+
+# filter channel and imu temperature field names used by the formats
+filter_channels = ["filter", "nav"]
+temp_fields = ["temp", "temp_C"]
+
+# per temperature bin sample count and bias sums (bins are fixed
+# multiples of bin_size so results from different flights can be merged)
+class BiasBins():
+    def __init__(self, bin_size=0.5, min_temp=-40.0, max_temp=85.0):
+        self.bin_size = bin_size
+        self.min_temp = min_temp
+        self.n = int(np.ceil((max_temp - min_temp) / bin_size))
+        self.count = np.zeros(self.n)
+        self.sum = np.zeros( (self.n, len(axes)) )
+        self.sumsq = np.zeros( (self.n, len(axes)) )
+
+    # add samples: temp is (N,), biases is (N, 6)
+    def add(self, temp, biases):
+        index = np.floor((np.asarray(temp) - self.min_temp) / self.bin_size).astype(int)
+        valid = (index >= 0) & (index < self.n) & np.all(np.isfinite(biases), axis=1)
+        index = index[valid]
+        biases = biases[valid]
+        self.count += np.bincount(index, minlength=self.n)
+        for j in range(len(axes)):
+            self.sum[:,j] += np.bincount(index, biases[:,j], minlength=self.n)
+            self.sumsq[:,j] += np.bincount(index, biases[:,j]**2, minlength=self.n)
+
+    def merge(self, other):
+        self.count += other.count
+        self.sum += other.sum
+        self.sumsq += other.sumsq
+
+    # temperature at the center of each bin
+    def centers(self):
+        return self.min_temp + (np.arange(self.n) + 0.5) * self.bin_size
+
+    # fit a polynomial of the given order to the mean bias of every bin with
+    # at least min_count samples.  Each bin mean is weighted by the inverse
+    # of its standard error (per axis) and all six weighted least squares
+    # problems are solved together.  Returns a Calibration (unit scale)
+    # valid over the temperature range of the bins used.
+    def fit(self, order=2, min_count=100):
+        used = self.count >= max(min_count, 2)
+        if np.count_nonzero(used) < order + 1:
+            print("Not enough temperature bins for an order", order, "fit:",
+                  np.count_nonzero(used))
+            return None
+        count = self.count[used][:,np.newaxis]
+        mean = self.sum[used] / count
+        var = np.maximum(self.sumsq[used] / count - mean**2, 0.0)
+        stderr = np.sqrt(var / count)
+        # floor the error so a constant bin can't take all the weight
+        floor = np.maximum(np.median(stderr, axis=0), 1e-12)
+        w = 1.0 / np.maximum(stderr, floor)           # (bins, 6)
+        temp = self.centers()[used]
+        V = np.vander(temp, order + 1)                # (bins, order+1)
+        A = w.T[:,:,np.newaxis] * V                   # (6, bins, order+1)
+        b = (w * mean).T[:,:,np.newaxis]              # (6, bins, 1)
+        coeffs = (np.linalg.pinv(A) @ b)[:,:,0].T     # (order+1, 6)
+
+        cal = Calibration()
+        cal.valid = True
+        cal.min_temp = float(temp[0])
+        cal.max_temp = float(temp[-1])
+        unit = np.zeros(order + 1)
+        unit[-1] = 1.0
+        for j, a in enumerate(axes):
+            setattr(cal, a + '_bias', coeffs[:,j])
+            setattr(cal, a + '_scale', unit.copy())
+        return cal
+
+def get_channel(flight_data, names, fields):
+    for name in names:
+        if name in flight_data:
+            if isinstance(flight_data, LazyFlight):
+                return flight_data.channel(name, fields)
+            return flight_data[name]
+    return None
+
+# reduce one (columnar or lazy) flight to its BiasBins.  The first
+# settle_sec seconds of filter output are skipped while the bias estimates
+# converge.
+def flight_bins(flight_data, flight_format=None, bin_size=0.5, settle_sec=60.0):
+    bins = BiasBins(bin_size)
+    imu = get_channel(flight_data, ["imu"], temp_fields)
+    filt = get_channel(flight_data, filter_channels, [ a + '_bias' for a in axes ])
+    if imu is None or filt is None:
+        return bins
+    imu = columnar.flight_to_columns({"imu": imu})["imu"]
+    filt = columnar.flight_to_columns({"filter": filt})["filter"]
+    imu_time = columnar.time_key(imu)
+    filt_time = columnar.time_key(filt)
+    temp_key = None
+    for key in temp_fields:
+        if key in imu:
+            temp_key = key
+    if imu_time is None or filt_time is None or temp_key is None \
+       or not columnar.size(imu) or not columnar.size(filt) \
+       or not all([ a + '_bias' in filt for a in axes ]):
+        return bins
+    t = np.asarray(filt[filt_time], dtype=np.float64)
+    keep = t >= t[0] + settle_sec
+    temp = np.interp(t[keep], imu[imu_time], imu[temp_key])
+    biases = np.column_stack([ np.asarray(filt[a + '_bias'])[keep] for a in axes ])
+    bins.add(temp, biases)
+    return bins
+
+# accumulate the temperature bins of many flights in parallel (see
+# flight_loader.load_many()), flights that fail to load are reported and
+# skipped
+def collect_bins(paths, workers=None, bin_size=0.5, settle_sec=60.0,
+                 cache=None):
+    bins = BiasBins(bin_size)
+    apply = functools.partial(flight_bins, bin_size=bin_size, settle_sec=settle_sec)
+    for path, result, flight_format, error in \
+        flight_loader.load_many(paths, workers=workers, cache=cache, apply=apply):
+        if error is not None:
+            print("Skipping:", path, error.strip().splitlines()[-1])
+        elif flight_format is not None:
+            print("Binned:", path, int(result.count.sum()), "samples")
+            bins.merge(result)
+    return bins
+
+# fit a temperature calibration from the filter bias estimates of many
+# flights, returns a Calibration (or None if there isn't enough data)
+def fit_flights(paths, order=2, workers=None, bin_size=0.5, min_count=100,
+                settle_sec=60.0, cache=None):
+    bins = collect_bins(paths, workers, bin_size, settle_sec, cache)
+    return bins.fit(order, min_count)
+
+# magnetometer calibration: fit the ellipsoid traced by the raw hx, hy, hz
+# samples and find the 4x4 affine transform (mag_affine) that maps it onto
+# the unit sphere: [h_cal, 1] = mag_affine @ [h_raw, 1]
+
+# keep at most per_bin samples in each direction bin (directions from
+# center, az_bins x el_bins grid) so long stretches of straight and level
+# flight don't outweigh the rest of the sphere.  Returns sample indices.
+def mag_subsample(h, center, per_bin=20, az_bins=36, el_bins=18, seed=0):
+    d = h - center
+    az = np.arctan2(d[:,1], d[:,0])
+    el = np.arctan2(d[:,2], np.hypot(d[:,0], d[:,1]))
+    i = np.minimum(((az + np.pi) / (2*np.pi) * az_bins).astype(int), az_bins - 1)
+    j = np.minimum(((el + 0.5*np.pi) / np.pi * el_bins).astype(int), el_bins - 1)
+    cell = i * el_bins + j
+    # random order within each cell: shuffle, then stable sort by cell
+    order = np.random.default_rng(seed).permutation(len(cell))
+    order = order[np.argsort(cell[order], kind="stable")]
+    sorted_cells = cell[order]
+    first = np.searchsorted(sorted_cells, sorted_cells, side="left")
+    rank = np.arange(len(order)) - first
+    return np.sort(order[rank < per_bin])
+
+# least squares fit of a general ellipsoid to (N, 3) points.  Returns the
+# 4x4 affine mapping the ellipsoid to the unit sphere, or None if the
+# points don't describe an ellipsoid.
+def ellipsoid_affine(h, w=None):
+    x = h[:,0]
+    y = h[:,1]
+    z = h[:,2]
+    # a x^2 + b y^2 + c z^2 + 2d xy + 2e xz + 2f yz + 2g x + 2h y + 2i z = 1
+    D = np.column_stack( (x*x, y*y, z*z, 2*x*y, 2*x*z, 2*y*z, 2*x, 2*y, 2*z) )
+    rhs = np.ones(len(x))
+    if w is not None:
+        D = D * w[:,np.newaxis]
+        rhs = rhs * w
+    v = np.linalg.lstsq(D, rhs, rcond=None)[0]
+    Q = np.array( [[v[0], v[3], v[4]],
+                   [v[3], v[1], v[5]],
+                   [v[4], v[5], v[2]]] )
+    try:
+        center = -np.linalg.solve(Q, v[6:9])
+    except np.linalg.LinAlgError:
+        return None
+    k = 1.0 + center @ Q @ center
+    evals, evecs = np.linalg.eigh(Q / k)
+    if np.any(evals <= 0):
+        return None
+    M = evecs @ np.diag(np.sqrt(evals)) @ evecs.T
+    affine = np.identity(4)
+    affine[:3,:3] = M
+    affine[:3,3] = -M @ center
+    return affine
+
+# robust ellipsoid fit: outliers (calibrated field magnitude more than
+# threshold median absolute deviations away from 1) are dropped and the fit
+# repeated.  h is (N, 3).  Returns the 4x4 affine or None.
+def fit_mag_affine(h, iterations=5, threshold=4.0, per_bin=20):
+    h = np.asarray(h, dtype=np.float64)
+    h = h[np.all(np.isfinite(h), axis=1)]
+    if len(h) < 9:
+        print("Not enough magnetometer samples:", len(h))
+        return None
+    lo, hi = np.percentile(h, [1, 99], axis=0)
+    h = h[mag_subsample(h, 0.5 * (lo + hi), per_bin)]
+    keep = np.ones(len(h), dtype=bool)
+    affine = None
+    for i in range(iterations):
+        affine = ellipsoid_affine(h[keep])
+        if affine is None:
+            print("Magnetometer data doesn't fit an ellipsoid (not enough attitude coverage?)")
+            return None
+        norm = np.linalg.norm(h @ affine[:3,:3].T + affine[:3,3], axis=1)
+        err = np.abs(norm - 1.0)
+        mad = 1.4826 * np.median(err[keep]) + 1e-9
+        new_keep = err < threshold * mad
+        if np.array_equal(new_keep, keep):
+            break
+        keep = new_keep
+    print("Magnetometer fit: %d samples, %d outliers, residual %.4f" %
+          (len(h), np.count_nonzero(~keep), np.std(norm[keep] - 1.0)))
+    return affine
+
+# the raw magnetometer columns of an imu channel as an (N, 3) array (the
+# *_raw fields when present and raw is set)
+def mag_columns(imu, raw=True):
+    names = ["hx", "hy", "hz"]
+    if raw and all([ n + "_raw" in imu for n in names ]):
+        names = [ n + "_raw" for n in names ]
+    return np.column_stack([ np.asarray(imu[n], dtype=np.float64) for n in names ])
+
+# one flight's direction binned magnetometer samples (load_many apply
+# function)
+def flight_mag_samples(flight_data, flight_format=None, raw=True, per_bin=20):
+    imu = get_channel(flight_data, ["imu"], ["hx", "hy", "hz", "hx_raw", "hy_raw", "hz_raw"])
+    if imu is None:
+        return np.zeros( (0, 3) )
+    imu = columnar.flight_to_columns({"imu": imu})["imu"]
+    if not columnar.size(imu) or not "hx" in imu:
+        return np.zeros( (0, 3) )
+    h = mag_columns(imu, raw)
+    h = h[np.all(np.isfinite(h), axis=1)]
+    if len(h) < 9:
+        return h
+    lo, hi = np.percentile(h, [1, 99], axis=0)
+    return h[mag_subsample(h, 0.5 * (lo + hi), per_bin)]
+
+# fit mag_affine from the magnetometer data of one or more flights
+# (loaded in parallel.)  Updates and returns cal (a new Calibration if not
+# given) or returns None if the fit fails.
+def fit_mag_flights(paths, cal=None, workers=None, raw=True, per_bin=20,
+                    cache=None):
+    apply = functools.partial(flight_mag_samples, raw=raw, per_bin=per_bin)
+    samples = []
+    for path, result, flight_format, error in \
+        flight_loader.load_many(paths, workers=workers, cache=cache, apply=apply):
+        if error is not None:
+            print("Skipping:", path, error.strip().splitlines()[-1])
+        elif flight_format is not None:
+            samples.append(result)
+    if not len(samples):
+        return None
+    # the combined samples are binned again in fit_mag_affine()
+    affine = fit_mag_affine(np.concatenate(samples), per_bin=per_bin * len(samples))
+    if affine is None:
+        return None
+    if cal is None:
+        cal = Calibration()
+    cal.valid = True
+    cal.mag_affine = affine
+    cal.mag_affine_inv = np.linalg.inv(affine)
+    return cal
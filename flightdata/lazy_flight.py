@@ -0,0 +1,126 @@
+# lazy, on-demand channel loading from hdf5 flight logs
+#
+# A LazyFlight keeps the h5py.File open and only reads a channel (and only
+# the requested fields of it when the format supports that) the first time
+# it is accessed.  It behaves like the (read only) flight data dict returned
+# by flight_loader.load() so most scripts can use it unchanged:
+#
+#   with flight_loader.load(path, lazy=True)[0] as data:
+#       nav = data["nav"]
+#       gps = data.channel("gps", ["timestamp", "latitude_deg", "longitude_deg"])
+
+import h5py
+
+from . import columnar
+
+# adapt a loader function that always reads a whole channel,
+# fn(data, time_range), to the fn(data, fields, time_range) form used by
+# LazyFlight
+def whole_channel(fn):
+    def load_channel(data, fields=None, time_range=None):
+        return fn(data, time_range=time_range)
+    return load_channel
+
+class LazyFlight():
+    # channels(data) must return a dict of channel name ->
+    # fn(data, fields, time_range) for the channels present in the file.
+    # time_range = (t0, t1) restricts every channel to that time window.
+    def __init__(self, h5_filename, channels, layout="records",
+                 time_range=None):
+        self.filename = h5_filename
+        self.layout = layout
+        self.time_range = time_range
+        self.data = h5py.File(h5_filename, "r")
+        self.loaders = channels(self.data)
+        self.columns = {}       # fields loaded so far, per channel
+        self.complete = {}      # true when every field of a channel is loaded
+        self.records = {}       # converted records, per channel and fields
+
+    def keys(self):
+        return self.loaders.keys()
+
+    def __contains__(self, key):
+        return key in self.loaders
+
+    def __iter__(self):
+        return iter(self.loaders)
+
+    def __len__(self):
+        return len(self.loaders)
+
+    def __getitem__(self, key):
+        return self.channel(key)
+
+    def items(self):
+        for key in self.loaders:
+            yield key, self.channel(key)
+
+    # return a channel, reading it from the file if needed.  If fields is
+    # given only those fields (plus the time field) are returned.
+    def channel(self, key, fields=None):
+        if not key in self.loaders:
+            raise KeyError(key)
+        if self.data is None:
+            raise ValueError("flight file is closed: " + self.filename)
+        cached = self.columns.get(key, {})
+        before = cached
+        if self.complete.get(key, False):
+            pass
+        elif fields is None:
+            cached = self.loaders[key](self.data, None, self.time_range)
+            self.complete[key] = True
+        else:
+            missing = [ f for f in fields if not f in cached ]
+            if len(missing):
+                subdata = self.loaders[key](self.data, missing, self.time_range)
+                if len(cached) and len(subdata) and columnar.size(subdata) != columnar.size(cached):
+                    # shouldn't happen, but never mix misaligned arrays
+                    cached = {}
+                cached = dict(cached, **subdata)
+        self.columns[key] = cached
+        if cached is not before:
+            # the channel columns changed, drop its stale records
+            self.records.pop(key, None)
+
+        if fields is None:
+            result = cached
+        else:
+            result = {}
+            tkey = columnar.time_key(cached)
+            if tkey is not None:
+                result[tkey] = cached[tkey]
+            for f in fields:
+                if f in cached:
+                    result[f] = cached[f]
+        if self.layout == "columnar":
+            return result
+        records = self.records.setdefault(key, {})
+        rkey = None if fields is None else tuple(fields)
+        if not rkey in records:
+            records[rkey] = columnar.columns_to_records(result)
+        return records[rkey]
+
+    # read every remaining channel and return a plain flight data dict
+    def load_all(self):
+        result = {}
+        for key in self.loaders:
+            result[key] = self.channel(key)
+        return result
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
@@ -0,0 +1,139 @@
+# ardupilot binary dataflash reader, checked against the text log reader
+# on the same synthetic flight
+
+import struct
+
+import numpy as np
+import pytest
+
+from flightdata import formats
+from flightdata.formats import ardupilot_bin
+from flightdata.formats import ardupilot_log
+
+# struct code of the dataflash field formats used below
+struct_codes = { "Q": "Q", "f": "f", "B": "B", "H": "H", "I": "I",
+                 "L": "i", "c": "h", "n": "4s", "N": "16s", "Z": "64s",
+                 "g": "e" }
+
+# (type id, name, format, columns)
+message_types = [
+    (130, "IMU2", "Qffffffff", ["TimeUS", "GyrX", "GyrY", "GyrZ", "AccX", "AccY", "AccZ", "EG", "T"]),
+    (131, "MAG2", "Qfff", ["TimeUS", "MagX", "MagY", "MagZ"]),
+    (132, "GPS", "QBIHBfLLffff", ["TimeUS", "Status", "GMS", "GWk", "NSats", "HDop", "Lat", "Lng", "Alt", "Spd", "GCrs", "VZ"]),
+    (133, "ATT", "Qcccc", ["TimeUS", "DesRoll", "Roll", "DesPitch", "Pitch"]),
+]
+
+# message types the reader can't decode (half float, duplicate column
+# names): they must not take their neighbours down with them
+odd_types = [
+    (140, "HALF", "Qg", ["TimeUS", "Val"]),
+    (141, "DUPL", "Qff", ["TimeUS", "A", "A"]),
+]
+
+def payload_size(fmt):
+    return struct.calcsize("<" + "".join([ struct_codes[c] for c in fmt ]))
+
+def fmt_message(type_id, name, fmt, columns):
+    return b"\xa3\x95\x80" + struct.pack("<BB4s16s64s", type_id,
+                                         3 + payload_size(fmt), name.encode(),
+                                         fmt.encode(), ",".join(columns).encode())
+
+def message(type_id, fmt, values):
+    return b"\xa3\x95" + bytes([type_id]) \
+        + struct.pack("<" + "".join([ struct_codes[c] for c in fmt ]), *values)
+
+# the raw field values and their text log representation
+def text_value(c, value):
+    if c == "L":
+        return "%.7f" % (value * 1e-7)
+    elif c == "c":
+        return "%.2f" % (value * 0.01)
+    return repr(value)
+
+# write the same flight as a dataflash .bin and as a text .log
+@pytest.fixture
+def flight(tmp_path):
+    binary = bytearray(fmt_message(128, "FMT", "BBnNZ", ["Type", "Length", "Name", "Format", "Columns"]))
+    lines = [ "FMT, 128, 89, FMT, BBnNZ, Type,Length,Name,Format,Columns" ]
+    for type_id, name, fmt, columns in message_types + odd_types:
+        binary += fmt_message(type_id, name, fmt, columns)
+        if (type_id, name, fmt, columns) in message_types:
+            lines.append("FMT, %d, %d, %s, %s, %s" % (type_id, 3 + payload_size(fmt),
+                                                       name, fmt, ",".join(columns)))
+    rng = np.random.default_rng(0)
+    for i in range(400):
+        time_us = 1000000 + i * 10000
+        rows = [ (130, [ time_us ] + [ float(v) for v in np.round(rng.normal(0, 2, 8) * 64) / 64 ]) ]
+        if i % 2 == 0:
+            rows.append( (131, [ time_us + 1 ] + [ float(v) for v in np.round(rng.normal(0, 200, 3)) ]) )
+        if i % 4 == 0:
+            rows.append( (133, [ time_us + 2 ] + [ int(v) for v in rng.integers(-9000, 9000, 4) ]) )
+        if i % 20 == 0:
+            rows.append( (132, [ time_us + 3, 3, i * 200, 2200, 6 + i % 4, 0.75,
+                                 449812345 + i * 10, -932712345 - i * 10, 250.5,
+                                 17.25, 45.5, -0.5 ]) )
+        for type_id, values in rows:
+            type_id, name, fmt, columns = [ t for t in message_types if t[0] == type_id ][0]
+            binary += message(type_id, fmt, values)
+            lines.append(name + ", " + ", ".join([ text_value(c, v) for c, v in zip(fmt, values) ]))
+        if i == 100:
+            binary += message(140, "Qg", [ time_us, 1.5 ])
+            binary += message(141, "Qff", [ time_us, 1.0, 2.0 ])
+        if i == 200:
+            # corrupt byte run starting with a fake sync
+            binary += b"\xa3\x95\x82\x00\xff\xff\x13"
+    # trailing partial message
+    binary += message(130, "Qffffffff", [ 9000000 ] + [ 0.0 ] * 8)[:12]
+
+    bin_file = tmp_path / "flight.bin"
+    bin_file.write_bytes(bytes(binary))
+    log_file = tmp_path / "flight.log"
+    log_file.write_text("\n".join(lines) + "\n")
+    return str(bin_file), str(log_file)
+
+def assert_channels_equal(a, b):
+    assert sorted(a.keys()) == sorted(b.keys())
+    for key in a:
+        assert sorted(a[key].keys()) == sorted(b[key].keys()), key
+        for field in a[key]:
+            np.testing.assert_allclose(np.asarray(a[key][field], dtype=float),
+                                       np.asarray(b[key][field], dtype=float),
+                                       rtol=1e-12, atol=1e-9, err_msg=key + " " + field)
+
+def test_read_messages_matches_text(flight):
+    bin_file, log_file = flight
+    names = [ t[1] for t in message_types ]
+    msgs = ardupilot_bin.read_messages(bin_file, names)
+    text = ardupilot_log.read_messages(log_file, names)
+    assert sorted(msgs.keys()) == sorted(names)
+    assert len(msgs["IMU2"]["TimeUS"]) == 400
+    assert_channels_equal(msgs, text)
+
+def test_undecodable_types_keep_neighbours(flight):
+    bin_file, log_file = flight
+    msgs = ardupilot_bin.read_messages(bin_file)
+    assert not "DUPL" in msgs
+    np.testing.assert_array_equal(msgs["HALF"]["Val"], [ 1.5 ])
+    # the IMU2 message written just before the undecodable records
+    assert 1000000 + 100 * 10000 in msgs["IMU2"]["TimeUS"]
+
+def test_load_matches_text(flight):
+    bin_file, log_file = flight
+    assert_channels_equal(ardupilot_bin.load_columns(bin_file),
+                          ardupilot_log.load_columns(log_file))
+    records = ardupilot_bin.load(bin_file)
+    assert records["imu"] == ardupilot_log.load(log_file)["imu"]
+
+def test_time_range(flight):
+    bin_file, log_file = flight
+    time_range = (1.5, 3.0)
+    data = ardupilot_bin.load_columns(bin_file, time_range)
+    assert_channels_equal(data, ardupilot_log.load_columns(log_file, time_range))
+    assert data["imu"]["time"].min() >= 1.5
+    assert data["imu"]["time"].max() <= 3.0
+
+def test_sniff(flight):
+    bin_file, log_file = flight
+    fmt, load_path = formats.detect(bin_file)
+    assert fmt["name"] == "ardupilot_bin"
+    assert load_path == bin_file
@@ -0,0 +1,49 @@
+# flight cache eviction and load_many() with a size limited cache
+
+import numpy as np
+
+from flightdata import flight_cache
+from flightdata import flight_loader
+from flightdata.formats import ardupilot_bin
+from flightdata.formats import px4_ulog
+
+def write_log(path):
+    lines = [ "FMT, 128, 89, FMT, BBnNZ, Type,Length,Name,Format,Columns",
+              "FMT, 130, 43, IMU2, Qffffffff, TimeUS,GyrX,GyrY,GyrZ,AccX,AccY,AccZ,EG,T",
+              "FMT, 131, 19, MAG2, Qfff, TimeUS,MagX,MagY,MagZ" ]
+    for i in range(50):
+        lines.append("IMU2, %d, 0.1, 0.2, 0.3, 0.0, 0.0, -9.8, 0, 25" % (1000000 + i * 10000))
+        lines.append("MAG2, %d, 100, 200, 300" % (1000000 + i * 10000 + 1))
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+def test_put_keeps_entry_larger_than_cache(tmp_path):
+    cache = flight_cache.FlightCache(str(tmp_path / "cache"), max_bytes=10)
+    log = write_log(tmp_path / "a.log")
+    cache.put(log, { "imu": { "time": np.arange(100.0) } }, "ardupilot_log",
+              "flightdata.formats.ardupilot_log")
+    flight_data, flight_format = cache.get(log)
+    assert flight_format == "ardupilot_log"
+    assert len(flight_data["imu"]["time"]) == 100
+
+def test_load_many_with_tiny_cache(tmp_path):
+    cache = flight_cache.FlightCache(str(tmp_path / "cache"), max_bytes=10)
+    logs = [ write_log(tmp_path / ("%d.log" % i)) for i in range(3) ]
+    for workers in [1, 2]:
+        results = list(flight_loader.load_many(logs, workers=workers,
+                                               layout="columnar", cache=cache))
+        assert len(results) == 3
+        for path, flight_data, flight_format, error in results:
+            assert error is None
+            assert len(flight_data["imu"]["time"]) == 50
+
+def test_loader_version_covers_dependencies():
+    deps = flight_cache.module_dependencies(ardupilot_bin)
+    for name in ["flightdata.columnar", "flightdata.formats.ardupilot_log",
+                 "flightdata.formats.ardupilot_bin"]:
+        assert name in deps
+    deps = flight_cache.module_dependencies(px4_ulog)
+    for name in ["flightdata.formats.ulog_reader", "flightdata.formats.quaternion"]:
+        assert name in deps
+    # the formats registry package doesn't drag in every format
+    assert not "flightdata.formats.aura_csv" in deps
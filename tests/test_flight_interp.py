@@ -0,0 +1,73 @@
+# circular interpolation helpers and IterateGroup replay
+
+import numpy as np
+
+from flightdata import flight_interp
+
+def test_unwrap():
+    y = np.array([ 350.0, 355.0, 5.0, 10.0, 0.0, 340.0 ])
+    np.testing.assert_allclose(flight_interp.unwrap(y, 360),
+                               [ 350, 355, 365, 370, 360, 340 ])
+
+def test_unwrap_keeps_nan_in_place():
+    y = np.array([ 350.0, np.nan, 5.0, np.inf, 10.0, np.nan ])
+    result = flight_interp.unwrap(y, 360)
+    np.testing.assert_allclose(result[[0, 2, 4]], [ 350, 365, 370 ])
+    assert np.isnan(result[1]) and np.isnan(result[5])
+    assert result[3] == np.inf
+    # the input is left alone
+    assert y[2] == 5.0
+
+# the original counter walk of IterateGroup.next()
+def baseline_next(data, counter):
+    result = {}
+    i = counter["imu"]
+    if i < len(data["imu"]):
+        t = data["imu"][i]["timestamp"]
+        result["imu"] = data["imu"][i]
+        counter["imu"] += 1
+        for key in data:
+            if key != "imu":
+                i = counter[key]
+                while i < len(data[key]):
+                    d = data[key][i]
+                    if d["timestamp"] <= t:
+                        result[key] = d
+                        counter[key] += 1
+                        i = counter[key]
+                        if d["timestamp"] == t:
+                            break
+                    else:
+                        break
+    return result
+
+def baseline_replay(data):
+    counter = { key: 0 for key in data }
+    return [ baseline_next(data, counter) for i in range(len(data["imu"]) + 1) ]
+
+def replay(data):
+    group = flight_interp.IterateGroup(data)
+    return [ group.next() for i in range(group.size() + 1) ]
+
+def test_next_duplicate_time_stamps():
+    data = { "imu": [ { "timestamp": 1.0 }, { "timestamp": 2.0 } ],
+             "gps": [ { "timestamp": 1.0, "n": 0 }, { "timestamp": 1.0, "n": 1 } ] }
+    result = replay(data)
+    assert result == baseline_replay(data)
+    assert result[0]["gps"]["n"] == 0
+    assert result[1]["gps"]["n"] == 1
+
+def test_next_matches_baseline():
+    rng = np.random.default_rng(1)
+    # coarse time stamps so that every channel has plenty of ties, with
+    # each other and with the imu (which repeats time stamps too)
+    data = {}
+    for key, n in [ ("imu", 300), ("gps", 80), ("air", 400), ("filter", 5) ]:
+        t = np.sort(rng.integers(0, 100, n)) * 0.1
+        data[key] = [ { "timestamp": float(x), "n": j } for j, x in enumerate(t) ]
+    result = replay(data)
+    assert result == baseline_replay(data)
+    # ticks() and state() agree with next()
+    group = flight_interp.IterateGroup(data)
+    assert list(group.ticks()) == result[:-1]
+    assert [ group.state(k, hold=False) for k in range(group.size()) ] == result[:-1]
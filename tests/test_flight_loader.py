@@ -0,0 +1,42 @@
+# load_many() failures are reported per flight
+
+import os
+import threading
+
+from flightdata import flight_loader
+
+def write_log(path):
+    lines = [ "FMT, 128, 89, FMT, BBnNZ, Type,Length,Name,Format,Columns",
+              "FMT, 130, 43, IMU2, Qffffffff, TimeUS,GyrX,GyrY,GyrZ,AccX,AccY,AccZ,EG,T",
+              "FMT, 131, 19, MAG2, Qfff, TimeUS,MagX,MagY,MagZ" ]
+    for i in range(20):
+        lines.append("IMU2, %d, 0.1, 0.2, 0.3, 0.0, 0.0, -9.8, 0, 25" % (1000000 + i * 10000))
+        lines.append("MAG2, %d, 100, 200, 300" % (1000000 + i * 10000 + 1))
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+def count_imu(flight_data, flight_format):
+    return len(flight_data["imu"]["time"])
+
+# the result can't be pickled back to the parent
+def unpicklable(flight_data, flight_format):
+    return threading.Lock()
+
+def crash(flight_data, flight_format):
+    os._exit(1)
+
+def test_unpicklable_result(tmp_path):
+    logs = [ write_log(tmp_path / ("%d.log" % i)) for i in range(3) ]
+    results = list(flight_loader.load_many(logs, workers=2, apply=unpicklable))
+    assert sorted([ r[0] for r in results ]) == sorted(logs)
+    for path, flight_data, flight_format, error in results:
+        assert flight_data is None and error is not None
+
+def test_worker_crash(tmp_path):
+    logs = [ write_log(tmp_path / ("%d.log" % i)) for i in range(3) ]
+    results = list(flight_loader.load_many(logs, workers=2, apply=crash))
+    assert sorted([ r[0] for r in results ]) == sorted(logs)
+    for path, flight_data, flight_format, error in results:
+        assert flight_data is None and "BrokenProcessPool" in error
+    results = list(flight_loader.load_many(logs, workers=2, apply=count_imu))
+    assert [ r[1] for r in results ] == [ 20, 20, 20 ]
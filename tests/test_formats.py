@@ -0,0 +1,47 @@
+# format sniffing
+
+import pickle
+
+import h5py
+
+from flightdata import formats
+
+def write_h5(path, md_format=None, groups=[]):
+    with h5py.File(path, "w") as f:
+        if md_format is not None:
+            f.create_group("metadata").attrs["format"] = md_format
+        for group in groups:
+            f.create_group(group)
+
+def test_aura_directory_without_metadata(tmp_path):
+    write_h5(tmp_path / "flight.h5", groups=["sensors"])
+    fmt, load_path = formats.detect(str(tmp_path))
+    assert fmt["name"] == "aura_hdf5"
+    assert load_path == str(tmp_path / "flight.h5")
+
+def test_hdf5_files(tmp_path):
+    for md_format, groups, name in [ ("AuraUAS", [], "aura_hdf5"),
+                                     ("NorthStarUAS", [], "nst_hdf5"),
+                                     (None, ["Sensors"], "umn3") ]:
+        path = str(tmp_path / ("%s.h5" % name))
+        write_h5(path, md_format, groups)
+        fmt, load_path = formats.detect(path)
+        assert fmt["name"] == name
+    # a umn3 file in a flight directory isn't taken for an aura flight
+    flight_dir = tmp_path / "umn3_flight"
+    flight_dir.mkdir()
+    write_h5(flight_dir / "flight.h5", groups=["Sensors"])
+    fmt, load_path = formats.detect(str(flight_dir))
+    assert fmt is None or fmt["name"] != "aura_hdf5"
+
+def test_cirrus_pickle_protocols(tmp_path):
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        path = str(tmp_path / ("%d.pkl" % protocol))
+        with open(path, "wb") as f:
+            pickle.dump({ "imu": [] }, f, protocol=protocol)
+        fmt, load_path = formats.detect(path)
+        assert fmt["name"] == "cirrus_pkl", protocol
+    path = tmp_path / "text.pkl"
+    path.write_text("not a pickle\n")
+    fmt, load_path = formats.detect(str(path))
+    assert fmt is None or fmt["name"] != "cirrus_pkl"
@@ -0,0 +1,33 @@
+# lazy hdf5 channel loading
+
+import h5py
+import numpy as np
+
+from flightdata.lazy_flight import LazyFlight
+
+def channels(data):
+    def load_imu(data, fields=None, time_range=None):
+        if fields is None:
+            fields = list(data["imu"].keys())
+        result = { "timestamp": data["imu"]["timestamp"][()] }
+        for f in fields:
+            result[f] = data["imu"][f][()]
+        return result
+    return { "imu": load_imu }
+
+def test_records_are_converted_once(tmp_path):
+    h5_file = str(tmp_path / "flight.h5")
+    with h5py.File(h5_file, "w") as f:
+        f["imu/timestamp"] = np.arange(5.0)
+        f["imu/p_rps"] = np.arange(5.0) * 0.1
+        f["imu/q_rps"] = np.arange(5.0) * 0.2
+    with LazyFlight(h5_file, channels) as data:
+        p = data.channel("imu", ["p_rps"])
+        assert data.channel("imu", ["p_rps"]) is p
+        assert not "q_rps" in p[0]
+        # loading more fields refreshes the records
+        pq = data.channel("imu", ["p_rps", "q_rps"])
+        assert pq[4]["q_rps"] == 0.8
+        imu = data["imu"]
+        assert data["imu"] is imu
+        assert len(imu) == 5 and imu[2]["p_rps"] == 0.2
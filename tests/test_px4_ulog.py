@@ -0,0 +1,17 @@
+# px4 ulog loader
+
+import struct
+
+from flightdata.formats import px4_ulog
+from flightdata.formats.ulog_reader import ulog_magic
+
+def test_missing_channels_are_independent(tmp_path):
+    # a ulog file with only the header: every channel is missing
+    path = tmp_path / "empty.ulg"
+    path.write_bytes(ulog_magic + b"\x00" + struct.pack("<Q", 0))
+    data = px4_ulog.load_columns(str(path))
+    assert len(data["imu"]["timestamp"]) == 0
+    data["imu"]["temp_C"] = [ 15.0 ]
+    for key in data:
+        if key != "imu":
+            assert not "temp_C" in data[key]
@@ -0,0 +1,49 @@
+# vectorized quaternion / euler kernels against the per sample scalar code
+# the px4 loaders used before
+
+import math
+
+import numpy as np
+
+from flightdata.formats import quaternion
+
+def scalar_quat2euler(q):
+    norm = math.sqrt(q[0]*q[0] + q[1]*q[1] + q[2]*q[2] + q[3]*q[3])
+    if norm > 0.000001:
+        for i in range(4):
+            q[i] /= norm
+    phi = math.atan2(2.0 * (q[0] * q[1] + q[2] * q[3]),
+                     1.0 - 2.0 * (q[1] * q[1] + q[2] * q[2]))
+    the = math.asin(2.0 * (q[0] * q[2] - q[3] * q[1]))
+    psi = math.atan2(2.0 * (q[0] * q[3] + q[1] * q[2]),
+                     1.0 - 2.0 * (q[2] * q[2] + q[3] * q[3]))
+    return (phi, the, psi)
+
+def random_euler(n):
+    rng = np.random.default_rng(0)
+    return [ rng.uniform(-math.pi, math.pi, n),
+             rng.uniform(-0.49 * math.pi, 0.49 * math.pi, n),
+             rng.uniform(-math.pi, math.pi, n) ]
+
+def test_quat2euler_matches_scalar():
+    n = 2000
+    rng = np.random.default_rng(1)
+    q = quaternion.euler2quat(*random_euler(n)) * rng.uniform(0.5, 2.0, n)[:,None]
+    scalar = np.array([ scalar_quat2euler(row) for row in q.tolist() ])
+    vector = np.column_stack(quaternion.quat2euler(q))
+    np.testing.assert_allclose(vector, scalar, rtol=0, atol=1e-12)
+    # a single quaternion gives scalars, the input is left alone
+    q0 = q[0].copy()
+    phi, the, psi = quaternion.quat2euler(q[0])
+    np.testing.assert_allclose([phi, the, psi], scalar[0], rtol=0, atol=1e-12)
+    np.testing.assert_array_equal(q[0], q0)
+
+def test_euler2quat_round_trip():
+    euler = np.column_stack(random_euler(2000))
+    result = np.column_stack(quaternion.quat2euler(quaternion.euler2quat(*euler.T)))
+    np.testing.assert_allclose(result, euler, rtol=0, atol=1e-9)
+
+def test_psixy():
+    psix, psiy = quaternion.psixy(np.array([ 0.0, 0.5 * math.pi ]))
+    np.testing.assert_allclose(psix, [ 1.0, 0.0 ], atol=1e-15)
+    np.testing.assert_allclose(psiy, [ 0.0, 1.0 ], atol=1e-15)